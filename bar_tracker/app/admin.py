@@ -1,7 +1,18 @@
 from django.contrib import admin
-from .models import Bar, OccupancyReport, UserProfile, SiteStatistics
+from .models import (
+    Bar,
+    ForecastFit,
+    OccupancyReport,
+    UserProfile,
+    SiteStatistics,
+    HourlyBarReport,
+)
+from .caching import invalidate_bars_payload
+from .geo import invalidate_bar_locations
 
 admin.site.register(OccupancyReport)
+admin.site.register(HourlyBarReport)
+admin.site.register(ForecastFit)
 
 
 @admin.register(UserProfile)
@@ -11,6 +22,7 @@ class UserProfileAdmin(admin.ModelAdmin):
         "email",
         "is_near_bar",
         "strikes",
+        "trust_weight",
         "submissions",
         "last_updated_location",
     )
@@ -30,10 +42,14 @@ class BarAdmin(admin.ModelAdmin):
     @admin.action(description="Activate selected bars")
     def activate_bars(self, request, queryset):
         queryset.update(is_active=True)
+        invalidate_bars_payload()
+        invalidate_bar_locations()
 
     @admin.action(description="Deactivate selected bars")
     def deactivate_bars(self, request, queryset):
         queryset.update(is_active=False)
+        invalidate_bars_payload()
+        invalidate_bar_locations()
 
 
 @admin.register(SiteStatistics)
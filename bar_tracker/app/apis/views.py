@@ -1,30 +1,49 @@
 from django.shortcuts import get_object_or_404
 from app.models import Bar, OccupancyReport, UserProfile
 from app.weather_models import CurrentWeather
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.utils.timezone import now
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework import permissions
-from app.serializers import UpdateEmailSerializer
+from app.serializers import (
+    UpdateEmailSerializer,
+    OccupancySubmissionSerializer,
+    OccupancyBatchSerializer,
+)
 from rest_framework.permissions import AllowAny
 from rest_framework.decorators import (
     api_view,
     permission_classes,
     authentication_classes,
 )
-from rest_framework.permissions import IsAuthenticated
 from app.permissions import ValidTokenPermission
+from app.authentication import async_token_permission, async_token_required
+from app.caching import aget_bars_entry, bars_etag, get_bars_delta
+from app.encoding import negotiate_encoding, negotiate_format
+from app.live import current_cursor, merge_changes, read_changes, sse_events
+from app.forecast import get_forecaster
+from app.geo import resolve_nearest_bar
+from app.pipeline import enqueue_reports
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from app.utils import (
-    flag_fraudulent_entries,
-    handle_user_strikes,
-    verify_cooldown,
-    calculate_displayed_values,
-    get_user_from_request,
+    claim_cooldown,
+    release_cooldown,
+    split_by_cooldown,
+    transition_user_location,
+    get_report_page,
 )
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+import json
 import logging
+import math
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
@@ -64,17 +83,19 @@ def register_user(request):
     )
 
 
-@api_view(["GET"])
-@permission_classes([ValidTokenPermission])
-def get_user_email(request):
+@require_GET
+@async_token_required
+async def get_user_email(request):
     try:
-        # Use the authenticated user
-        user = request.user
-        # Fetch the user's profile
-        profile = UserProfile.objects.get(user=user)
+        # Fetch the authenticated user's email
+        email = (
+            await UserProfile.objects.filter(user_id=request.user.id)
+            .values_list("email", flat=True)
+            .aget()
+        )
         # Check if email exists
-        if profile.email:
-            return JsonResponse({"email": profile.email}, status=200)
+        if email:
+            return JsonResponse({"email": email}, status=200)
         else:
             return JsonResponse({"error": "Email not found"}, status=404)
     except UserProfile.DoesNotExist:
@@ -83,31 +104,157 @@ def get_user_email(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+@require_GET
+@async_token_permission
+async def get_bars(request):
+    """
+    Retrieve a list of all active bars.
+    Answers If-None-Match / If-Modified-Since with 304 straight from the cache.
+    Serves the compact formats and content codings negotiated by app.encoding,
+    all encoded once per cached payload.
+    With ?since=<version> returns only the bars changed since that version, see
+    get_bars_delta. since=0 returns every bar along with the first version.
+    """
+    since = request.GET.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return JsonResponse({"detail": "since must be an integer."}, status=400)
+        delta = await sync_to_async(get_bars_delta)(since)
+        return JsonResponse(delta)
+
+    media_type = negotiate_format(request)
+    coding = negotiate_encoding(request)
+    tag, last_modified, bodies = await aget_bars_entry()
+    if (media_type, coding) not in bodies:
+        coding = None
+    etag = bars_etag(tag, media_type, coding)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(bodies[media_type, coding], content_type=media_type)
+        if coding:
+            response.headers["Content-Encoding"] = coding
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+    return response
+
+
+@require_GET
+@async_token_permission
+async def get_bar_changes(request):
+    """
+    Long-poll fallback for the live stream. Without ?after= returns the current
+    cursor right away. Otherwise waits up to LIVE_POLL_SECONDS for changes after
+    the cursor and returns them merged into one diff per bar. reset means the
+    cursor can't be resumed, refetch /bars/ and continue from the new cursor.
+    """
+    after = request.GET.get("after")
+    if not after:
+        return JsonResponse(
+            {"cursor": await current_cursor(), "changes": [], "reset": False}
+        )
+
+    events = await read_changes(after, settings.LIVE_POLL_SECONDS)
+    if events is None:
+        return JsonResponse(
+            {"cursor": await current_cursor(), "changes": [], "reset": True}
+        )
+    return JsonResponse(
+        {
+            "cursor": events[-1][0] if events else after,
+            "changes": merge_changes(events),
+            "reset": False,
+        }
+    )
+
+
+@require_GET
+@async_token_permission
+async def stream_bar_changes(request):
+    """
+    Server-Sent Events stream of per-bar diffs, see app.live.sse_events.
+    Resumes after the Last-Event-ID header or ?after= when given.
+    """
+    after = request.headers.get("Last-Event-ID") or request.GET.get("after")
+    response = StreamingHttpResponse(
+        sse_events(after), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Keep proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @api_view(["GET"])
 @permission_classes([ValidTokenPermission])
 @authentication_classes([])
-def get_bars(request):
-    """Retrieve a list of all active bars."""
-    bars = Bar.objects.filter(is_active=True)
-
-    bar_data = []
-    for bar in bars:
-        bar.displayed_current_occupancy, bar.displayed_current_line = (
-            calculate_displayed_values(bar)
-        )
-        bar_info = {
-            "id": bar.id,
-            "name": bar.name,
-            "current_occupancy": bar.displayed_current_occupancy,
-            "current_line_wait": bar.displayed_current_line,
-            "is_active": bar.is_active,
-            "latitude": bar.latitude,
-            "longitude": bar.longitude,
-        }
+def get_bar_reports(request, bar_id):
+    """
+    Report history for a bar, newest first.
+    Pass the returned "next" cursor as ?before= to fetch the following page.
+    """
+    bar = get_object_or_404(Bar, id=bar_id)
+    try:
+        reports, next_cursor = get_report_page(bar, request.query_params.get("before"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "reports": [
+                {
+                    "id": report.id,
+                    "timestamp": report.timestamp,
+                    "occupancy_level": report.occupancy_level,
+                    "line_wait": report.line_wait,
+                    "flagged": report.flagged,
+                }
+                for report in reports
+            ],
+            "next": next_cursor,
+        },
+        status=status.HTTP_200_OK,
+    )
+
 
-        bar_data.append(bar_info)
+@api_view(["GET"])
+@permission_classes([ValidTokenPermission])
+@authentication_classes([])
+def get_bar_forecast(request, bar_id):
+    """
+    Forecast occupancy for the next FORECAST_HOURS hours, starting with the
+    current one, under the current weather. 404 for bars without a forecast.
+    """
+    forecaster = get_forecaster()
+    weather = CurrentWeather.objects.filter(id=1).first()
+    effect = (
+        forecaster.weather_effect(weather.temperature, weather.weather_string)
+        if forecaster is not None and weather is not None
+        else 0.0
+    )
+    hours = (
+        forecaster.forecast(bar_id, now(), settings.FORECAST_HOURS, effect)
+        if forecaster is not None
+        else None
+    )
+    if hours is None:
+        return Response(
+            {"error": "No forecast for this bar"}, status=status.HTTP_404_NOT_FOUND
+        )
 
-    return JsonResponse(bar_data, safe=False)
+    return Response(
+        {
+            "bar_id": bar_id,
+            "trained_at": forecaster.trained_at,
+            "forecast": [
+                {"hour": hour, "occupancy": round(occupancy, 1)}
+                for hour, occupancy in hours
+            ],
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 @api_view(["POST"])
@@ -117,60 +264,46 @@ def submit_occupancy(request):
     """
     DRF-based version of your submit_occupancy endpoint.
     Expects JSON with bar_id, occupancy_level, and line_wait.
+    Only stores the report; app/pipeline.py does the rest after the commit.
     """
     try:
-        # 1) Extract data from request.data
-        bar_id = request.data.get("bar_id")
-        occupancy_level = request.data.get("occupancy_level")
-        line_wait = request.data.get("line_wait")
-        if not bar_id:
+        # 1) Validate request.data
+        serializer = OccupancySubmissionSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(
-                {"success": False, "error": "bar_id is required."},
+                {"success": False, "error": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        data = serializer.validated_data
+        token = request.headers.get("Authorization")
 
-        # 2) Fetch the bar using the provided ID
-        bar = get_object_or_404(Bar, id=bar_id)
-
-        # 3) Get the user from request (assuming session or token auth)
-        user = request.user
-
-        # 4) Check cooldown logic
-        """if not verify_cooldown(user, bar):
+        # 2) Check cooldown logic
+        if not claim_cooldown(token, data["bar_id"]):
             return Response(
                 {
                     "success": False,
-                    "message": "You can only submit a report every 10 minutes for the same bar.",
+                    "message": f"You can only submit a report every {settings.REPORT_COOLDOWN_MINUTES} minutes for the same bar.",
                 },
                 status=status.HTTP_400_BAD_REQUEST,
-            )"""
-
-        # 5) Create the OccupancyReport
-        weather_data = CurrentWeather.objects.get(id=1)
-        report = OccupancyReport.objects.create(
-            bar=bar,
-            user=request.headers.get("Authorization"),
-            occupancy_level=int(occupancy_level) if occupancy_level else 0,
-            line_wait=int(line_wait) if line_wait else 0,
-            temperature=weather_data.temperature,
-            weather=weather_data.weather_string,
-        )
-        # 6) Recalculate displayed values
-        displayed_occupancy, displayed_line = calculate_displayed_values(bar)
-        bar.displayed_current_occupancy = displayed_occupancy
-        bar.displayed_current_line = displayed_line
-
-        # 7) Fraud check
-        if flag_fraudulent_entries(report, displayed_occupancy, displayed_line):
-            handle_user_strikes(user)
-
-        bar.save()
-        user, error_response = get_user_from_request(request)
+            )
 
-        # Track user submissions
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        profile.submissions += 1
-        profile.save()
+        # 3) Create the OccupancyReport, the bar foreign key is checked on commit
+        try:
+            with transaction.atomic():
+                report = OccupancyReport.objects.create(
+                    bar_id=data["bar_id"],
+                    user=token,
+                    occupancy_level=data["occupancy_level"],
+                    line_wait=data.get("line_wait"),
+                )
+                # 4) Fold, fraud check, strikes and submission count
+                enqueue_reports([report.id])
+        except IntegrityError:
+            release_cooldown(token, data["bar_id"])
+            return Response(
+                {"success": False, "error": "Bar not found."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
 
         return Response(
             {"success": True, "message": "Report submitted successfully."},
@@ -185,9 +318,85 @@ def submit_occupancy(request):
         )
 
 
-@api_view(["PATCH"])
+@api_view(["POST"])
 @permission_classes([ValidTokenPermission])
 @authentication_classes([])
+def submit_occupancy_batch(request):
+    """
+    Submit several reports at once, e.g. ones queued while the phone was offline.
+    Expects JSON {"reports": [{bar_id, occupancy_level, line_wait, timestamp?}]}.
+    Reports older than BATCH_REPORT_MAX_AGE_HOURS or that break the per-bar
+    cooldown are skipped and listed in "errors" by their index in the request.
+    """
+    serializer = OccupancyBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {"success": False, "error": serializer.errors},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    items = serializer.validated_data["reports"]
+
+    bar_ids = {item["bar_id"] for item in items}
+    missing = bar_ids - set(
+        Bar.objects.filter(id__in=bar_ids).values_list("id", flat=True)
+    )
+    if missing:
+        return Response(
+            {"success": False, "error": f"Bars not found: {sorted(missing)}"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    current_time = now()
+    oldest = current_time - timedelta(hours=settings.BATCH_REPORT_MAX_AGE_HOURS)
+    token = request.headers.get("Authorization")
+    errors = {}
+    indexes = []
+    reports = []
+    for index, item in enumerate(items):
+        # Never trust a phone clock that is ahead of ours
+        timestamp = min(item.get("timestamp", current_time), current_time)
+        if timestamp < oldest:
+            errors[index] = (
+                f"Reports older than {settings.BATCH_REPORT_MAX_AGE_HOURS} hours "
+                "are not accepted."
+            )
+            continue
+        indexes.append(index)
+        reports.append(
+            OccupancyReport(
+                bar_id=item["bar_id"],
+                user=token,
+                occupancy_level=item["occupancy_level"],
+                line_wait=item.get("line_wait"),
+                timestamp=timestamp,
+            )
+        )
+    # Same cooldown per bar as submit_occupancy, measured between report times
+    reports, rejected = split_by_cooldown(token, reports)
+    for position in rejected:
+        errors[indexes[position]] = (
+            f"Reports for the same bar must be {settings.REPORT_COOLDOWN_MINUTES} "
+            "minutes apart."
+        )
+    if reports:
+        with transaction.atomic():
+            reports = OccupancyReport.objects.bulk_create(reports)
+            enqueue_reports(report.id for report in reports)
+
+    return Response(
+        {
+            "success": True,
+            "message": f"{len(reports)} reports submitted.",
+            "errors": [
+                {"index": index, "error": errors[index]} for index in sorted(errors)
+            ],
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["PATCH"])
+@permission_classes([ValidTokenPermission])
 def update_user_email(request):
     user = request.user
 
@@ -206,53 +415,64 @@ def update_user_email(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(["POST"])
-@permission_classes([ValidTokenPermission])
-@authentication_classes([])
-def is_user_near_bar(request):
-    print("is_near_bar ran in the backend")
-    user, error_response = get_user_from_request(request)
+def _request_data(request):
+    """JSON or form body of a plain Django request, None if the JSON is invalid."""
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST
+
+
+@csrf_exempt
+@require_POST
+@async_token_required
+async def is_user_near_bar(request):
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"detail": "Invalid JSON body."}, status=400)
+
+    near_bar_id = data.get("near_bar_id")
+    logger.info(
+        "Presence update",
+        extra={"user_id": request.user.id, "near_bar_id": near_bar_id},
+    )
+    # The transition locks the profile row, which needs a transaction the
+    # async ORM can't hold open
+    await sync_to_async(transition_user_location)(request.user, near_bar_id)
+    return JsonResponse({"message": "is_near_bar updated successfully"}, status=200)
 
-    profile, created = UserProfile.objects.get_or_create(user=user)
-    near_bar_id = request.data.get("near_bar_id")
-    old_near_bar_id = profile.is_near_bar
 
-    if str(user) == "9D0F599A-80B5-46F1-B92E-EB1AE3028665":
-        user_name = "Alison"
-    elif str(user) == "138A88B8-0714-427F-881E-86680EAE5B55":
-        user_name = "Luke"
-    else:
-        user_name = "Other user"
+@api_view(["POST"])
+@permission_classes([ValidTokenPermission])
+def is_user_near_bar_location(request):
+    """
+    Variant of is_user_near_bar that takes raw coordinates and resolves the
+    nearest active bar within the geofence radius on the server.
+    """
+    user = request.user
 
-    print(f"NEAR BAR ID: {near_bar_id}, USER: {user_name}")
-    # Handle old bar count decrease if user was at a bar
-    if old_near_bar_id != -1:
-        try:
-            old_bar = Bar.objects.get(id=old_near_bar_id)
-            if old_bar.users_nearby > 0:
-                old_bar.users_nearby -= 1
-                old_bar.save()
-        except Bar.DoesNotExist:
-            logger.error(
-                f"Previous bar with ID {old_near_bar_id} does not exist for user {user_name}"
-            )
+    try:
+        latitude = float(request.data.get("latitude"))
+        longitude = float(request.data.get("longitude"))
+    except (TypeError, ValueError):
+        return Response(
+            {"error": "latitude and longitude are required."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # float() accepts "nan" and "inf", which the grid lookup can't place
+    if not (
+        math.isfinite(latitude)
+        and math.isfinite(longitude)
+        and -90 <= latitude <= 90
+        and -180 <= longitude <= 180
+    ):
+        return Response(
+            {"error": "latitude must be within ±90 and longitude within ±180."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Update user's location
-    if near_bar_id is not None:
-        try:
-            new_bar_id = int(near_bar_id)
-            profile.is_near_bar = new_bar_id
-
-            # Increase count for new bar
-            new_bar = Bar.objects.get(id=new_bar_id)
-            new_bar.users_nearby += 1
-            new_bar.save()
-        except (ValueError, Bar.DoesNotExist):
-            # Handle invalid bar ID
-            profile.is_near_bar = -1
-
-    profile.last_updated_location = now()
-    profile.save()
-    return Response(
-        {"message": "is_near_bar updated successfully"}, status=status.HTTP_200_OK
-    )
+    nearest = resolve_nearest_bar(latitude, longitude)
+    near_bar_id = transition_user_location(user, nearest[0] if nearest else -1)
+    return Response({"near_bar_id": near_bar_id}, status=status.HTTP_200_OK)
@@ -0,0 +1,186 @@
+"""
+Authentication for the app's device tokens.
+
+The app authenticates with a UUID generated on the device, sent as the raw
+Authorization header, and registered as the user's username. Resolving it to
+a user id goes through a small in-process LRU, then the shared cache, and
+only then auth_user, so a warm request doesn't touch the database at all.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import NotFound
+from app.permissions import ValidTokenPermission
+
+TOKEN_USER_KEY = "auth:token:{token_hash}"
+
+
+class TokenUserCache:
+    """
+    Thread safe LRU of token -> user id with at most max_size entries.
+    Entries expire after ttl seconds, which bounds how long another process
+    keeps resolving the token of a deleted user.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user_id
+
+    def set(self, token, user_id):
+        with self._lock:
+            self._entries[token] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_users = TokenUserCache(settings.AUTH_LRU_SIZE, settings.AUTH_LRU_TTL)
+
+
+def _token_key(token):
+    # Tokens are credentials, keep them out of the cache keys
+    return TOKEN_USER_KEY.format(token_hash=hashlib.sha1(token.encode()).hexdigest())
+
+
+def get_request_token(request):
+    """The device token in the Authorization header, or None."""
+    token = request.headers.get("Authorization")
+    if token and token.startswith("Token "):
+        token = token[6:]
+    return token or None
+
+
+def resolve_user_id(token):
+    """Id of the user registered with `token`, or None if there isn't one."""
+    user_id = token_users.get(token)
+    if user_id is not None:
+        return user_id
+
+    key = _token_key(token)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = (
+            User.objects.filter(username=token).values_list("id", flat=True).first()
+        )
+        # Unknown tokens aren't cached, they may register any moment
+        if user_id is None:
+            return None
+        cache.set(key, user_id, settings.AUTH_CACHE_TTL)
+    token_users.set(token, user_id)
+    return user_id
+
+
+async def aresolve_user_id(token):
+    """Async version of resolve_user_id."""
+    user_id = token_users.get(token)
+    if user_id is not None:
+        return user_id
+
+    key = _token_key(token)
+    user_id = await cache.aget(key)
+    if user_id is None:
+        user_id = (
+            await User.objects.filter(username=token)
+            .values_list("id", flat=True)
+            .afirst()
+        )
+        if user_id is None:
+            return None
+        await cache.aset(key, user_id, settings.AUTH_CACHE_TTL)
+    token_users.set(token, user_id)
+    return user_id
+
+
+def forget_token(token):
+    """Drop a token from both cache levels, e.g. when its user is deleted."""
+    token_users.discard(token)
+    cache.delete(_token_key(token))
+
+
+class DeviceTokenAuthentication(BaseAuthentication):
+    """
+    Sets request.user from the device token, resolved once per request.
+    The user only has id and username loaded, other fields are fetched on
+    first access like with .only().
+    Headers that aren't UUIDs are left to the other authentication classes.
+    """
+
+    def authenticate(self, request):
+        token = get_request_token(request)
+        if not token:
+            return None
+        try:
+            uuid.UUID(token)
+        except ValueError:
+            return None
+
+        user_id = resolve_user_id(token)
+        if user_id is None:
+            raise NotFound("User not found for this token")
+        return User.from_db("default", ["id", "username"], [user_id, token]), token
+
+
+def async_token_permission(view):
+    """ValidTokenPermission for async views, which DRF can't serve."""
+    permission = ValidTokenPermission()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not permission.has_permission(request, view):
+            return JsonResponse(
+                {"detail": "You do not have permission to perform this action."},
+                status=403,
+            )
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_token_required(view):
+    """
+    async_token_permission that also resolves the token like
+    DeviceTokenAuthentication and sets request.user.
+    """
+
+    @async_token_permission
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        token = get_request_token(request)
+        user_id = await aresolve_user_id(token)
+        if user_id is None:
+            return JsonResponse({"detail": "User not found for this token"}, status=404)
+        request.user = User.from_db("default", ["id", "username"], [user_id, token])
+        return await view(request, *args, **kwargs)
+
+    return wrapper
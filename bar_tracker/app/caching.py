@@ -0,0 +1,172 @@
+import hashlib
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.timezone import now
+from app.encoding import COLUMNS, JSON, MSGPACK, encode_payloads
+from app.forecast import current_forecast, get_forecaster
+from app.models import Bar
+from app.weather_models import CurrentWeather
+
+BARS_VERSION_KEY = "bars:version"
+BARS_PAYLOAD_KEY = "bars:payload:{version}"
+BAR_FIELDS = (
+    "id",
+    "name",
+    "current_occupancy",
+    "current_line_wait",
+    "forecast_occupancy",
+    "is_active",
+    "latitude",
+    "longitude",
+)
+FORMAT_TAGS = {JSON: "", COLUMNS: "-columns", MSGPACK: "-msgpack"}
+
+
+def _bar_entry(bar, current_time, forecast=None):
+    """A bar's payload entry, without forecast_occupancy when forecast is None."""
+    displayed_occupancy, displayed_line = bar.decayed_display_values(current_time)
+    entry = {
+        "id": bar.id,
+        "name": bar.name,
+        "current_occupancy": displayed_occupancy,
+        "current_line_wait": displayed_line,
+        "is_active": bar.is_active,
+        "latitude": bar.latitude,
+        "longitude": bar.longitude,
+    }
+    if forecast is not None:
+        # Fills in bars without recent reports
+        entry["forecast_occupancy"] = (
+            forecast(bar.id) if displayed_occupancy is None else None
+        )
+    return entry
+
+
+def build_bars_rows():
+    """Every active bar with its current displayed values."""
+    current_time = now()
+    forecast = current_forecast(
+        get_forecaster(), CurrentWeather.objects.filter(id=1).first(), current_time
+    )
+    return [
+        _bar_entry(bar, current_time, forecast)
+        for bar in Bar.objects.filter(is_active=True)
+    ]
+
+
+async def abuild_bars_rows():
+    """Async version of build_bars_rows."""
+    current_time = now()
+    forecast = current_forecast(
+        await sync_to_async(get_forecaster)(),
+        await CurrentWeather.objects.filter(id=1).afirst(),
+        current_time,
+    )
+    return [
+        _bar_entry(bar, current_time, forecast)
+        async for bar in Bar.objects.filter(is_active=True).aiterator()
+    ]
+
+
+def _new_bars_entry(version, rows):
+    bodies = encode_payloads(rows, BAR_FIELDS)
+    digest = hashlib.md5(bodies[JSON, None]).hexdigest()[:16]
+    return f"{version}-{digest}", int(time.time()), bodies
+
+
+def bars_etag(tag, media_type, coding):
+    """Strong ETag of one representation of the /bars/ payload."""
+    suffix = FORMAT_TAGS[media_type] + (f"+{coding}" if coding else "")
+    return f'"{tag}{suffix}"'
+
+
+def get_bars_delta(since: int) -> dict:
+    """
+    Active bars changed at or after `since`, the version handed out by an earlier
+    delta (0 for everything), plus the ids of bars deactivated since then.
+    The version is the oldest transaction still running when the bars are read:
+    every change made before it has committed and is in this read, later ones
+    have change_version at or above it and are picked up by the next delta.
+    Postgres only: the version comes from txid_current_snapshot and
+    change_version is set by the trigger of migration 0031.
+    Entries carry no forecast_occupancy: forecasts move with the hour, the
+    weather and each training run without touching change_version, so clients
+    read them from the full /bars/ payload or bars/<id>/forecast/.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        version = cursor.fetchone()[0]
+
+    current_time = now()
+    bars = []
+    removed = []
+    for bar in Bar.objects.filter(change_version__gte=since):
+        if bar.is_active:
+            bars.append(
+                {
+                    **_bar_entry(bar, current_time),
+                    "users_nearby": bar.users_nearby,
+                }
+            )
+        elif since:
+            removed.append(bar.id)
+    return {"version": version, "bars": bars, "removed": removed}
+
+
+def get_bars_version() -> int:
+    """Current content version of the /bars/ payload."""
+    version = cache.get(BARS_VERSION_KEY)
+    if version is None:
+        cache.add(BARS_VERSION_KEY, 1, timeout=None)
+        version = cache.get(BARS_VERSION_KEY, 1)
+    return version
+
+
+def get_bars_entry():
+    """
+    Return (tag, last_modified, bodies) for the /bars/ payload, rebuilding it on
+    a cache miss. bodies holds every encoding from app.encoding.encode_payloads,
+    tag is the base of their ETags, see bars_etag. Entries are keyed by content
+    version and expire after BARS_CACHE_TTL seconds so displayed values that age
+    out of the display window are picked up even when nothing is submitted. The
+    tag includes a digest of the payload for the same reason.
+    """
+    version = get_bars_version()
+    key = BARS_PAYLOAD_KEY.format(version=version)
+    entry = cache.get(key)
+    if entry is None:
+        entry = _new_bars_entry(version, build_bars_rows())
+        cache.set(key, entry, settings.BARS_CACHE_TTL)
+    return entry
+
+
+async def aget_bars_version() -> int:
+    """Async version of get_bars_version."""
+    version = await cache.aget(BARS_VERSION_KEY)
+    if version is None:
+        await cache.aadd(BARS_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(BARS_VERSION_KEY, 1)
+    return version
+
+
+async def aget_bars_entry():
+    """Async version of get_bars_entry."""
+    version = await aget_bars_version()
+    key = BARS_PAYLOAD_KEY.format(version=version)
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = _new_bars_entry(version, await abuild_bars_rows())
+        await cache.aset(key, entry, settings.BARS_CACHE_TTL)
+    return entry
+
+
+def invalidate_bars_payload():
+    """Bump the content version so the next request rebuilds the payload."""
+    try:
+        cache.incr(BARS_VERSION_KEY)
+    except ValueError:
+        # Version key missing or evicted, start a new sequence
+        cache.add(BARS_VERSION_KEY, int(time.time()), timeout=None)
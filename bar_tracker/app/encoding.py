@@ -0,0 +1,150 @@
+"""
+Negotiated payload formats and content codings for API responses.
+
+Formats, picked from Accept:
+    application/json                         list of objects, the default
+    application/vnd.bartracker.columns+json  {field: [value per row, ...]}
+    application/msgpack                      the columnar layout as MessagePack
+
+Content codings, picked from Accept-Encoding: br and gzip. CompressionMiddleware
+compresses any large enough response on the way out. /bars/ instead serves
+bodies encoded and compressed once per cached payload version, see
+encode_payloads.
+"""
+
+import gzip
+import json
+
+import brotli
+import msgpack
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+JSON = "application/json"
+COLUMNS = "application/vnd.bartracker.columns+json"
+MSGPACK = "application/msgpack"
+MSGPACK_ALIASES = (
+    "application/msgpack",
+    "application/x-msgpack",
+    "application/vnd.msgpack",
+)
+# Preferred first when the client accepts several with the same quality
+CODINGS = ("br", "gzip")
+# Smaller bodies don't win back the compression header and CPU time
+MIN_COMPRESS_SIZE = 200
+GZIP_LEVEL = 6
+# Brotli's default of 11 is far slower for a few percent, see bench_encoding.py
+BROTLI_QUALITY = 5
+
+
+def _qualities(header):
+    """Map of lowercased token -> quality from an Accept or Accept-Encoding header."""
+    qualities = {}
+    for item in header.split(","):
+        token, *params = item.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[token] = quality
+    return qualities
+
+
+def negotiate_format(request):
+    """
+    The compact format the client asked for by name, JSON otherwise. Wildcards
+    never select a compact format, existing clients send */*.
+    """
+    qualities = _qualities(request.headers.get("Accept", ""))
+    msgpack_quality = max(qualities.get(alias, 0.0) for alias in MSGPACK_ALIASES)
+    quality, media_type = max(
+        ((msgpack_quality, MSGPACK), (qualities.get(COLUMNS, 0.0), COLUMNS)),
+        key=lambda candidate: candidate[0],
+    )
+    if quality <= 0 or qualities.get(JSON, 0.0) > quality:
+        return JSON
+    return media_type
+
+
+def negotiate_encoding(request):
+    """Best content coding the client accepts, None for identity."""
+    qualities = _qualities(request.headers.get("Accept-Encoding", ""))
+    wildcard = qualities.get("*", 0.0)
+    best = max(CODINGS, key=lambda coding: qualities.get(coding, wildcard))
+    return best if qualities.get(best, wildcard) > 0 else None
+
+
+def compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # A fixed mtime keeps the output, and so any digest of it, deterministic
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def encode(rows, fields, media_type):
+    """Serialize a list of dicts with the given keys in one of the formats."""
+    if media_type == JSON:
+        return json.dumps(rows, cls=DjangoJSONEncoder).encode()
+    columns = {field: [row[field] for row in rows] for field in fields}
+    if media_type == COLUMNS:
+        return json.dumps(
+            columns, cls=DjangoJSONEncoder, separators=(",", ":")
+        ).encode()
+    return msgpack.packb(columns)
+
+
+def encode_payloads(rows, fields):
+    """
+    rows in every format, plus the br and gzip compressed bodies that come out
+    smaller, keyed by (media type, content coding or None).
+    """
+    bodies = {}
+    for media_type in (JSON, COLUMNS, MSGPACK):
+        body = bodies[media_type, None] = encode(rows, fields, media_type)
+        if len(body) < MIN_COMPRESS_SIZE:
+            continue
+        for coding in CODINGS:
+            compressed = compress(body, coding)
+            if len(compressed) < len(body):
+                bodies[media_type, coding] = compressed
+    return bodies
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    GZipMiddleware with brotli. Streaming responses are left alone so Server-Sent
+    Events aren't held back by the compressor.
+    """
+
+    def process_response(self, request, response):
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < MIN_COMPRESS_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        coding = negotiate_encoding(request)
+        if coding is None:
+            return response
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+        response.headers["Content-Encoding"] = coding
+        # Like GZipMiddleware, the compressed body is no longer byte-identical
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        return response
@@ -0,0 +1,324 @@
+"""
+Occupancy forecasts from the hourly report history.
+
+The model is additive:
+
+    occupancy = pooled[weekday, hour] + bar[weekday, hour] + weather
+
+where each [weekday, hour] term is a baseline plus a weekday effect plus an
+hour-of-day effect in FORECAST_TIME_ZONE, so Thursday to Saturday party nights
+are carried by the weekday effects. The pooled terms are fit on every bar, and
+each bar's deviation from them is shrunk toward zero, so a bar with little
+history forecasts close to the citywide pattern. The weather term (temperature
+plus an offset per condition) is shared by all bars. The three parts are fit
+in turn by weighted ridge least squares with NumPy, weighting every hour by its
+report count.
+
+train_forecast stores a ForecastFit. Predictions are served from an in-memory
+Forecaster, reloaded when the cache says a newer fit was stored.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Max
+from django.db.models.functions import TruncHour
+from django.utils.timezone import now
+from app.models import ForecastFit, HourlyBarReport, OccupancyReport
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = 7
+HOURS = 24
+PARAMETERS = 1 + WEEKDAYS + HOURS
+# Conditions stored by update_weather, anything else counts as clear
+WEATHER_CONDITIONS = ("clouds", "rain", "snow", "thunderstorm", "drizzle", "mist")
+# Ridge penalties, measured in reports. A bar's deviation from the pooled
+# pattern needs about BAR_RIDGE reports in a slot to move halfway to its own mean.
+POOLED_RIDGE = 1.0
+BAR_RIDGE = 20.0
+WEATHER_RIDGE = 10.0
+BACKFIT_ITERATIONS = 4
+# Bars with fewer hourly samples get no forecast
+MIN_BAR_HOURS = 3
+# Fits kept in the database, older ones are deleted after training
+KEEP_FITS = 3
+# Holds (id, trained_at) of the latest fit
+FORECAST_FIT_KEY = "forecast:fit"
+# Seconds the latest fit is cached. Without a shared cache this is how long a
+# web process keeps serving the previous fit after a training run.
+FIT_CHECK_SECONDS = 300
+
+
+def _design(weekdays, hours):
+    rows = np.arange(len(weekdays))
+    design = np.zeros((len(weekdays), PARAMETERS))
+    design[:, 0] = 1
+    design[rows, 1 + weekdays] = 1
+    design[rows, 1 + WEEKDAYS + hours] = 1
+    return design
+
+
+def _ridge(design, target, weights, penalty):
+    """
+    Weighted least squares with an L2 penalty per column. Solved through the
+    normal equations, the penalties keep them positive definite.
+    """
+    weighted = design.T * weights
+    return np.linalg.solve(weighted @ design + np.diag(penalty), weighted @ target)
+
+
+def fit_forecast(bar_ids, weekdays, hours, occupancy, weights, temperatures, weather):
+    """
+    Fit the model to hourly samples given as equal length arrays. weekdays and
+    hours are local, temperatures may hold NaN and weather holds condition names
+    or None. Returns the ForecastFit fields as a dict.
+    """
+    bar_ids = np.asarray(bar_ids)
+    weekdays = np.asarray(weekdays, dtype=np.int64)
+    hours = np.asarray(hours, dtype=np.int64)
+    occupancy = np.asarray(occupancy, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+
+    known = ~np.isnan(temperatures)
+    temperature_mean = float(temperatures[known].mean()) if known.any() else None
+    weather_design = np.zeros((len(occupancy), 1 + len(WEATHER_CONDITIONS)))
+    if temperature_mean is not None:
+        weather_design[known, 0] = (temperatures[known] - temperature_mean) / 10
+    for column, condition in enumerate(WEATHER_CONDITIONS, start=1):
+        weather_design[:, column] = [value == condition for value in weather]
+
+    design = _design(weekdays, hours)
+    pooled_penalty = np.full(PARAMETERS, POOLED_RIDGE)
+    pooled_penalty[0] = 0
+    bar_penalty = np.full(PARAMETERS, BAR_RIDGE)
+    weather_penalty = np.full(weather_design.shape[1], WEATHER_RIDGE)
+
+    order = np.argsort(bar_ids, kind="stable")
+    unique_bars, starts = np.unique(bar_ids[order], return_index=True)
+    groups = np.split(order, starts[1:])
+
+    weather_coef = np.zeros(weather_design.shape[1])
+    deviation_fit = np.zeros(len(occupancy))
+    deviations = {}
+    for _ in range(BACKFIT_ITERATIONS):
+        weather_fit = weather_design @ weather_coef
+        pooled = _ridge(
+            design, occupancy - weather_fit - deviation_fit, weights, pooled_penalty
+        )
+        residual = occupancy - weather_fit - design @ pooled
+        for bar_id, rows in zip(unique_bars, groups):
+            deviation = _ridge(design[rows], residual[rows], weights[rows], bar_penalty)
+            deviations[bar_id] = deviation
+            deviation_fit[rows] = design[rows] @ deviation
+        weather_coef = _ridge(
+            weather_design,
+            occupancy - design @ pooled - deviation_fit,
+            weights,
+            weather_penalty,
+        )
+
+    return {
+        "samples": len(occupancy),
+        "temperature_mean": temperature_mean,
+        "temperature_effect": (
+            0.0 if temperature_mean is None else float(weather_coef[0])
+        ),
+        "weather_effects": dict(zip(WEATHER_CONDITIONS, weather_coef[1:].tolist())),
+        "bar_parameters": {
+            str(bar_id): (pooled + deviations[bar_id]).tolist()
+            for bar_id, rows in zip(unique_bars, groups)
+            if len(rows) >= MIN_BAR_HOURS
+        },
+    }
+
+
+def training_samples(since):
+    """
+    Hourly (bar_id, hour, mean occupancy, reports, mean temperature, weather)
+    rows since a time: the rolled up history plus the raw reports still waiting
+    for the retention job.
+    """
+    rolled_up = HourlyBarReport.objects.filter(
+        hour__gte=since, report_count__gt=0, mean_occupancy__isnull=False
+    ).values_list(
+        "bar_id",
+        "hour",
+        "mean_occupancy",
+        "report_count",
+        "mean_temperature",
+        "weather",
+    )
+    recent = (
+        OccupancyReport.objects.filter(timestamp__gte=since, flagged=False)
+        .annotate(hour=TruncHour("timestamp"))
+        .values("bar_id", "hour")
+        # Weather is copied from CurrentWeather, so it rarely varies in an hour
+        .annotate(
+            mean_occupancy=Avg("occupancy_level"),
+            report_count=Count("id"),
+            mean_temperature=Avg("temperature"),
+            weather=Max("weather"),
+        )
+        .values_list(
+            "bar_id",
+            "hour",
+            "mean_occupancy",
+            "report_count",
+            "mean_temperature",
+            "weather",
+        )
+    )
+    return [*rolled_up, *recent]
+
+
+def train_forecast(weeks=None):
+    """
+    Fit the model to the last `weeks` weeks of history, store the fit and make
+    it the one served. Returns the new ForecastFit, None without history.
+    """
+    weeks = weeks or settings.FORECAST_HISTORY_WEEKS
+    samples = training_samples(now() - timedelta(weeks=weeks))
+    if not samples:
+        return None
+
+    zone = ZoneInfo(settings.FORECAST_TIME_ZONE)
+    local_hours = [hour.astimezone(zone) for _, hour, *_ in samples]
+    fit = ForecastFit.objects.create(
+        **fit_forecast(
+            bar_ids=[sample[0] for sample in samples],
+            weekdays=[hour.weekday() for hour in local_hours],
+            hours=[hour.hour for hour in local_hours],
+            occupancy=[sample[2] for sample in samples],
+            weights=[sample[3] for sample in samples],
+            temperatures=[
+                np.nan if sample[4] is None else sample[4] for sample in samples
+            ],
+            weather=[(sample[5] or "").lower() or None for sample in samples],
+        )
+    )
+    stale = ForecastFit.objects.order_by("-id").values_list("id", flat=True)[KEEP_FITS:]
+    ForecastFit.objects.filter(id__in=list(stale)).delete()
+    cache.set(FORECAST_FIT_KEY, (fit.id, fit.trained_at), FIT_CHECK_SECONDS)
+    logger.info(
+        "Trained forecast",
+        extra={"samples": fit.samples, "bars": len(fit.bar_parameters)},
+    )
+    return fit
+
+
+class Forecaster:
+    """A ForecastFit held in memory, predictions are a few lookups and adds."""
+
+    def __init__(self, fit):
+        self.fit_id = fit.id
+        self.trained_at = fit.trained_at
+        self.temperature_mean = fit.temperature_mean
+        self.temperature_effect = fit.temperature_effect
+        self.weather_effects = fit.weather_effects
+        self.bars = {
+            int(bar_id): parameters for bar_id, parameters in fit.bar_parameters.items()
+        }
+        self.zone = ZoneInfo(settings.FORECAST_TIME_ZONE)
+
+    def weather_effect(self, temperature=None, weather=None):
+        """Occupancy offset for the given conditions, 0 for unknown ones."""
+        effect = self.weather_effects.get((weather or "").lower(), 0.0)
+        if temperature is not None and self.temperature_mean is not None:
+            effect += (
+                self.temperature_effect * (temperature - self.temperature_mean) / 10
+            )
+        return effect
+
+    def predict(self, bar_id, when, weather_effect=0.0):
+        """Occupancy expected at a bar at a time, None for bars without a fit."""
+        parameters = self.bars.get(bar_id)
+        if parameters is None:
+            return None
+        local = when.astimezone(self.zone)
+        value = (
+            parameters[0]
+            + parameters[1 + local.weekday()]
+            + parameters[1 + WEEKDAYS + local.hour]
+            + weather_effect
+        )
+        return min(max(value, 1.0), 10.0)
+
+    def forecast(self, bar_id, start, hours, weather_effect=0.0):
+        """(hour, occupancy) for `hours` hours from the hour containing start."""
+        if bar_id not in self.bars:
+            return None
+        start = start.replace(minute=0, second=0, microsecond=0)
+        return [
+            (hour, self.predict(bar_id, hour, weather_effect))
+            for hour in (start + timedelta(hours=i) for i in range(hours))
+        ]
+
+
+_forecaster = None
+_forecaster_lock = threading.Lock()
+
+
+def get_forecaster():
+    """
+    The Forecaster of the latest fit, None before the first training run.
+    Costs a cache read while the fit is unchanged, plus a query every
+    FIT_CHECK_SECONDS. The fit is matched on id and trained_at, ids alone can
+    come back after the table is emptied.
+    """
+    global _forecaster
+    latest = cache.get(FORECAST_FIT_KEY)
+    if latest is None:
+        latest = (
+            ForecastFit.objects.order_by("-id").values_list("id", "trained_at").first()
+        )
+        cache.add(FORECAST_FIT_KEY, latest or 0, FIT_CHECK_SECONDS)
+    if not latest:
+        return None
+
+    forecaster = _forecaster
+    if forecaster is None or (forecaster.fit_id, forecaster.trained_at) != latest:
+        with _forecaster_lock:
+            if (
+                _forecaster is None
+                or (_forecaster.fit_id, _forecaster.trained_at) != latest
+            ):
+                fit = ForecastFit.objects.filter(
+                    id=latest[0], trained_at=latest[1]
+                ).first()
+                _forecaster = Forecaster(fit) if fit is not None else None
+            forecaster = _forecaster
+    return forecaster
+
+
+def reset_forecaster():
+    """Drop the Forecaster held in memory, the next get_forecaster reloads it."""
+    global _forecaster
+    with _forecaster_lock:
+        _forecaster = None
+
+
+def current_forecast(forecaster, weather, current_time):
+    """
+    bar_id -> forecast occupancy for current_time rounded like the displayed
+    values, None without a fit for the bar. weather is the CurrentWeather row.
+    """
+    if forecaster is None:
+        return lambda bar_id: None
+    effect = (
+        forecaster.weather_effect(weather.temperature, weather.weather_string)
+        if weather is not None
+        else 0.0
+    )
+
+    def forecast(bar_id):
+        value = forecaster.predict(bar_id, current_time, effect)
+        return None if value is None else round(value)
+
+    return forecast
@@ -0,0 +1,226 @@
+"""
+Robust fraud scoring for occupancy reports.
+
+A report is compared with the other reports for its bar in the hour up to it
+(the display window), weighted with the same half life as the displayed
+values. The comparison uses the weighted median and the weighted median
+absolute deviation (MAD), so a handful of bad reports can't drag the reference
+towards themselves the way they can drag a mean. A report is flagged when its
+occupancy or line wait is more than Z_THRESHOLD robust standard deviations
+from the median.
+
+Levels are small integers, so every window is summarized as a weighted
+histogram over the levels, with as many bins as the largest level of the bar.
+Histograms for many windows come out of one prefix sum per bar, which is what
+lets a whole night be rescored at once. Occupancy and line wait are each scored
+only when enough other reports in the window have one.
+"""
+
+from collections import defaultdict
+import numpy as np
+from django.db.models import Case, Value, When
+from app.models import (
+    OccupancyReport,
+    HALF_LIFE_MINUTES,
+    DISPLAY_WINDOW,
+    MAX_LINE_WAIT,
+)
+from app.reputation import exclude_banned
+
+# Stored levels above this are binned as this, so a bad row can't blow up the
+# histograms. Occupancy goes to 10, line waits are minutes.
+MAX_LEVEL = MAX_LINE_WAIT
+Z_THRESHOLD = 3.5
+# MAD to standard deviation for normally distributed data
+MAD_SCALE = 1.4826
+# Lower bound on the robust standard deviation, in levels. When every report
+# agrees the MAD is 0, and this keeps the old "more than 3 levels off" rule.
+MIN_SIGMA = 1.0
+# The same for line waits, one 5 minute step of the app's slider
+MIN_LINE_SIGMA = 5.0
+# Other reports in the window needed to score a report
+MIN_WINDOW_REPORTS = 2
+
+WINDOW_MINUTES = DISPLAY_WINDOW.total_seconds() / 60
+# Evaluation times are processed in blocks this long so exp2 stays finite
+BLOCK_MINUTES = 24 * 60
+
+
+def _to_minutes(timestamps):
+    return np.array([t.timestamp() / 60 for t in timestamps], dtype=np.float64)
+
+
+def _levels(values):
+    """
+    Stored levels as an array for binning. Missing and negative values become
+    -1, values above MAX_LEVEL are clipped to it and still score as outliers.
+    """
+    levels = np.array(
+        [-1 if value is None else value for value in values], dtype=np.int64
+    )
+    levels[levels < 0] = -1
+    return np.minimum(levels, MAX_LEVEL)
+
+
+def window_histograms(times, levels):
+    """
+    Half life weighted histograms of the levels reported by the other reports in
+    the window ending at each report.
+    Args:
+        times: sorted report times in minutes, shape (n,).
+        levels: integer levels of those reports in [0, MAX_LEVEL], -1 where
+            missing, shape (n,).
+    Returns:
+        (histograms of shape (n, max level + 1), report counts of shape (n,)).
+        Each row is scaled by a positive constant, which doesn't change its
+        median or MAD.
+    """
+    bins = int(levels.max(initial=0)) + 1
+    histograms = np.zeros((len(times), bins))
+    counts = np.zeros(len(times), dtype=np.int64)
+    if not len(times):
+        return histograms, counts
+
+    blocks = np.floor((times - times[0]) / BLOCK_MINUTES)
+    for block in np.unique(blocks):
+        in_block = np.nonzero(blocks == block)[0]
+        block_times = times[in_block]
+        origin = block_times[0] - WINDOW_MINUTES
+        lo_report = np.searchsorted(times, origin, side="left")
+        hi_report = np.searchsorted(times, block_times[-1], side="right")
+        window_times = times[lo_report:hi_report]
+        window_levels = levels[lo_report:hi_report]
+
+        # 0.5^((t_eval - t) / half life) = 2^(-t_eval / half life) * 2^(t / half life),
+        # so prefix sums of 2^(t / half life) give every window's weights at once
+        valid = window_levels >= 0
+        growth = np.exp2((window_times - origin) / HALF_LIFE_MINUTES)
+        weighted = np.zeros((len(window_times), bins))
+        weighted[np.nonzero(valid)[0], window_levels[valid]] = growth[valid]
+        prefix = np.vstack((np.zeros(bins), np.cumsum(weighted, axis=0)))
+        count_prefix = np.concatenate(([0], np.cumsum(valid)))
+
+        hi = np.searchsorted(window_times, block_times, side="right")
+        lo = np.searchsorted(window_times, block_times - WINDOW_MINUTES, side="left")
+        histograms[in_block] = prefix[hi] - prefix[lo]
+        counts[in_block] = count_prefix[hi] - count_prefix[lo]
+
+        # Leave each report out of its own window
+        own = in_block - lo_report
+        histograms[in_block] -= weighted[own]
+        counts[in_block] -= valid[own]
+    return np.maximum(histograms, 0), counts
+
+
+def histogram_median(histograms):
+    """Weighted (lower) median level of each histogram row."""
+    cumulative = np.cumsum(histograms, axis=1)
+    half = cumulative[:, -1:] / 2
+    return np.argmax(cumulative >= half, axis=1)
+
+
+def histogram_mad(histograms, medians):
+    """Weighted median absolute deviation from `medians` of each histogram row."""
+    rows = np.arange(len(histograms))
+    deviations = np.zeros_like(histograms)
+    for level in range(histograms.shape[1]):
+        deviations[rows, np.abs(level - medians)] += histograms[:, level]
+    return histogram_median(deviations)
+
+
+def robust_z(values, histograms, min_sigma=MIN_SIGMA):
+    """Distance of each value from its histogram's median in robust sigmas."""
+    medians = histogram_median(histograms)
+    sigma = np.maximum(MAD_SCALE * histogram_mad(histograms, medians), min_sigma)
+    return np.abs(values - medians) / sigma
+
+
+def score_bar(times, occupancy, line):
+    """
+    Flags for the reports of one bar, each scored against the other reports in
+    the window ending at it. The arrays must be sorted by time, see _levels.
+    Returns a boolean array, True where the report looks fraudulent.
+    """
+    occupancy_hist, occupancy_counts = window_histograms(times, occupancy)
+    line_hist, line_counts = window_histograms(times, line)
+    occupancy_z = robust_z(occupancy, occupancy_hist)
+    line_z = robust_z(line, line_hist, MIN_LINE_SIGMA)
+    # Reports without a line wait are left out of the line counts, so a wait is
+    # never compared with an empty histogram
+    occupancy_scored = occupancy_counts >= MIN_WINDOW_REPORTS
+    line_scored = (line >= 0) & (line_counts >= MIN_WINDOW_REPORTS)
+    return (occupancy_scored & (occupancy_z > Z_THRESHOLD)) | (
+        line_scored & (line_z > Z_THRESHOLD)
+    )
+
+
+def _score_rows(rows, score_ids):
+    """
+    Score reports given as (id, bar_id, timestamp, occupancy, line) rows, which
+    must include every report in the windows of the ones in score_ids.
+    Returns the set of flagged ids among score_ids.
+    """
+    rows_by_bar = defaultdict(list)
+    for row in rows:
+        rows_by_bar[row[1]].append(row)
+
+    flagged = set()
+    for bar_rows in rows_by_bar.values():
+        bar_rows.sort(key=lambda row: row[2])
+        ids, _, timestamps, occupancy, line = zip(*bar_rows)
+        flags = score_bar(_to_minutes(timestamps), _levels(occupancy), _levels(line))
+        flagged.update(
+            report_id
+            for report_id, flag in zip(ids, flags)
+            if flag and report_id in score_ids
+        )
+    return flagged
+
+
+REPORT_FIELDS = ("id", "bar_id", "timestamp", "occupancy_level", "line_wait")
+
+
+def flag_reports(reports) -> list:
+    """
+    Score new reports against the unflagged reports in each bar's window and
+    mark the fraudulent ones with a single UPDATE. Returns the flagged reports.
+    """
+    if not reports:
+        return []
+    window_rows = exclude_banned(
+        OccupancyReport.objects.filter(
+            bar_id__in={report.bar_id for report in reports},
+            flagged=False,
+            timestamp__gte=min(report.timestamp for report in reports) - DISPLAY_WINDOW,
+            timestamp__lte=max(report.timestamp for report in reports),
+        )
+    ).values_list(*REPORT_FIELDS)
+    flagged_ids = _score_rows(window_rows, {report.id for report in reports})
+    if flagged_ids:
+        OccupancyReport.objects.filter(id__in=flagged_ids).update(flagged=True)
+    flagged = [report for report in reports if report.id in flagged_ids]
+    for report in flagged:
+        report.flagged = True
+    return flagged
+
+
+def rescore_reports(start, end):
+    """
+    Recompute the flag of every report submitted in [start, end) against all
+    reports in its window, and write the flags with a single UPDATE.
+    Returns (reports scored, reports flagged).
+    """
+    window_rows = list(
+        OccupancyReport.objects.filter(
+            timestamp__gte=start - DISPLAY_WINDOW, timestamp__lt=end
+        ).values_list(*REPORT_FIELDS)
+    )
+    score_ids = {row[0] for row in window_rows if row[2] >= start}
+    if not score_ids:
+        return 0, 0
+
+    flagged_ids = _score_rows(window_rows, score_ids)
+    OccupancyReport.objects.filter(id__in=score_ids).update(
+        flagged=Case(When(id__in=flagged_ids, then=Value(True)), default=Value(False))
+    )
+    return len(score_ids), len(flagged_ids)
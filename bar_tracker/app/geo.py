@@ -0,0 +1,133 @@
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from app.models import Bar
+from app.utils import calculate_distance, EARTH_RADIUS_MILES
+
+MILES_PER_DEGREE_LAT = 69.0
+BAR_LOCATIONS_VERSION_KEY = "bars:locations:version"
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> float:
+    """Great circle distance in miles. Within ~0.5% of geodesic."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+class BarSpatialIndex:
+    """
+    Grid index of bar coordinates. Cells are at least radius_miles wide in both
+    directions, so every bar within radius_miles of a point lies in the point's
+    cell or one of its eight neighbours.
+    """
+
+    def __init__(self, bars, radius_miles):
+        self.radius_miles = radius_miles
+        self.lat_cell = radius_miles / MILES_PER_DEGREE_LAT
+        max_lat = max((abs(lat) for _, lat, _ in bars), default=0)
+        # Longitude degrees shrink towards the poles, size cells for the worst case
+        self.lon_cell = self.lat_cell / max(math.cos(math.radians(max_lat)), 0.01)
+        self.cells = defaultdict(list)
+        for bar_id, lat, lon in bars:
+            self.cells[self._cell(lat, lon)].append((bar_id, lat, lon))
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.lat_cell), math.floor(lon / self.lon_cell))
+
+    def nearest(self, lat, lon) -> Optional[Tuple[int, float]]:
+        """
+        Return (bar_id, distance in miles) of the nearest bar within the radius,
+        or None. Candidates are prefiltered with haversine and only those passing
+        it are measured with the exact geodesic.
+        """
+        row, col = self._cell(lat, lon)
+        # Small slack so haversine's error can't drop a bar right at the edge
+        prefilter_radius = self.radius_miles * 1.01
+        candidates = []
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                for bar_id, bar_lat, bar_lon in self.cells.get(
+                    (row + d_row, col + d_col), ()
+                ):
+                    if haversine_miles(lat, lon, bar_lat, bar_lon) <= prefilter_radius:
+                        candidates.append((bar_id, bar_lat, bar_lon))
+
+        nearest = None
+        for bar_id, bar_lat, bar_lon in candidates:
+            distance = calculate_distance((lat, lon), (bar_lat, bar_lon))
+            if distance <= self.radius_miles and (
+                nearest is None or distance < nearest[1]
+            ):
+                nearest = (bar_id, distance)
+        return nearest
+
+
+_index_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_built = 0.0
+
+
+def get_bar_locations_version() -> int:
+    version = cache.get(BAR_LOCATIONS_VERSION_KEY)
+    if version is None:
+        # Random seed so a restarted sequence never matches a stale local index
+        cache.add(BAR_LOCATIONS_VERSION_KEY, random.getrandbits(48), timeout=None)
+        version = cache.get(BAR_LOCATIONS_VERSION_KEY)
+    return version
+
+
+def invalidate_bar_locations():
+    """
+    Mark the spatial index stale in every process sharing the cache. With the
+    per-process LocMem cache only this process sees it, the others pick up the
+    change when their index is BAR_INDEX_TTL_SECONDS old.
+    """
+    try:
+        cache.incr(BAR_LOCATIONS_VERSION_KEY)
+    except ValueError:
+        cache.add(BAR_LOCATIONS_VERSION_KEY, random.getrandbits(48), timeout=None)
+
+
+def get_bar_index() -> BarSpatialIndex:
+    """
+    Process-local spatial index of active bars, rebuilt when bars change or
+    after BAR_INDEX_TTL_SECONDS.
+    """
+    global _index, _index_version, _index_built
+    version = get_bar_locations_version()
+
+    def stale():
+        return (
+            _index is None
+            or _index_version != version
+            or time.monotonic() - _index_built > settings.BAR_INDEX_TTL_SECONDS
+        )
+
+    if stale():
+        with _index_lock:
+            if stale():
+                bars = Bar.objects.filter(
+                    is_active=True, latitude__isnull=False, longitude__isnull=False
+                ).values_list("id", "latitude", "longitude")
+                _index = BarSpatialIndex(list(bars), settings.GEOFENCE_RADIUS_MILES)
+                _index_version = version
+                _index_built = time.monotonic()
+    return _index
+
+
+def resolve_nearest_bar(latitude, longitude) -> Optional[Tuple[int, float]]:
+    """Nearest active bar within GEOFENCE_RADIUS_MILES of a point, or None."""
+    return get_bar_index().nearest(latitude, longitude)
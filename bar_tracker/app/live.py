@@ -0,0 +1,238 @@
+"""
+Live bar changes for clients that keep the bar list open.
+
+Writers publish small per-bar diffs: the displayed occupancy and line after
+reports are folded into a bar, and users_nearby after a check-in. Readers
+follow them from a cursor, either as Server-Sent Events or by long polling,
+instead of re-fetching /bars/. Cursors are opaque strings. A reader whose
+cursor is unknown or has fallen out of the backlog is told to reset, i.e. to
+refetch /bars/ and continue from the cursor it is handed.
+
+Without REDIS_URL changes live in an in-process ring buffer, so readers only
+see changes made by their own worker process. With REDIS_URL they go through
+a capped Redis stream shared by every web and Celery worker.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from django.conf import settings
+from app.models import Bar
+
+logger = logging.getLogger(__name__)
+
+LIVE_STREAM_KEY = "bars:live"
+STREAM_ID = re.compile(r"(\d+)-(\d+)")
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LocalBroadcaster:
+    """Ring buffer of the last `backlog` changes, for a single process."""
+
+    def __init__(self, backlog):
+        # Cursors from before a restart must not match this buffer
+        self._epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._events = deque(maxlen=backlog)
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    def _cursor(self, seq):
+        return f"{self._epoch}-{seq}"
+
+    def _events_after(self, after):
+        epoch, _, seq = after.partition("-")
+        if epoch != self._epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        seq = int(seq)
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        if seq < oldest - 1:
+            return None
+        return [(self._cursor(s), changes) for s, changes in self._events if s > seq]
+
+    def publish(self, changes):
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, changes))
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def cursor(self):
+        with self._lock:
+            return self._cursor(self._seq)
+
+    async def read(self, after, timeout):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            events = self._events_after(after)
+            if events == []:
+                self._waiters.add(waiter)
+        if events != []:
+            return events
+
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        with self._lock:
+            return self._events_after(after)
+
+
+class RedisBroadcaster:
+    """Capped Redis stream, cursors are stream entry ids."""
+
+    def __init__(self, url, backlog, key=LIVE_STREAM_KEY):
+        import redis
+        import redis.asyncio
+
+        self.key = key
+        self.backlog = backlog
+        self._client = redis.Redis.from_url(url)
+        self._async_client = redis.asyncio.Redis.from_url(url)
+
+    def publish(self, changes):
+        self._client.xadd(
+            self.key,
+            {"changes": json.dumps(changes)},
+            maxlen=self.backlog,
+            approximate=True,
+        )
+
+    async def cursor(self):
+        newest = await self._async_client.xrevrange(self.key, count=1)
+        return newest[0][0].decode() if newest else "0-0"
+
+    async def read(self, after, timeout):
+        match = STREAM_ID.fullmatch(after)
+        if match is None:
+            return None
+        position = (int(match[1]), int(match[2]))
+        # Entries between the cursor and the oldest kept one may have been trimmed
+        oldest = await self._async_client.xrange(self.key, count=1)
+        if oldest and position < _stream_position(oldest[0][0]):
+            return None
+        newest = await self._async_client.xrevrange(self.key, count=1)
+        if position > (_stream_position(newest[0][0]) if newest else (0, 0)):
+            return None
+
+        response = await self._async_client.xread(
+            {self.key: after}, block=max(int(timeout * 1000), 1)
+        )
+        return [
+            (entry_id.decode(), json.loads(fields[b"changes"]))
+            for _, entries in response
+            for entry_id, fields in entries
+        ]
+
+
+def _stream_position(entry_id):
+    ms, _, seq = entry_id.decode().partition("-")
+    return int(ms), int(seq)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            if settings.REDIS_URL:
+                _broadcaster = RedisBroadcaster(
+                    settings.REDIS_URL, settings.LIVE_BACKLOG
+                )
+            else:
+                _broadcaster = LocalBroadcaster(settings.LIVE_BACKLOG)
+        return _broadcaster
+
+
+def publish_bar_changes(changes):
+    """
+    Publish per-bar diffs, each a dict with the bar "id" and its changed fields.
+    A failed publish is logged, never raised, the write it describes has already
+    committed.
+    """
+    if not changes:
+        return
+    try:
+        get_broadcaster().publish(changes)
+    except Exception:
+        logger.warning("Could not publish bar changes", exc_info=True)
+
+
+def publish_users_nearby(bar_ids):
+    """Publish the current users_nearby of the given bars."""
+    bar_ids = [bar_id for bar_id in bar_ids if bar_id not in (None, -1)]
+    if bar_ids:
+        publish_bar_changes(
+            list(Bar.objects.filter(id__in=bar_ids).values("id", "users_nearby"))
+        )
+
+
+async def current_cursor():
+    return await get_broadcaster().cursor()
+
+
+async def read_changes(after, timeout):
+    """
+    Changes published after the cursor as a list of (cursor, changes), waiting up
+    to timeout seconds for the first one. Empty on timeout, None when the cursor
+    can't be resumed.
+    """
+    return await get_broadcaster().read(after, timeout)
+
+
+def merge_changes(events):
+    """Collapse the changes of several events into one diff per bar."""
+    merged = {}
+    for _, changes in events:
+        for change in changes:
+            merged.setdefault(change["id"], {}).update(change)
+    return list(merged.values())
+
+
+def _sse_frame(event, data, cursor=None):
+    frame = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {cursor}\n{frame}" if cursor is not None else frame
+
+
+async def sse_events(after=None):
+    """
+    Server-Sent Events for the live stream, starting after the cursor when given.
+    A "reset" event carries the cursor to continue from after refetching /bars/,
+    every "changes" event carries a list of per-bar diffs. The stream ends after
+    LIVE_STREAM_SECONDS so connections are recycled, EventSource reconnects with
+    the last event id.
+    """
+    deadline = time.monotonic() + settings.LIVE_STREAM_SECONDS
+    if after is None:
+        after = await current_cursor()
+        yield _sse_frame("ready", {}, after)
+
+    while (remaining := deadline - time.monotonic()) > 0:
+        events = await read_changes(
+            after, min(settings.LIVE_KEEPALIVE_SECONDS, remaining)
+        )
+        if events is None:
+            after = await current_cursor()
+            yield _sse_frame("reset", {}, after)
+        elif not events:
+            yield ": keepalive\n\n"
+        else:
+            for after, changes in events:
+                yield _sse_frame("changes", changes, after)
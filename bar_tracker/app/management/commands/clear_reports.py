@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from app.tasks import clear_reports
+
+
+class Command(BaseCommand):
+
+    help = "Rolls up raw reports past the retention window and deletes them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=None,
+            help="Keep the last N hours of raw reports (default REPORT_RETENTION_HOURS).",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(clear_reports(retention_hours=options["hours"]))
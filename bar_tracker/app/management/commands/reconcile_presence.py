@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from app.presence import reconcile_users_nearby
+from app.utils import expire_displayed_values
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Expires stale user presences, recounts users near each bar and clears "
+        "displayed values that have left the display window"
+    )
+
+    def handle(self, *args, **options):
+        expired, updated = reconcile_users_nearby()
+        self.stdout.write(
+            f"Expired {expired} presences, corrected {updated} bar counts."
+        )
+        cleared = expire_displayed_values()
+        self.stdout.write(f"Cleared displayed values of {cleared} bars.")
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from app.fraud import rescore_reports
+
+
+class Command(BaseCommand):
+
+    help = "Recomputes the fraud flags of recent reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=12,
+            help="Rescore reports submitted in the last N hours (default 12).",
+        )
+
+    def handle(self, *args, **options):
+        end = now()
+        start = end - timedelta(hours=options["hours"])
+        scored, flagged = rescore_reports(start, end)
+        self.stdout.write(f"Rescored {scored} reports, flagged {flagged}.")
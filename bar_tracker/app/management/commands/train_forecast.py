@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from app.forecast import train_forecast
+
+
+class Command(BaseCommand):
+
+    help = "Fits the occupancy forecast to the report history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--weeks",
+            type=int,
+            default=None,
+            help="Train on the last N weeks of history (default FORECAST_HISTORY_WEEKS).",
+        )
+
+    def handle(self, *args, **options):
+        fit = train_forecast(options["weeks"])
+        if fit is None:
+            self.stdout.write("No report history to train on.")
+            return
+        self.stdout.write(
+            f"Trained on {fit.samples} hourly samples, "
+            f"{len(fit.bar_parameters)} bars forecast."
+        )
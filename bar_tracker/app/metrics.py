@@ -0,0 +1,232 @@
+"""
+Request metrics.
+
+RequestMetricsMiddleware times every request and counts the queries it runs
+through connection.execute_wrapper, then records them per view in an
+in-process registry. The /metrics endpoint renders that registry in the
+Prometheus text format. Each gunicorn worker keeps its own registry, so the
+scraper sees one series per worker.
+
+Requests slower than SLOW_REQUEST_MS are logged with every query they ran,
+which is usually enough to spot an N+1 without reproducing it.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# Longest SQL statement kept in a slow request trace
+TRACE_SQL_LENGTH = 1000
+
+
+class Histogram:
+    """Prometheus style histogram with fixed upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.db_seconds = 0.0
+        self.statuses = Counter()
+
+
+HISTOGRAMS = (
+    ("latency", "request_duration_seconds", "Time spent handling the request"),
+    ("queries", "request_db_queries", "Database queries run by the request"),
+    ("response_size", "response_size_bytes", "Size of the response body"),
+)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Thread safe per view request metrics."""
+
+    def __init__(self, prefix="bar_tracker"):
+        self.prefix = prefix
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, status, duration, queries, db_duration, size=None):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            metrics.latency.observe(duration)
+            metrics.queries.observe(queries)
+            metrics.db_seconds += db_duration
+            metrics.statuses[status] += 1
+            if size is not None:
+                metrics.response_size.observe(size)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self) -> str:
+        """The registry in the Prometheus text exposition format."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                f"# HELP {self.prefix}_requests_total Requests handled",
+                f"# TYPE {self.prefix}_requests_total counter",
+            ]
+            for view, metrics in views:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(
+                        f'{self.prefix}_requests_total{{view="{_label(view)}",'
+                        f'status="{status}"}} {count}'
+                    )
+
+            for attribute, name, description in HISTOGRAMS:
+                lines.append(f"# HELP {self.prefix}_{name} {description}")
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for view, metrics in views:
+                    lines.extend(
+                        getattr(metrics, attribute).render(
+                            f"{self.prefix}_{name}", f'view="{_label(view)}"'
+                        )
+                    )
+
+            lines.append(
+                f"# HELP {self.prefix}_request_db_duration_seconds "
+                "Time spent in database queries"
+            )
+            lines.append(f"# TYPE {self.prefix}_request_db_duration_seconds counter")
+            for view, metrics in views:
+                lines.append(
+                    f'{self.prefix}_request_db_duration_seconds{{view="{_label(view)}"}}'
+                    f" {metrics.db_seconds}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class QueryRecorder:
+    """execute_wrapper that counts and times queries, keeping their SQL if asked."""
+
+    def __init__(self, keep_sql=False):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.duration = 0.0
+        self.trace = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql:
+                # Parameters are left out, they can hold tokens and emails
+                self.trace.append(
+                    {"sql": sql[:TRACE_SQL_LENGTH], "ms": round(elapsed * 1000, 3)}
+                )
+
+
+def _add_recorder(recorder):
+    connection.execute_wrappers.append(recorder)
+
+
+def _remove_recorder(recorder):
+    connection.execute_wrappers.remove(recorder)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(keep_sql=settings.SLOW_REQUEST_MS is not None)
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(keep_sql=settings.SLOW_REQUEST_MS is not None)
+        start = time.perf_counter()
+        # Under ASGI the async ORM and any sync code run on one thread per
+        # request, so the recorder goes on that thread's connection
+        await sync_to_async(_add_recorder)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_recorder)(recorder)
+        self.record(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    def record(self, request, response, duration, recorder):
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else "unmatched"
+        size = None if response.streaming else len(response.content)
+        registry.observe(
+            view,
+            response.status_code,
+            duration,
+            recorder.count,
+            recorder.duration,
+            size,
+        )
+
+        slow_ms = settings.SLOW_REQUEST_MS
+        if slow_ms is not None and duration * 1000 > slow_ms:
+            logger.warning(
+                "Slow request",
+                extra={
+                    "view": view,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration * 1000, 3),
+                    "query_count": recorder.count,
+                    "db_ms": round(recorder.duration * 1000, 3),
+                    "queries": recorder.trace,
+                },
+            )
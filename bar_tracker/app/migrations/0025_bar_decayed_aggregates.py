@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:40
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def seed_decayed_aggregates(apps, schema_editor):
+    """Fold the last hour of reports into the new aggregates, oldest first."""
+    Bar = apps.get_model('app', 'Bar')
+    OccupancyReport = apps.get_model('app', 'OccupancyReport')
+    one_hour_ago = now() - timedelta(hours=1)
+    for bar in Bar.objects.all():
+        reports = OccupancyReport.objects.filter(
+            bar=bar, timestamp__gte=one_hour_ago
+        ).order_by('timestamp')
+        for report in reports:
+            if bar.decay_anchor is not None:
+                minutes = (report.timestamp - bar.decay_anchor).total_seconds() / 60
+                decay = 0.5 ** (minutes / 15)
+                bar.decayed_occupancy_sum *= decay
+                bar.decayed_line_sum *= decay
+                bar.decayed_weight_total *= decay
+            bar.decayed_occupancy_sum += report.occupancy_level
+            # Missing line waits are skipped, see Bar.fold_report
+            if report.line_wait is not None:
+                bar.decayed_line_sum += report.line_wait
+            bar.decayed_weight_total += 1
+            bar.decay_anchor = report.timestamp
+        if bar.decay_anchor is not None:
+            bar.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_sitestatistics_remove_occupancyreport_sunrise'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bar',
+            name='decay_anchor',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bar',
+            name='decayed_line_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bar',
+            name='decayed_occupancy_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bar',
+            name='decayed_weight_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(seed_decayed_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:46
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the reports table against inserts
+    atomic = False
+
+    dependencies = [
+        ('app', '0026_userprofile_presence_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='occupancyreport',
+            index=models.Index(fields=['bar', '-timestamp'], name='report_bar_recent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='occupancyreport',
+            index=models.Index(condition=models.Q(('flagged', False)), fields=['bar', '-timestamp'], name='report_bar_recent_ok_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='occupancyreport',
+            index=models.Index(fields=['user', 'bar', 'timestamp'], name='report_user_bar_time_idx'),
+        ),
+    ]
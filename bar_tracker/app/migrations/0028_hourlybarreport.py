@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:47
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('app', '0027_occupancyreport_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyBarReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('report_count', models.IntegerField(default=0)),
+                ('flagged_count', models.IntegerField(default=0)),
+                ('mean_occupancy', models.FloatField(blank=True, null=True)),
+                ('mean_line_wait', models.FloatField(blank=True, null=True)),
+                ('mean_temperature', models.FloatField(blank=True, null=True)),
+                ('weather', models.CharField(blank=True, null=True)),
+            ],
+        ),
+        AddIndexConcurrently(
+            model_name='occupancyreport',
+            index=models.Index(fields=['timestamp'], name='report_timestamp_idx'),
+        ),
+        migrations.AddField(
+            model_name='hourlybarreport',
+            name='bar',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_reports', to='app.bar'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlybarreport',
+            constraint=models.UniqueConstraint(fields=('bar', 'hour'), name='unique_bar_hour'),
+        ),
+    ]
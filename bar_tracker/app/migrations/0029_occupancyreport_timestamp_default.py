@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0028_hourlybarreport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occupancyreport',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Power
+
+
+def seed_trust_weights(apps, schema_editor):
+    UserProfile = apps.get_model('app', 'UserProfile')
+    UserProfile.objects.filter(strikes__gt=0).update(
+        trust_weight=Power(Value(0.5), F('strikes'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0029_occupancyreport_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='trust_weight',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.RunPython(seed_trust_weights, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('strikes__gt', 3)), fields=['user'], name='profile_banned_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+# Bumps change_version only when a column clients are shown changes, so a
+# recount that writes the same users_nearby doesn't resend the bar. Full saves
+# from the ORM can't move the version backwards.
+CREATE_TRIGGER = """
+CREATE FUNCTION app_bar_bump_change_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR (
+        NEW.name, NEW.latitude, NEW.longitude, NEW.is_active, NEW.users_nearby,
+        NEW.displayed_current_occupancy, NEW.displayed_current_line
+    ) IS DISTINCT FROM (
+        OLD.name, OLD.latitude, OLD.longitude, OLD.is_active, OLD.users_nearby,
+        OLD.displayed_current_occupancy, OLD.displayed_current_line
+    ) THEN
+        NEW.change_version := txid_current();
+    ELSE
+        NEW.change_version := OLD.change_version;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER app_bar_change_version
+    BEFORE INSERT OR UPDATE ON app_bar
+    FOR EACH ROW EXECUTE FUNCTION app_bar_bump_change_version();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER app_bar_change_version ON app_bar;
+DROP FUNCTION app_bar_bump_change_version();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0030_userprofile_trust_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bar',
+            name='change_version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
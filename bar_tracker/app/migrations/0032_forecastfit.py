@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0031_bar_change_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastFit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trained_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('samples', models.IntegerField(default=0)),
+                ('temperature_mean', models.FloatField(blank=True, null=True)),
+                ('temperature_effect', models.FloatField(default=0)),
+                ('weather_effects', models.JSONField(default=dict)),
+                ('bar_parameters', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:05
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def reseed_decayed_aggregates(apps, schema_editor):
+    """
+    Refold the last hour of reports with the rule of Bar.fold_report: reports
+    without a line wait count towards the occupancy only.
+    """
+    Bar = apps.get_model('app', 'Bar')
+    OccupancyReport = apps.get_model('app', 'OccupancyReport')
+    one_hour_ago = now() - timedelta(hours=1)
+    for bar in Bar.objects.filter(decay_anchor__gte=one_hour_ago):
+        bar.decayed_occupancy_sum = 0
+        bar.decayed_line_sum = 0
+        bar.decayed_weight_total = 0
+        bar.decayed_line_weight = 0
+        bar.decay_anchor = None
+        reports = OccupancyReport.objects.filter(
+            bar=bar, timestamp__gte=one_hour_ago, flagged=False
+        ).order_by('timestamp')
+        for report in reports:
+            if bar.decay_anchor is not None:
+                minutes = (report.timestamp - bar.decay_anchor).total_seconds() / 60
+                decay = 0.5 ** (minutes / 15)
+                bar.decayed_occupancy_sum *= decay
+                bar.decayed_line_sum *= decay
+                bar.decayed_weight_total *= decay
+                bar.decayed_line_weight *= decay
+            bar.decayed_occupancy_sum += report.occupancy_level
+            bar.decayed_weight_total += 1
+            if report.line_wait is not None:
+                bar.decayed_line_sum += report.line_wait
+                bar.decayed_line_weight += 1
+            bar.decay_anchor = report.timestamp
+        bar.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0032_forecastfit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bar',
+            name='decayed_line_weight',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(reseed_decayed_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0033_bar_decayed_line_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hourlybarreport',
+            name='last_report_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:38
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0034_hourlybarreport_last_report_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occupancyreport',
+            name='line_wait',
+            field=models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(60)]),
+        ),
+    ]
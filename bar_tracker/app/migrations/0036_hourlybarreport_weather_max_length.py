@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0035_occupancyreport_line_wait_minutes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hourlybarreport',
+            name='weather',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
@@ -1,9 +1,25 @@
+from datetime import timedelta
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.timezone import now
 from app.weather_models import CurrentWeather
 from django.contrib.auth.models import User
 
+HALF_LIFE_MINUTES = 15
+DISPLAY_WINDOW = timedelta(hours=1)
+# Users with more strikes than this are banned and their reports are ignored
+STRIKE_LIMIT = 3
+# Each strike halves the weight of a user's reports in the displayed values
+TRUST_DECAY = 0.5
+# Line waits are minutes. The iOS app sends its 0-60 minute slider in steps of
+# 5, 0 meaning no wait.
+MAX_LINE_WAIT = 60
+
+
+def decay_factor(elapsed: timedelta) -> float:
+    """Half life weight for a report that is `elapsed` old."""
+    return 0.5 ** (elapsed.total_seconds() / 60 / HALF_LIFE_MINUTES)
+
 
 class SiteStatistics(models.Model):
     total_users = models.IntegerField(default=0)
@@ -62,6 +78,70 @@ class Bar(models.Model):
     )
     is_active = models.BooleanField(default=True)
     displayed_current_line = models.IntegerField(null=True, blank=True)
+    # Half life weighted sums of recent reports, decayed to decay_anchor
+    decayed_occupancy_sum = models.FloatField(default=0)
+    decayed_line_sum = models.FloatField(default=0)
+    decayed_weight_total = models.FloatField(default=0)
+    # Weight of the reports with a line wait, the others don't count towards it
+    decayed_line_weight = models.FloatField(default=0)
+    decay_anchor = models.DateTimeField(null=True, blank=True)
+    # Id of the last transaction that changed what clients are shown, kept by a
+    # database trigger (migration 0031) and read by the /bars/?since= delta sync
+    change_version = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    def fold_report(self, timestamp, occupancy_level, line_wait, weight=1.0):
+        """
+        Fold a single report into the decayed aggregates in O(1).
+        The sums are kept decayed to decay_anchor, the newest report timestamp.
+        A report arriving after a gap longer than the display window starts over,
+        since everything folded before it has left the window.
+        """
+        anchor = self.decay_anchor
+        if anchor is None or timestamp - anchor > DISPLAY_WINDOW:
+            self.decayed_occupancy_sum = 0
+            self.decayed_line_sum = 0
+            self.decayed_weight_total = 0
+            self.decayed_line_weight = 0
+            anchor = timestamp
+        if timestamp >= anchor:
+            decay = decay_factor(timestamp - anchor)
+            self.decayed_occupancy_sum *= decay
+            self.decayed_line_sum *= decay
+            self.decayed_weight_total *= decay
+            self.decayed_line_weight *= decay
+            anchor = timestamp
+        else:
+            weight *= decay_factor(anchor - timestamp)
+
+        self.decayed_occupancy_sum += occupancy_level * weight
+        self.decayed_weight_total += weight
+        if line_wait is not None:
+            self.decayed_line_sum += line_wait * weight
+            self.decayed_line_weight += weight
+        self.decay_anchor = anchor
+
+    def decayed_display_values(self, current_time=None):
+        """
+        Displayed occupancy and line from the decayed aggregates.
+        Decaying the sums to current_time scales numerator and denominator by the
+        same factor, so only the window check depends on the time of the read.
+        The line is None when no report in the window had a line wait.
+        """
+        current_time = current_time or now()
+        if (
+            self.decay_anchor is None
+            or not self.decayed_weight_total
+            or current_time - self.decay_anchor > DISPLAY_WINDOW
+        ):
+            return None, None
+        return (
+            round(self.decayed_occupancy_sum / self.decayed_weight_total),
+            (
+                round(self.decayed_line_sum / self.decayed_line_weight)
+                if self.decayed_line_weight
+                else None
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -71,13 +151,14 @@ class OccupancyReport(models.Model):
     bar = models.ForeignKey(Bar, on_delete=models.CASCADE, related_name="reports")
     # user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reports")
     user = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add so reports queued offline keep their submission time
+    timestamp = models.DateTimeField(default=now, editable=False)
     flagged = models.BooleanField(default=False)
     occupancy_level = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(10)]
     )
     line_wait = models.IntegerField(
-        validators=[MinValueValidator(1), MaxValueValidator(10)],
+        validators=[MinValueValidator(0), MaxValueValidator(MAX_LINE_WAIT)],
         null=True,
         blank=True,
     )
@@ -85,6 +166,23 @@ class OccupancyReport(models.Model):
     weather = models.CharField(blank=True, null=True)
     closed_event = models.BooleanField(blank=True, default=False)
 
+    class Meta:
+        indexes = [
+            # Recent reports per bar for the displayed values
+            models.Index(fields=["bar", "-timestamp"], name="report_bar_recent_idx"),
+            models.Index(
+                fields=["bar", "-timestamp"],
+                name="report_bar_recent_ok_idx",
+                condition=models.Q(flagged=False),
+            ),
+            # Cooldown checks, also serves lookups by user alone
+            models.Index(
+                fields=["user", "bar", "timestamp"], name="report_user_bar_time_idx"
+            ),
+            # Hour by hour scans of the retention job in app/tasks.py
+            models.Index(fields=["timestamp"], name="report_timestamp_idx"),
+        ]
+
     @property
     def day_of_week(self):
         return self.timestamp.weekday()
@@ -99,21 +197,88 @@ class OccupancyReport(models.Model):
         return f"{self.bar.name} - Level {self.occupancy_level} at {self.timestamp}"
 
 
+class HourlyBarReport(models.Model):
+    """Hourly per-bar rollup of the OccupancyReports removed by the retention job."""
+
+    bar = models.ForeignKey(
+        Bar, on_delete=models.CASCADE, related_name="hourly_reports"
+    )
+    hour = models.DateTimeField()
+    # Counts and means cover unflagged reports only
+    report_count = models.IntegerField(default=0)
+    flagged_count = models.IntegerField(default=0)
+    mean_occupancy = models.FloatField(null=True, blank=True)
+    mean_line_wait = models.FloatField(null=True, blank=True)
+    mean_temperature = models.FloatField(null=True, blank=True)
+    # Most common weather of the hour's reports
+    weather = models.CharField(max_length=50, blank=True, null=True)
+    # Newest report id rolled up into the hour, reports up to it may be deleted
+    last_report_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bar", "hour"], name="unique_bar_hour")
+        ]
+
+    def __str__(self):
+        return f"{self.bar.name} - {self.hour}: {self.report_count} reports"
+
+
+class ForecastFit(models.Model):
+    """Parameters of one occupancy forecast training run, see app/forecast.py."""
+
+    trained_at = models.DateTimeField(default=now)
+    # Hourly samples the fit was trained on
+    samples = models.IntegerField(default=0)
+    # Temperatures are centered on the training mean, the effect is per 10 degrees
+    temperature_mean = models.FloatField(null=True, blank=True)
+    temperature_effect = models.FloatField(default=0)
+    # Weather condition -> occupancy offset, relative to clear skies
+    weather_effects = models.JSONField(default=dict)
+    # Bar id -> [baseline, 7 weekday effects from Monday, 24 hour effects]
+    bar_parameters = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Forecast fit {self.trained_at} ({len(self.bar_parameters)} bars)"
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     email = models.EmailField(unique=True, null=True, blank=True)
     submissions = models.IntegerField(default=0)
     strikes = models.IntegerField(default=0)
+    # TRUST_DECAY ** strikes, kept in sync by app/reputation.py
+    trust_weight = models.FloatField(default=1.0)
     is_near_bar = models.IntegerField(null=True, default=-1)
     last_updated_location = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Live presence counts per bar and bulk expiry, see app/presence.py
+            models.Index(
+                fields=["is_near_bar", "last_updated_location"],
+                name="profile_presence_idx",
+            ),
+            models.Index(
+                fields=["last_updated_location"], name="profile_location_updated_idx"
+            ),
+            # Banned users, excluded from report queries in app/reputation.py
+            models.Index(
+                fields=["user"],
+                condition=models.Q(strikes__gt=STRIKE_LIMIT),
+                name="profile_banned_idx",
+            ),
+        ]
+
     def increment_strikes(self):
         """increment the strike count for the user"""
         self.strikes += 1
+        self.trust_weight = TRUST_DECAY**self.strikes
         self.save()
 
     def reset_strikes(self):
         self.strikes = 0
+        self.trust_weight = 1.0
         self.save()
 
     def __str__(self):
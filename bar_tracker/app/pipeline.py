@@ -0,0 +1,120 @@
+"""
+Post-submission pipeline for occupancy reports.
+
+The submit endpoints only store reports. Everything else (weather, folding
+into the bar's displayed values, the fraud check, strikes and submission
+counting) runs here after the insert commits, in one of three modes selected
+by settings.REPORT_PIPELINE:
+
+    "eager"  - in the request thread, as before
+    "thread" - on an in-process thread pool, the default
+    "celery" - on a Celery worker, see app/tasks.py. Only set this where a
+               worker consumes CELERY_BROKER_URL, render.yaml runs none.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from app.models import OccupancyReport, UserProfile
+from app.weather_models import CurrentWeather
+from app.fraud import flag_reports
+from app.reputation import get_trust_weights, record_strikes
+from app.utils import fold_reports_into_bar
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def process_reports(report_ids):
+    """
+    Run the post-submission steps for stored reports. Each touched bar is
+    folded once, and weather, fraud flags, strikes and submission counts are
+    written with one UPDATE each.
+    """
+    reports = list(OccupancyReport.objects.filter(id__in=report_ids))
+    if not reports:
+        return
+
+    weather = CurrentWeather.objects.filter(id=1).first()
+    if weather is not None:
+        OccupancyReport.objects.filter(id__in=report_ids).update(
+            temperature=weather.temperature, weather=weather.weather_string
+        )
+
+    reports_by_bar = defaultdict(list)
+    for report in reports:
+        reports_by_bar[report.bar_id].append(report)
+    trust_weights = get_trust_weights({report.user for report in reports})
+    for bar_id, bar_reports in reports_by_bar.items():
+        fold_reports_into_bar(bar_id, bar_reports, trust_weights)
+
+    flagged = flag_reports(reports)
+
+    strikes = Counter(report.user for report in flagged)
+    submissions = Counter(report.user for report in reports)
+    user_ids = dict(
+        User.objects.filter(username__in=submissions).values_list("username", "id")
+    )
+    record_strikes(
+        {
+            user_id: strikes[username]
+            for username, user_id in user_ids.items()
+            if strikes[username]
+        }
+    )
+    if user_ids:
+        UserProfile.objects.filter(user_id__in=user_ids.values()).update(
+            submissions=F("submissions")
+            + Case(
+                *[
+                    When(user_id=user_id, then=Value(submissions[username]))
+                    for username, user_id in user_ids.items()
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+
+
+def _process_reports_in_thread(report_ids):
+    try:
+        process_reports(report_ids)
+    except Exception:
+        logger.exception(f"Error processing reports {report_ids}")
+    finally:
+        # Pool threads outlive requests, don't leak their connections
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.REPORT_PIPELINE_THREADS,
+            thread_name_prefix="report-pipeline",
+        )
+    return _executor
+
+
+def dispatch_reports(report_ids):
+    """Hand stored reports to the configured pipeline mode right away."""
+    mode = settings.REPORT_PIPELINE
+    if mode == "celery":
+        from app.tasks import process_reports_task
+
+        process_reports_task.delay(report_ids)
+    elif mode == "thread":
+        _get_executor().submit(_process_reports_in_thread, report_ids)
+    else:
+        process_reports(report_ids)
+
+
+def enqueue_reports(report_ids):
+    """Process reports once the transaction that inserted them commits."""
+    report_ids = list(report_ids)
+    transaction.on_commit(lambda: dispatch_reports(report_ids))
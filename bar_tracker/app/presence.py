@@ -0,0 +1,76 @@
+"""
+Presence is keyed on UserProfile.last_updated_location. A user counts towards
+the bar in UserProfile.is_near_bar only while their last location update is
+younger than PRESENCE_TTL_MINUTES. Clients report presence only on geofence
+entry and exit, so the TTL is hours long, see the setting. Both lookups below
+are range scans on the UserProfile presence indexes.
+"""
+
+from datetime import timedelta
+from typing import Dict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, Q, Value, When
+from django.utils.timezone import now
+from app.models import Bar, UserProfile
+
+
+def presence_cutoff(current_time=None):
+    """Oldest location update that still counts as present."""
+    current_time = current_time or now()
+    return current_time - timedelta(minutes=settings.PRESENCE_TTL_MINUTES)
+
+
+def live_users_nearby(bar_id, current_time=None) -> int:
+    """Number of users with an unexpired presence at a bar."""
+    return UserProfile.objects.filter(
+        is_near_bar=bar_id, last_updated_location__gte=presence_cutoff(current_time)
+    ).count()
+
+
+def live_presence_counts(current_time=None) -> Dict[int, int]:
+    """Map of bar_id -> number of users with an unexpired presence there."""
+    counts = (
+        UserProfile.objects.filter(
+            last_updated_location__gte=presence_cutoff(current_time)
+        )
+        .exclude(is_near_bar=-1)
+        .values("is_near_bar")
+        .annotate(users=Count("id"))
+    )
+    return {row["is_near_bar"]: row["users"] for row in counts}
+
+
+def expire_stale_presences(current_time=None) -> int:
+    """Clear the bar of every user whose presence has expired, in one UPDATE."""
+    return (
+        UserProfile.objects.filter(
+            Q(last_updated_location__lt=presence_cutoff(current_time))
+            | Q(last_updated_location__isnull=True)
+        )
+        .exclude(is_near_bar=-1)
+        .update(is_near_bar=-1)
+    )
+
+
+def reconcile_users_nearby(current_time=None):
+    """
+    Expire stale presences and rewrite Bar.users_nearby from the live counts.
+    Returns (expired presences, bars updated).
+    """
+    with transaction.atomic():
+        expired = expire_stale_presences(current_time)
+        counts = live_presence_counts(current_time)
+        updated = (
+            Bar.objects.exclude(id__in=counts)
+            .exclude(users_nearby=0)
+            .update(users_nearby=0)
+        )
+        if counts:
+            updated += Bar.objects.filter(id__in=counts).update(
+                users_nearby=Case(
+                    *[When(id=bar_id, then=Value(n)) for bar_id, n in counts.items()],
+                    default=Value(0),
+                )
+            )
+    return expired, updated
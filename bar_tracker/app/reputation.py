@@ -0,0 +1,76 @@
+"""
+User reputation.
+
+Every strike halves a user's trust weight, which scales the weight of their
+reports in the displayed values. Users with more than STRIKE_LIMIT strikes are
+banned. Their reports stay untouched in the table and are left out at query
+time by exclude_banned, which joins against the partial profile_banned_idx
+index instead of rewriting every historical row.
+
+Reports store the submitting user's token, which is also their username, so
+lookups go through auth_user's unique username index.
+"""
+
+from typing import Dict, Iterable
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Power
+from app.models import UserProfile, STRIKE_LIMIT, TRUST_DECAY
+
+
+def banned_usernames():
+    """Subquery of the usernames of banned users."""
+    return UserProfile.objects.filter(strikes__gt=STRIKE_LIMIT).values("user__username")
+
+
+def exclude_banned(reports):
+    """Filter a report queryset down to reports from users who aren't banned."""
+    return reports.exclude(user__in=banned_usernames())
+
+
+def with_trust_weights(reports):
+    """
+    Drop banned users' reports from a report queryset and annotate the rest with
+    their author's trust weight as `trust_weight`.
+    """
+    trust_weight = UserProfile.objects.filter(user__username=OuterRef("user")).values(
+        "trust_weight"
+    )[:1]
+    return exclude_banned(reports).annotate(
+        trust_weight=Coalesce(Subquery(trust_weight), Value(1.0))
+    )
+
+
+def get_trust_weights(usernames: Iterable[str]) -> Dict[str, float]:
+    """
+    Map usernames to the weight of their reports, 0 for banned users.
+    Users without a profile have full trust.
+    """
+    weights = {username: 1.0 for username in usernames}
+    profiles = UserProfile.objects.filter(user__username__in=weights).values_list(
+        "user__username", "strikes", "trust_weight"
+    )
+    for username, strikes, trust_weight in profiles:
+        weights[username] = 0.0 if strikes > STRIKE_LIMIT else trust_weight
+    return weights
+
+
+def record_strikes(strikes_by_user_id: Dict[int, int]):
+    """
+    Add strikes to users and update their trust weight, for all users in a
+    single UPDATE. Postgres evaluates both assignments against the old row, so
+    the weight always matches the new strike count.
+    """
+    if not strikes_by_user_id:
+        return
+    increment = Case(
+        *[
+            When(user_id=user_id, then=Value(count))
+            for user_id, count in strikes_by_user_id.items()
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    UserProfile.objects.filter(user_id__in=strikes_by_user_id).update(
+        strikes=F("strikes") + increment,
+        trust_weight=Power(Value(TRUST_DECAY), F("strikes") + increment),
+    )
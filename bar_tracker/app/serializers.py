@@ -1,7 +1,7 @@
 # yourapp/serializers.py
 
 from rest_framework import serializers
-from .models import UserProfile
+from .models import MAX_LINE_WAIT, UserProfile
 
 
 class UpdateEmailSerializer(serializers.ModelSerializer):
@@ -20,3 +20,21 @@ class UpdateEmailSerializer(serializers.ModelSerializer):
         ):
             raise serializers.ValidationError("This email is already in use.")
         return value
+
+
+class OccupancySubmissionSerializer(serializers.Serializer):
+    bar_id = serializers.IntegerField()
+    occupancy_level = serializers.IntegerField(min_value=1, max_value=10)
+    # Optional like the model, a report without a wait only counts for occupancy
+    line_wait = serializers.IntegerField(
+        min_value=0, max_value=MAX_LINE_WAIT, required=False, allow_null=True
+    )
+
+
+class OccupancyBatchItemSerializer(OccupancySubmissionSerializer):
+    # When the report was made on the phone, for reports queued offline
+    timestamp = serializers.DateTimeField(required=False)
+
+
+class OccupancyBatchSerializer(serializers.Serializer):
+    reports = OccupancyBatchItemSerializer(many=True, allow_empty=False, max_length=100)
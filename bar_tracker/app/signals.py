@@ -1,11 +1,16 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile, SiteStatistics
+from .models import UserProfile, SiteStatistics, Bar
+from .caching import invalidate_bars_payload
+from .geo import invalidate_bar_locations
+from .authentication import forget_token
 from django.conf import settings
 from rest_framework.authtoken.models import Token
 from django.db import transaction
 
+BAR_LOCATION_FIELDS = {"latitude", "longitude", "is_active"}
+
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -20,6 +25,7 @@ def handle_user_deletion(sender, instance, **kwargs):
     # Note: UserProfile should be automatically deleted due to OneToOneField with CASCADE
     # Check if there are any UserProfiles without users and delete them
     UserProfile.objects.filter(user__isnull=True).delete()
+    transaction.on_commit(lambda: forget_token(instance.username))
     # Update total user count
     update_user_count()
 
@@ -41,3 +47,13 @@ def update_user_count():
         stats = SiteStatistics.get_instance()
         stats.total_users = User.objects.count()
         stats.save()
+
+
+@receiver(post_save, sender=Bar)
+@receiver(post_delete, sender=Bar)
+def handle_bar_change(sender, instance, **kwargs):
+    # Wait for the commit so a concurrent request can't re-cache the old values
+    transaction.on_commit(invalidate_bars_payload)
+    update_fields = kwargs.get("update_fields")
+    if update_fields is None or BAR_LOCATION_FIELDS & set(update_fields):
+        transaction.on_commit(invalidate_bar_locations)
@@ -0,0 +1,37 @@
+"""
+WhiteNoise for the ASGI middleware chain.
+
+WhiteNoiseMiddleware is sync only. Under uvicorn Django adapts it, and then
+every async view below it runs through async_to_sync on a thread, the long
+polls and event streams of app/live.py included. The static file lookup is a
+dict read, so this subclass does it on the event loop and only goes to a
+thread to open a file it is actually serving.
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Development only, this looks on disk
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -6,14 +6,169 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
 django.setup()
 import logging
-from app.models import OccupancyReport
+from celery import shared_task
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q
+from django.db.models.functions import TruncHour
+from django.utils.timezone import now
+from app.models import OccupancyReport, HourlyBarReport
+from app.pipeline import process_reports
+
 logger = logging.getLogger(__name__)
 
-def clear_reports():
-    deleted_count, _ = OccupancyReport.objects.all().delete()
-    message = f"Deleted {deleted_count} reports."
+UNFLAGGED = Q(flagged=False)
+# Report weather is unbounded text, the rollup column is not
+WEATHER_MAX_LENGTH = HourlyBarReport._meta.get_field("weather").max_length
+
+
+def _combine_means(mean_a, count_a, mean_b, count_b):
+    if mean_a is None or not count_a:
+        return mean_b
+    if mean_b is None or not count_b:
+        return mean_a
+    return (mean_a * count_a + mean_b * count_b) / (count_a + count_b)
+
+
+def rollup_hour(hour, batch_size=5000):
+    """
+    Roll one hour of raw reports into HourlyBarReport rows and delete them.
+    The rollup commits first, recording the newest report id it covers, then
+    the covered reports are deleted in batches that commit one at a time, so
+    no transaction holds locks on the whole hour. A run interrupted between
+    batches only rolls up reports past the recorded id when retried, so no
+    report is counted twice. Returns the number of raw reports deleted.
+    """
+    reports = OccupancyReport.objects.filter(
+        timestamp__gte=hour, timestamp__lt=hour + timedelta(hours=1)
+    )
+    with transaction.atomic():
+        existing = {
+            rollup.bar_id: rollup
+            for rollup in HourlyBarReport.objects.select_for_update().filter(hour=hour)
+        }
+        rolled_up_id = max(
+            (rollup.last_report_id for rollup in existing.values()), default=0
+        )
+        pending = reports.filter(id__gt=rolled_up_id)
+        last_report_id = pending.aggregate(last=Max("id"))["last"]
+        if last_report_id is not None:
+            pending = pending.filter(id__lte=last_report_id)
+            _merge_rollups(hour, pending, existing, last_report_id)
+            rolled_up_id = last_report_id
+
+    covered = reports.filter(id__lte=rolled_up_id).order_by("id")
+    deleted = 0
+    while True:
+        batch = list(covered.values_list("id", flat=True)[:batch_size])
+        if not batch:
+            break
+        # Outside of the rollup transaction, each batch commits on its own
+        deleted += OccupancyReport.objects.filter(id__in=batch).delete()[0]
+    return deleted
+
+
+def _merge_rollups(hour, reports, existing, last_report_id):
+    """Add the reports to the hour's rollups in `existing` and upsert them."""
+    stats = reports.values("bar_id").annotate(
+        report_count=Count("id", filter=UNFLAGGED),
+        flagged_count=Count("id", filter=~UNFLAGGED),
+        mean_occupancy=Avg("occupancy_level", filter=UNFLAGGED),
+        mean_line_wait=Avg("line_wait", filter=UNFLAGGED),
+        mean_temperature=Avg("temperature", filter=UNFLAGGED),
+    )
+    weather_counts = Counter()
+    for row in (
+        reports.exclude(weather__isnull=True)
+        .values("bar_id", "weather")
+        .annotate(n=Count("id"))
+    ):
+        weather_counts[(row["bar_id"], row["weather"])] = row["n"]
+
+    rollups = []
+    for row in stats:
+        bar_id = row["bar_id"]
+        weathers = [
+            (n, weather)
+            for (weather_bar_id, weather), n in weather_counts.items()
+            if weather_bar_id == bar_id
+        ]
+        rollup = existing.get(bar_id) or HourlyBarReport(bar_id=bar_id, hour=hour)
+        # Reports can land in an hour that was already rolled up, merge them
+        for field in ("mean_occupancy", "mean_line_wait", "mean_temperature"):
+            setattr(
+                rollup,
+                field,
+                _combine_means(
+                    getattr(rollup, field),
+                    rollup.report_count,
+                    row[field],
+                    row["report_count"],
+                ),
+            )
+        rollup.report_count += row["report_count"]
+        rollup.flagged_count += row["flagged_count"]
+        if weathers:
+            rollup.weather = max(weathers)[1][:WEATHER_MAX_LENGTH]
+        rollups.append(rollup)
+    # Every row of the hour carries the newest report id covered so far
+    for rollup in existing.values():
+        if rollup not in rollups:
+            rollups.append(rollup)
+    for rollup in rollups:
+        rollup.last_report_id = last_report_id
+
+    HourlyBarReport.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=["bar", "hour"],
+        update_fields=[
+            "report_count",
+            "flagged_count",
+            "mean_occupancy",
+            "mean_line_wait",
+            "mean_temperature",
+            "weather",
+            "last_report_id",
+        ],
+    )
+
+
+def clear_reports(retention_hours=None, batch_size=5000):
+    """
+    Retention job. Every whole hour of reports older than retention_hours is
+    rolled up into HourlyBarReport and its raw reports deleted, oldest first.
+    """
+    if retention_hours is None:
+        retention_hours = settings.REPORT_RETENTION_HOURS
+    cutoff = (now() - timedelta(hours=retention_hours)).replace(
+        minute=0, second=0, microsecond=0
+    )
+    hours_to_roll = (
+        OccupancyReport.objects.filter(timestamp__lt=cutoff)
+        .annotate(hour=TruncHour("timestamp"))
+        .values_list("hour", flat=True)
+        .distinct()
+        .order_by("hour")
+    )
+
+    deleted_count = 0
+    hours = 0
+    for hour in list(hours_to_roll):
+        deleted_count += rollup_hour(hour, batch_size=batch_size)
+        hours += 1
+
+    message = f"Rolled up {hours} hours, deleted {deleted_count} reports."
     logger.info(message)
     return message
 
+
+@shared_task
+def process_reports_task(report_ids):
+    process_reports(report_ids)
+
+
 if __name__ == "__main__":
-    clear_reports()
\ No newline at end of file
+    clear_reports()
@@ -1,13 +1,55 @@
-from django.test import TestCase
-from app.models import Bar, OccupancyReport
+import gzip
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from django.db import connection
+from django.db.models import F
+from django.core.cache import cache
+from unittest import mock, skipUnless
+import brotli
+import msgpack
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from app.forecast import reset_forecaster, train_forecast
+from app.models import Bar, HourlyBarReport, OccupancyReport, UserProfile
+from app.weather_models import CurrentWeather
 from django.contrib.auth.models import User
 from django.utils.timezone import now
-from app.apis.views import get_bars
+from app.authentication import resolve_user_id, token_users
+from app.caching import invalidate_bars_payload
+from app.live import current_cursor, publish_bar_changes
+from app.metrics import registry
+from app.pipeline import process_reports
+from app.static_files import AsyncWhiteNoiseMiddleware
+from app.utils import (
+    calculate_displayed_values,
+    calculate_displayed_values_for_bars,
+    fold_report_into_bar,
+    transition_user_location,
+    get_report_page,
+)
+
+# The ?since= delta reads Postgres transaction ids, see get_bars_delta
+postgres_only = skipUnless(connection.vendor == "postgresql", "Postgres delta sync")
 
 
 class GetBarTest(TestCase):
     def setUp(self):
-        self.user = User.objects.create_user(username="testuser", password="password")
+        self.user = User.objects.create_user(
+            username=str(uuid.uuid4()), password="password"
+        )
         self.bar = Bar.objects.create(name="Test Bar")
 
     def test_get_bars(self):
@@ -18,4 +60,965 @@ class GetBarTest(TestCase):
             line_wait=5,
             timestamp=now(),
         )
-        self.assertTrue(get_bars(self.bar))
+        cache.clear()
+        response = self.client.get(
+            reverse("get_bars"), HTTP_AUTHORIZATION=self.user.username
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Test Bar", [bar["name"] for bar in json.loads(response.content)])
+
+
+class GetBarsQueryCountTest(TestCase):
+    def setUp(self):
+        self.token = str(uuid.uuid4())
+
+    def create_bars(self, count):
+        for i in range(count):
+            bar = Bar.objects.create(name=f"Bar {i}")
+            OccupancyReport.objects.create(
+                user=self.token, bar=bar, occupancy_level=5, line_wait=3
+            )
+
+    def get_bars_query_count(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("get_bars"), HTTP_AUTHORIZATION=self.token
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_constant_in_bar_count(self):
+        self.create_bars(2)
+        few_bars_queries = self.get_bars_query_count()
+        self.create_bars(10)
+        many_bars_queries = self.get_bars_query_count()
+        self.assertEqual(few_bars_queries, many_bars_queries)
+
+    def test_get_bars_reads_aggregates_without_reports_query(self):
+        self.create_bars(3)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("get_bars"), HTTP_AUTHORIZATION=self.token)
+        self.assertFalse(
+            any("app_occupancyreport" in query["sql"] for query in queries)
+        )
+
+    def test_batched_values_match_single_bar_calculation(self):
+        self.create_bars(3)
+        bars = list(Bar.objects.all())
+        OccupancyReport.objects.create(
+            user=self.token, bar=bars[0], occupancy_level=9, line_wait=8
+        )
+        batched = calculate_displayed_values_for_bars(bars)
+        for bar in bars:
+            self.assertEqual(batched[bar.id], calculate_displayed_values(bar))
+
+    def test_bar_without_reports(self):
+        empty_bar = Bar.objects.create(name="Empty Bar")
+        self.assertEqual(
+            calculate_displayed_values_for_bars([empty_bar]),
+            {empty_bar.id: (None, None)},
+        )
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.token = str(uuid.uuid4())
+        Bar.objects.create(name="Test Bar")
+
+    def get_bars(self):
+        return self.client.get(reverse("get_bars"), HTTP_AUTHORIZATION=self.token)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_per_view(self):
+        self.get_bars()
+        self.get_bars()
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(
+            'bar_tracker_requests_total{view="get_bars",status="200"} 2', body
+        )
+        self.assertIn(
+            'bar_tracker_request_duration_seconds_count{view="get_bars"} 2', body
+        )
+        # The first request builds the cached payload, the second runs no queries
+        self.assertIn(
+            'bar_tracker_request_db_queries_bucket{view="get_bars",le="0"} 1', body
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_needs_token(self):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer x")
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_metrics_disabled_without_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logged_with_queries(self):
+        with self.assertLogs("app.metrics", "WARNING") as logs:
+            self.get_bars()
+        record = logs.records[0]
+        self.assertEqual(record.view, "get_bars")
+        self.assertEqual(record.query_count, len(record.queries))
+        self.assertTrue(any("app_bar" in query["sql"] for query in record.queries))
+
+
+class CachedBarsPayloadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        self.bar = Bar.objects.create(name="Test Bar")
+
+    def get_bars(self):
+        response = self.client.get(reverse("get_bars"), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_cached_payload_served_without_queries(self):
+        first = self.get_bars()
+        with self.assertNumQueries(0):
+            second = self.get_bars()
+        self.assertEqual(first, second)
+
+    def test_report_submission_refreshes_payload(self):
+        self.assertIsNone(self.get_bars()[0]["current_occupancy"])
+        with self.captureOnCommitCallbacks(execute=True):
+            fold_report_into_bar(
+                OccupancyReport.objects.create(
+                    user=self.token, bar=self.bar, occupancy_level=7, line_wait=2
+                )
+            )
+        self.assertEqual(self.get_bars()[0]["current_occupancy"], 7)
+
+    def test_deactivated_bar_dropped_after_invalidation(self):
+        self.assertEqual(len(self.get_bars()), 1)
+        Bar.objects.update(is_active=False)
+        invalidate_bars_payload()
+        self.assertEqual(self.get_bars(), [])
+
+
+class ConditionalGetBarsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        Bar.objects.create(name="Test Bar")
+
+    def get_bars(self, **headers):
+        return self.client.get(
+            reverse("get_bars"), HTTP_AUTHORIZATION=self.token, **headers
+        )
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.get_bars()["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get_bars(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_etag_changes_after_version_bump(self):
+        etag = self.get_bars()["ETag"]
+        invalidate_bars_payload()
+        response = self.get_bars(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class BarsEncodingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        for i in range(10):
+            Bar.objects.create(name=f"Bar {i}", latitude=40.0 + i, longitude=-74.0)
+
+    def get_bars(self, **headers):
+        return self.client.get(
+            reverse("get_bars"), HTTP_AUTHORIZATION=self.token, **headers
+        )
+
+    def test_compact_formats_match_json(self):
+        rows = json.loads(self.get_bars(HTTP_ACCEPT="*/*").content)
+        columns = {field: [row[field] for row in rows] for field in rows[0]}
+
+        response = self.get_bars(HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), columns)
+
+        response = self.get_bars(
+            HTTP_ACCEPT="application/vnd.bartracker.columns+json, */*;q=0.1"
+        )
+        self.assertEqual(json.loads(response.content), columns)
+
+    def test_json_preferred_by_quality(self):
+        response = self.get_bars(
+            HTTP_ACCEPT="application/json, application/msgpack;q=0.5"
+        )
+        self.assertEqual(response["Content-Type"], "application/json")
+
+    def test_precompressed_variants(self):
+        identity = self.get_bars()
+        response = self.get_bars(HTTP_ACCEPT_ENCODING="gzip;q=0.5, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), identity.content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertNotEqual(response["ETag"], identity["ETag"])
+
+        response = self.get_bars(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(gzip.decompress(response.content), identity.content)
+        not_modified = self.get_bars(
+            HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    @postgres_only
+    def test_middleware_compresses_other_responses(self):
+        response = self.get_bars(HTTP_ACCEPT_ENCODING="gzip, br;q=0", data={"since": 0})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))["bars"]), 10)
+        self.assertNotIn(
+            "Content-Encoding", self.get_bars(HTTP_ACCEPT_ENCODING="identity")
+        )
+
+
+class ForecastApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_forecaster()
+        self.addCleanup(reset_forecaster)
+        self.token = str(uuid.uuid4())
+        self.quiet_bar = Bar.objects.create(name="Quiet Bar")
+        self.busy_bar = Bar.objects.create(name="Busy Bar")
+        for bar in (self.quiet_bar, self.busy_bar):
+            for days in range(1, 8):
+                HourlyBarReport.objects.create(
+                    bar=bar,
+                    hour=now().replace(minute=0, second=0, microsecond=0)
+                    - timedelta(days=days),
+                    report_count=5,
+                    mean_occupancy=6,
+                )
+        train_forecast()
+        OccupancyReport.objects.create(
+            user=self.token, bar=self.busy_bar, occupancy_level=2, line_wait=1
+        )
+        fold_report_into_bar(OccupancyReport.objects.get(bar=self.busy_bar))
+
+    def test_bars_without_reports_forecast(self):
+        response = self.client.get(reverse("get_bars"), HTTP_AUTHORIZATION=self.token)
+        bars = {bar["id"]: bar for bar in json.loads(response.content)}
+        self.assertAlmostEqual(
+            bars[self.quiet_bar.id]["forecast_occupancy"], 6, delta=1
+        )
+        self.assertIsNone(bars[self.busy_bar.id]["forecast_occupancy"])
+        self.assertEqual(bars[self.busy_bar.id]["current_occupancy"], 2)
+
+    @postgres_only
+    def test_delta_has_no_forecasts(self):
+        response = self.client.get(
+            reverse("get_bars"), {"since": 0}, HTTP_AUTHORIZATION=self.token
+        )
+        bars = response.json()["bars"]
+        self.assertEqual(len(bars), 2)
+        for bar in bars:
+            self.assertNotIn("forecast_occupancy", bar)
+
+    @override_settings(FORECAST_HOURS=3)
+    def test_forecast_endpoint(self):
+        response = self.client.get(
+            reverse("get_bar_forecast", args=[self.quiet_bar.id]),
+            HTTP_AUTHORIZATION=self.token,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["forecast"]), 3)
+
+        response = self.client.get(
+            reverse("get_bar_forecast", args=[999999]), HTTP_AUTHORIZATION=self.token
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class IsUserNearBarTest(TestCase):
+    def setUp(self):
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.other_bar = Bar.objects.create(name="Other Bar")
+
+    def post_near_bar(self, near_bar_id):
+        response = self.client.post(
+            reverse("is_user_near_bar"),
+            {"near_bar_id": near_bar_id},
+            HTTP_AUTHORIZATION=self.token,
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def assertUsersNearby(self, bar_counts):
+        for bar, count in bar_counts.items():
+            bar.refresh_from_db()
+            self.assertEqual(bar.users_nearby, count)
+
+    def test_move_between_bars(self):
+        self.post_near_bar(self.bar.id)
+        self.assertUsersNearby({self.bar: 1, self.other_bar: 0})
+        self.post_near_bar(self.other_bar.id)
+        self.assertUsersNearby({self.bar: 0, self.other_bar: 1})
+        self.assertEqual(
+            UserProfile.objects.get(user=self.user).is_near_bar, self.other_bar.id
+        )
+
+    def test_repeated_check_in_counts_once(self):
+        self.post_near_bar(self.bar.id)
+        self.post_near_bar(self.bar.id)
+        self.assertUsersNearby({self.bar: 1})
+
+    def test_leaving_never_goes_below_zero(self):
+        self.post_near_bar(self.bar.id)
+        Bar.objects.filter(id=self.bar.id).update(users_nearby=0)
+        self.post_near_bar(-1)
+        self.assertUsersNearby({self.bar: 0})
+        self.assertEqual(UserProfile.objects.get(user=self.user).is_near_bar, -1)
+
+    def test_unknown_bar_clears_location(self):
+        self.post_near_bar(self.bar.id)
+        self.assertEqual(transition_user_location(self.user, 999999), -1)
+        self.assertUsersNearby({self.bar: 0})
+
+    def test_transition_issues_fixed_number_of_updates(self):
+        self.post_near_bar(self.bar.id)
+        with CaptureQueriesContext(connection) as queries:
+            transition_user_location(self.user, self.other_bar.id)
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 3)
+
+
+class DeviceTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_users.clear()
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        UserProfile.objects.filter(user=self.user).update(email="test@example.com")
+
+    def get_email(self, token=None):
+        return self.client.get(
+            reverse("get_user_email"), HTTP_AUTHORIZATION=token or self.token
+        )
+
+    def test_warm_token_resolved_without_queries(self):
+        self.assertEqual(self.get_email().status_code, 200)
+        # Only the profile lookup, in both the local LRU and the shared cache case
+        with self.assertNumQueries(1):
+            response = self.get_email()
+        token_users.clear()
+        with self.assertNumQueries(1):
+            self.get_email()
+        self.assertEqual(json.loads(response.content)["email"], "test@example.com")
+
+    def test_unknown_token(self):
+        self.assertEqual(self.get_email(str(uuid.uuid4())).status_code, 404)
+
+    def test_deleted_user_forgotten(self):
+        self.assertEqual(self.get_email().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(resolve_user_id(self.token))
+        self.assertEqual(self.get_email().status_code, 404)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        token_users.clear()
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        UserProfile.objects.filter(user=self.user).update(email="test@example.com")
+        self.bar = Bar.objects.create(name="Test Bar")
+
+    async def test_get_bars(self):
+        response = await self.async_client.get(
+            reverse("get_bars"), headers={"authorization": str(uuid.uuid4())}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [bar["id"] for bar in json.loads(response.content)], [self.bar.id]
+        )
+        cached = await self.async_client.get(
+            reverse("get_bars"),
+            headers={
+                "authorization": self.token,
+                "if-none-match": response["ETag"],
+            },
+        )
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_get_bars_needs_token(self):
+        response = await self.async_client.get(reverse("get_bars"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_no_middleware_adapted_to_async(self):
+        # A sync-only middleware would put every async view below it on a thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), "async_capable", False), path)
+
+    async def test_static_files_served_without_adapting(self):
+        async def view(request):
+            return HttpResponse("view")
+
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "app.css"), "w") as f:
+                f.write("body {}")
+            with override_settings(STATIC_ROOT=root):
+                middleware = AsyncWhiteNoiseMiddleware(view)
+            self.assertTrue(iscoroutinefunction(middleware))
+            static = await middleware(AsyncRequestFactory().get("/static/app.css"))
+            self.assertEqual(static.status_code, 200)
+            self.assertTrue(static["Content-Type"].startswith("text/css"))
+            static.close()
+            response = await middleware(AsyncRequestFactory().get("/bars/"))
+            self.assertEqual(response.content, b"view")
+
+    async def test_get_email(self):
+        response = await self.async_client.get(
+            reverse("get_user_email"), headers={"authorization": self.token}
+        )
+        self.assertEqual(json.loads(response.content)["email"], "test@example.com")
+        response = await self.async_client.get(
+            reverse("get_user_email"), headers={"authorization": str(uuid.uuid4())}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_is_near_bar(self):
+        response = await self.async_client.post(
+            reverse("is_user_near_bar"),
+            {"near_bar_id": self.bar.id},
+            content_type="application/json",
+            headers={"authorization": self.token},
+        )
+        self.assertEqual(response.status_code, 200)
+        await self.bar.arefresh_from_db()
+        self.assertEqual(self.bar.users_nearby, 1)
+
+    async def test_is_near_bar_invalid_json(self):
+        response = await self.async_client.post(
+            reverse("is_user_near_bar"),
+            "{",
+            content_type="application/json",
+            headers={"authorization": self.token},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_queries_recorded_for_async_view(self):
+        await self.async_client.get(
+            reverse("get_bars"), headers={"authorization": self.token}
+        )
+        body = registry.render()
+        self.assertIn(
+            'bar_tracker_requests_total{view="get_bars",status="200"} 1', body
+        )
+        # Building the payload queries the bars on the request's sync thread
+        self.assertNotIn('bar_tracker_request_db_queries_sum{view="get_bars"} 0', body)
+
+
+class LiveChangesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.other_bar = Bar.objects.create(name="Other Bar")
+
+    def poll(self, after=None):
+        response = self.client.get(
+            reverse("get_bar_changes"),
+            {"after": after} if after else {},
+            HTTP_AUTHORIZATION=self.token,
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def check_in(self, bar):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("is_user_near_bar"),
+                {"near_bar_id": bar.id},
+                HTTP_AUTHORIZATION=self.token,
+            )
+
+    @override_settings(LIVE_POLL_SECONDS=0.01)
+    def test_check_ins_pushed_as_diffs(self):
+        cursor = self.poll()["cursor"]
+        self.check_in(self.bar)
+        self.check_in(self.other_bar)
+        body = self.poll(cursor)
+        self.assertFalse(body["reset"])
+        self.assertEqual(
+            sorted(body["changes"], key=lambda change: change["id"]),
+            [
+                {"id": self.bar.id, "users_nearby": 0},
+                {"id": self.other_bar.id, "users_nearby": 1},
+            ],
+        )
+        # Nothing new, the poll times out with the same cursor
+        self.assertEqual(
+            self.poll(body["cursor"]),
+            {"cursor": body["cursor"], "changes": [], "reset": False},
+        )
+
+    @override_settings(LIVE_POLL_SECONDS=0.01, REPORT_PIPELINE="eager")
+    def test_report_pushes_displayed_values(self):
+        cursor = self.poll()["cursor"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("submit_occupancy"),
+                {"bar_id": self.bar.id, "occupancy_level": 8, "line_wait": 3},
+                HTTP_AUTHORIZATION=self.token,
+            )
+        self.assertEqual(
+            self.poll(cursor)["changes"],
+            [{"id": self.bar.id, "current_occupancy": 8, "current_line_wait": 3}],
+        )
+
+    def test_unknown_cursor_resets(self):
+        body = self.poll("not-a-cursor")
+        self.assertTrue(body["reset"])
+        self.assertEqual(body["cursor"], self.poll()["cursor"])
+
+    @override_settings(LIVE_STREAM_SECONDS=0.05, LIVE_KEEPALIVE_SECONDS=0.01)
+    async def test_stream(self):
+        cursor = await current_cursor()
+        publish_bar_changes([{"id": self.bar.id, "users_nearby": 4}])
+        response = await self.async_client.get(
+            reverse("stream_bar_changes"),
+            headers={"authorization": self.token, "last-event-id": cursor},
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        frames = [chunk async for chunk in response.streaming_content]
+        event_id, event, data = frames[0].decode().splitlines()[:3]
+        self.assertEqual(event, "event: changes")
+        self.assertEqual(
+            json.loads(data.removeprefix("data: ")),
+            [{"id": self.bar.id, "users_nearby": 4}],
+        )
+        self.assertEqual(event_id, f"id: {await current_cursor()}")
+        self.assertIn(b": keepalive\n\n", frames)
+
+
+@postgres_only
+class BarsDeltaTest(TransactionTestCase):
+    # Versions are transaction ids, so each change here has to commit on its own
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.other_bar = Bar.objects.create(name="Other Bar")
+
+    def get_delta(self, since):
+        response = self.client.get(
+            reverse("get_bars"), {"since": since}, HTTP_AUTHORIZATION=self.token
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_full_then_changed_bars_only(self):
+        delta = self.get_delta(0)
+        self.assertEqual(
+            sorted(bar["id"] for bar in delta["bars"]),
+            [self.bar.id, self.other_bar.id],
+        )
+        Bar.objects.filter(id=self.bar.id).update(users_nearby=2)
+        changed = self.get_delta(delta["version"])
+        self.assertEqual([bar["id"] for bar in changed["bars"]], [self.bar.id])
+        self.assertEqual(changed["bars"][0]["users_nearby"], 2)
+        self.assertEqual(self.get_delta(changed["version"])["bars"], [])
+
+    def test_folded_report_changes_bar(self):
+        version = self.get_delta(0)["version"]
+        report = OccupancyReport.objects.create(
+            bar=self.bar, user=self.token, occupancy_level=6, line_wait=2
+        )
+        fold_report_into_bar(report)
+        bars = self.get_delta(version)["bars"]
+        self.assertEqual(len(bars), 1)
+        self.assertEqual(bars[0]["current_occupancy"], 6)
+
+    def test_unchanged_values_not_resent(self):
+        version = self.get_delta(0)["version"]
+        Bar.objects.update(users_nearby=F("users_nearby"))
+        self.bar.save()
+        self.assertEqual(self.get_delta(version)["bars"], [])
+
+    def test_deactivated_bar_tombstoned(self):
+        version = self.get_delta(0)["version"]
+        self.other_bar.is_active = False
+        self.other_bar.save()
+        delta = self.get_delta(version)
+        self.assertEqual(delta["bars"], [])
+        self.assertEqual(delta["removed"], [self.other_bar.id])
+        self.assertNotIn(
+            self.other_bar.id, [bar["id"] for bar in self.get_delta(0)["bars"]]
+        )
+
+    def test_invalid_since(self):
+        response = self.client.get(
+            reverse("get_bars"), {"since": "x"}, HTTP_AUTHORIZATION=self.token
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class IsUserNearBarLocationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        self.bar = Bar.objects.create(
+            name="Test Bar", latitude=38.0336, longitude=-78.5080
+        )
+
+    def post_location(self, latitude, longitude):
+        response = self.client.post(
+            reverse("is_user_near_bar_location"),
+            {"latitude": latitude, "longitude": longitude},
+            HTTP_AUTHORIZATION=self.token,
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["near_bar_id"]
+
+    def test_resolves_nearby_bar(self):
+        self.assertEqual(self.post_location(38.0337, -78.5081), self.bar.id)
+        self.bar.refresh_from_db()
+        self.assertEqual(self.bar.users_nearby, 1)
+
+    def test_far_from_any_bar(self):
+        self.assertEqual(self.post_location(38.10, -78.50), -1)
+
+    def test_index_rebuilt_when_bar_moves(self):
+        self.assertEqual(self.post_location(38.0337, -78.5081), self.bar.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.latitude = 38.10
+            self.bar.save()
+        self.assertEqual(self.post_location(38.0337, -78.5081), -1)
+
+    def test_missing_coordinates(self):
+        response = self.client.post(
+            reverse("is_user_near_bar_location"), {}, HTTP_AUTHORIZATION=self.token
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_coordinates(self):
+        for latitude, longitude in (
+            ("nan", -78.5),
+            (38.0, "inf"),
+            (91, -78.5),
+            (38.0, -180.5),
+        ):
+            response = self.client.post(
+                reverse("is_user_near_bar_location"),
+                {"latitude": latitude, "longitude": longitude},
+                HTTP_AUTHORIZATION=self.token,
+            )
+            self.assertEqual(response.status_code, 400, (latitude, longitude))
+
+
+class GetBarReportsTest(TestCase):
+    def setUp(self):
+        self.token = str(uuid.uuid4())
+        self.bar = Bar.objects.create(name="Test Bar")
+        timestamp = now()
+        for i in range(5):
+            report = OccupancyReport.objects.create(
+                user=self.token, bar=self.bar, occupancy_level=i + 1, line_wait=1
+            )
+            # Two reports share a timestamp to exercise the id tiebreak
+            OccupancyReport.objects.filter(id=report.id).update(
+                timestamp=timestamp - timedelta(minutes=i // 2 * 2)
+            )
+
+    def get_reports(self, before=None):
+        params = {"before": before} if before else {}
+        return self.client.get(
+            reverse("get_bar_reports", args=[self.bar.id]),
+            params,
+            HTTP_AUTHORIZATION=self.token,
+        )
+
+    def test_pages_cover_history_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            reports, cursor = get_report_page(self.bar, cursor, page_size=2)
+            seen.extend(report.id for report in reports)
+            if cursor is None:
+                break
+        expected = list(
+            OccupancyReport.objects.order_by("-timestamp", "-id").values_list(
+                "id", flat=True
+            )
+        )
+        self.assertEqual(seen, expected)
+
+    def test_page_query_count_is_fixed(self):
+        reports, cursor = get_report_page(self.bar, page_size=2)
+        with self.assertNumQueries(1):
+            reports, cursor = get_report_page(self.bar, cursor, page_size=2)
+            [str(report) for report in reports]
+
+    def test_json_endpoint(self):
+        response = self.get_reports()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["reports"]), 5)
+        self.assertIsNone(response.json()["next"])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get_reports(before="not-a-cursor").status_code, 400)
+
+
+@override_settings(REPORT_PIPELINE="eager")
+class SubmitOccupancyPipelineTest(TestCase):
+    def setUp(self):
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        self.bar = Bar.objects.create(name="Test Bar")
+        CurrentWeather.objects.create(id=1, temperature=55, weather_string="clear")
+
+    def submit(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("submit_occupancy"), data, HTTP_AUTHORIZATION=self.token
+            )
+
+    def test_report_processed_after_insert(self):
+        response = self.submit(bar_id=self.bar.id, occupancy_level=6, line_wait=3)
+        self.assertEqual(response.status_code, 200)
+
+        report = OccupancyReport.objects.get(bar=self.bar)
+        self.assertEqual((report.temperature, report.weather), (55, "clear"))
+        self.bar.refresh_from_db()
+        self.assertEqual(self.bar.displayed_current_occupancy, 6)
+        self.assertEqual(UserProfile.objects.get(user=self.user).submissions, 1)
+
+    @mock.patch("app.utils.cache_is_shared", return_value=True)
+    def test_request_path_is_a_single_insert(self, cache_is_shared):
+        with CaptureQueriesContext(connection) as queries:
+            with override_settings(REPORT_PIPELINE="thread"):
+                with mock.patch("app.pipeline.dispatch_reports") as dispatch:
+                    self.submit(bar_id=self.bar.id, occupancy_level=6, line_wait=3)
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("INSERT"))
+        dispatch.assert_called_once()
+
+    def test_invalid_submission(self):
+        response = self.submit(bar_id=self.bar.id, occupancy_level=11, line_wait=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OccupancyReport.objects.exists())
+
+    @override_settings(REPORT_COOLDOWN_MINUTES=0)
+    def test_line_wait_in_client_range_or_missing(self):
+        # The iOS app sends minutes, 0 for no wait
+        for line_wait in (0, 25, 50):
+            response = self.submit(
+                bar_id=self.bar.id, occupancy_level=6, line_wait=line_wait
+            )
+            self.assertEqual(response.status_code, 200, line_wait)
+        self.assertEqual(
+            self.submit(bar_id=self.bar.id, occupancy_level=6).status_code, 200
+        )
+        self.assertEqual(
+            list(
+                OccupancyReport.objects.order_by("id").values_list(
+                    "line_wait", flat=True
+                )
+            ),
+            [0, 25, 50, None],
+        )
+        self.assertEqual(
+            self.submit(
+                bar_id=self.bar.id, occupancy_level=6, line_wait=61
+            ).status_code,
+            400,
+        )
+
+    def test_submissions_counted_in_one_update(self):
+        other = User.objects.create(username=str(uuid.uuid4()))
+        reports = [
+            OccupancyReport.objects.create(
+                bar=self.bar, user=user.username, occupancy_level=5, line_wait=5
+            )
+            for user in (self.user, self.user, other)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            process_reports([report.id for report in reports])
+
+        profile_updates = [
+            q for q in queries if q["sql"].startswith('UPDATE "app_userprofile"')
+        ]
+        self.assertEqual(len(profile_updates), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).submissions, 2)
+        self.assertEqual(UserProfile.objects.get(user=other).submissions, 1)
+
+    def test_cooldown_per_bar(self):
+        other_bar = Bar.objects.create(name="Other Bar")
+        first = self.submit(bar_id=self.bar.id, occupancy_level=6, line_wait=3)
+        again = self.submit(bar_id=self.bar.id, occupancy_level=6, line_wait=3)
+        other = self.submit(bar_id=other_bar.id, occupancy_level=6, line_wait=3)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(again.status_code, 400)
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(OccupancyReport.objects.count(), 2)
+
+
+@override_settings(REPORT_PIPELINE="eager")
+class SubmitOccupancyBatchTest(TestCase):
+    def setUp(self):
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.other_bar = Bar.objects.create(name="Other Bar")
+
+    def submit_batch(self, reports):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("submit_occupancy_batch"),
+                {"reports": reports},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=self.token,
+            )
+
+    def test_batch_stored_and_each_bar_folded_once(self):
+        reports = [
+            {
+                "bar_id": self.bar.id,
+                "occupancy_level": 5,
+                "line_wait": 5,
+                "timestamp": (now() - timedelta(minutes=minutes_ago)).isoformat(),
+            }
+            for minutes_ago in (50, 40, 30, 20)
+        ]
+        reports.append({"bar_id": self.bar.id, "occupancy_level": 10, "line_wait": 5})
+        reports.append(
+            {
+                "bar_id": self.other_bar.id,
+                "occupancy_level": 3,
+                "line_wait": 2,
+                "timestamp": (now() - timedelta(minutes=20)).isoformat(),
+            }
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.submit_batch(reports)
+        self.assertEqual(response.status_code, 200)
+
+        bar_updates = [q for q in queries if q["sql"].startswith('UPDATE "app_bar"')]
+        self.assertEqual(len(bar_updates), 2)
+        self.assertEqual(OccupancyReport.objects.count(), 6)
+        self.assertEqual(
+            list(
+                OccupancyReport.objects.filter(flagged=True).values_list(
+                    "occupancy_level", flat=True
+                )
+            ),
+            [10],
+        )
+        self.other_bar.refresh_from_db()
+        self.assertEqual(self.other_bar.displayed_current_occupancy, 3)
+        self.assertEqual(UserProfile.objects.get(user=self.user).submissions, 6)
+
+    def test_cooldown_within_batch_and_against_stored_reports(self):
+        cache.clear()
+        OccupancyReport.objects.create(
+            bar=self.other_bar, user=self.token, occupancy_level=5, line_wait=5
+        )
+        OccupancyReport.objects.filter(bar=self.other_bar).update(
+            timestamp=now() - timedelta(minutes=30)
+        )
+
+        def report(bar, minutes_ago):
+            return {
+                "bar_id": bar.id,
+                "occupancy_level": 5,
+                "line_wait": 5,
+                "timestamp": (now() - timedelta(minutes=minutes_ago)).isoformat(),
+            }
+
+        response = self.submit_batch(
+            [
+                report(self.bar, 0),
+                report(self.bar, 0),
+                report(self.bar, 25),
+                report(self.bar, 30),
+                report(self.other_bar, 35),
+                report(self.other_bar, 15),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["message"], "3 reports submitted.")
+        self.assertEqual([error["index"] for error in body["errors"]], [1, 2, 4])
+        self.assertEqual(OccupancyReport.objects.count(), 4)
+        # The report at now holds the cooldown for live submissions
+        live = self.client.post(
+            reverse("submit_occupancy"),
+            {"bar_id": self.bar.id, "occupancy_level": 5},
+            HTTP_AUTHORIZATION=self.token,
+        )
+        self.assertEqual(live.status_code, 400)
+
+    def test_future_timestamps_clamped(self):
+        self.submit_batch(
+            [
+                {
+                    "bar_id": self.bar.id,
+                    "occupancy_level": 5,
+                    "line_wait": 5,
+                    "timestamp": (now() + timedelta(hours=2)).isoformat(),
+                }
+            ]
+        )
+        self.assertLessEqual(OccupancyReport.objects.get().timestamp, now())
+
+    @override_settings(BATCH_REPORT_MAX_AGE_HOURS=6)
+    def test_old_timestamps_rejected(self):
+        def report(bar, hours_ago):
+            return {
+                "bar_id": bar.id,
+                "occupancy_level": 5,
+                "line_wait": 5,
+                "timestamp": (now() - timedelta(hours=hours_ago)).isoformat(),
+            }
+
+        response = self.submit_batch(
+            [
+                report(self.bar, 72),
+                report(self.bar, 5),
+                report(self.other_bar, 7),
+                report(self.bar, 5),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["message"], "1 reports submitted.")
+        self.assertEqual([error["index"] for error in body["errors"]], [0, 2, 3])
+        self.assertIn("6 hours", body["errors"][0]["error"])
+        self.assertIn("minutes apart", body["errors"][2]["error"])
+        self.assertAlmostEqual(
+            OccupancyReport.objects.get().timestamp,
+            now() - timedelta(hours=5),
+            delta=timedelta(minutes=1),
+        )
+
+    def test_unknown_bar_rejects_batch(self):
+        response = self.submit_batch(
+            [{"bar_id": 999999, "occupancy_level": 5, "line_wait": 5}]
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(OccupancyReport.objects.exists())
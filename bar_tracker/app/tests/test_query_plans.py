@@ -0,0 +1,81 @@
+import os
+import unittest
+from datetime import timedelta
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import now
+from app.models import Bar, OccupancyReport, DISPLAY_WINDOW
+
+# Set QUERY_PLAN_ROWS=5000000 to check the plans against a production sized table
+SEED_ROWS = int(os.environ.get("QUERY_PLAN_ROWS", 100000))
+SEED_BARS = 200
+SEED_USERS = 20000
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "Postgres query plans")
+class OccupancyReportQueryPlanTest(TestCase):
+    """Check that the hot report queries are served by index scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Bar.objects.bulk_create(Bar(name=f"Bar {i}") for i in range(SEED_BARS))
+        cls.bar = Bar.objects.order_by("id").first()
+        with connection.cursor() as cursor:
+            # Reports spread over 30 days, user tokens reused across bars
+            cursor.execute(
+                """
+                INSERT INTO app_occupancyreport
+                    (bar_id, "user", timestamp, flagged, occupancy_level,
+                     line_wait, closed_event)
+                SELECT
+                    (SELECT min(id) FROM app_bar) + i %% %s,
+                    'user-' || (i %% %s),
+                    now() - (i %% 43200) * interval '1 minute',
+                    i %% 50 = 0,
+                    1 + i %% 10,
+                    1 + i %% 7,
+                    false
+                FROM generate_series(1, %s) AS i
+                """,
+                [SEED_BARS, SEED_USERS, SEED_ROWS],
+            )
+            cursor.execute("ANALYZE app_occupancyreport")
+
+    def assertIndexScan(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn("Seq Scan on app_occupancyreport", plan, plan)
+        self.assertIn("Index", plan, plan)
+
+    def test_displayed_values_query(self):
+        self.assertIndexScan(
+            self.bar.reports.filter(timestamp__gte=now() - DISPLAY_WINDOW).order_by(
+                "-timestamp"
+            )
+        )
+
+    def test_batched_displayed_values_query(self):
+        bar_ids = list(Bar.objects.values_list("id", flat=True)[:50])
+        self.assertIndexScan(
+            OccupancyReport.objects.filter(
+                bar_id__in=bar_ids, timestamp__gte=now() - DISPLAY_WINDOW
+            )
+        )
+
+    def test_unflagged_recent_reports_query(self):
+        self.assertIndexScan(
+            self.bar.reports.filter(
+                flagged=False, timestamp__gte=now() - DISPLAY_WINDOW
+            ).order_by("-timestamp")
+        )
+
+    def test_cooldown_query(self):
+        self.assertIndexScan(
+            OccupancyReport.objects.filter(
+                user="user-1",
+                bar=self.bar,
+                timestamp__gte=now() - timedelta(minutes=10),
+            )
+        )
+
+    def test_reports_by_user_query(self):
+        self.assertIndexScan(OccupancyReport.objects.filter(user="user-1"))
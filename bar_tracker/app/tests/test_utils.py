@@ -1,9 +1,49 @@
-from django.test import TestCase
-from datetime import timedelta
+import asyncio
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+import json
+import logging
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from unittest import mock
+import numpy as np
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from django.utils.timezone import now
-from app.models import Bar, OccupancyReport
+from app.models import Bar, ForecastFit, OccupancyReport, UserProfile, HourlyBarReport
 from django.contrib.auth.models import User
-from app.utils import verify_cooldown
+from app.fraud import flag_reports, rescore_reports, score_bar
+from app.reputation import record_strikes
+from app_config.log_handlers import JsonFormatter, QueueListenerHandler, SamplingFilter
+from app.geo import BarSpatialIndex, get_bar_index, haversine_miles
+from app.forecast import (
+    Forecaster,
+    fit_forecast,
+    get_forecaster,
+    reset_forecaster,
+    train_forecast,
+)
+from app.live import LocalBroadcaster, merge_changes
+from app.presence import (
+    live_presence_counts,
+    live_users_nearby,
+    reconcile_users_nearby,
+)
+from app.tasks import clear_reports
+from app.utils import (
+    verify_cooldown,
+    claim_cooldown,
+    release_cooldown,
+    fold_report_into_bar,
+    expire_displayed_values,
+    calculate_displayed_values,
+    handle_user_strikes,
+    calculate_distance,
+    haversine_distance_matrix,
+    nearest_bars,
+    _weighted_display_values,
+)
 
 
 class VerifyCooldownTest(TestCase):
@@ -29,7 +69,7 @@ class VerifyCooldownTest(TestCase):
     def test_outside_cooldown_period(self):
         """Test cooldown passes if the last report is outside the cooldown period."""
         report = OccupancyReport.objects.create(
-            user=self.user,
+            user=self.user.username,
             bar=self.bar,
             occupancy_level=5,
             line_wait=5,
@@ -38,3 +78,618 @@ class VerifyCooldownTest(TestCase):
         report.timestamp -= timedelta(minutes=15)
         report.save()
         self.assertTrue(verify_cooldown(self.user, self.bar))
+
+
+class ClaimCooldownTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bar = Bar.objects.create(name="Test Bar")
+
+    @mock.patch("app.utils.cache_is_shared", return_value=True)
+    def test_claim_once_per_bar(self, cache_is_shared):
+        other_bar = Bar.objects.create(name="Other Bar")
+        with self.assertNumQueries(0):
+            self.assertTrue(claim_cooldown("token", self.bar))
+            self.assertFalse(claim_cooldown("token", self.bar.id))
+            self.assertTrue(claim_cooldown("token", other_bar))
+            self.assertTrue(claim_cooldown("other-token", self.bar))
+
+    def test_released_claim_can_be_retaken(self):
+        self.assertTrue(claim_cooldown("token", self.bar))
+        release_cooldown("token", self.bar)
+        self.assertTrue(claim_cooldown("token", self.bar))
+
+    def test_per_process_cache_checks_reports(self):
+        # Another process stored this report, its claim isn't in our cache
+        OccupancyReport.objects.create(
+            user="token", bar=self.bar, occupancy_level=5, line_wait=5
+        )
+        self.assertFalse(claim_cooldown("token", self.bar))
+        self.assertTrue(claim_cooldown("other-token", self.bar))
+
+    def test_falls_back_to_reports_without_cache(self):
+        OccupancyReport.objects.create(
+            user="token", bar=self.bar, occupancy_level=5, line_wait=5
+        )
+        with mock.patch("app.utils.cache.add", side_effect=ConnectionError):
+            self.assertFalse(claim_cooldown("token", self.bar))
+            self.assertTrue(claim_cooldown("other-token", self.bar))
+
+
+class DecayedAggregatesTest(TestCase):
+    def setUp(self):
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.current_time = now()
+
+    def test_fold_matches_windowed_calculation(self):
+        rows = [
+            (self.current_time - timedelta(minutes=50), 8, 6, 1.0),
+            (self.current_time - timedelta(minutes=20), 2, 1, 1.0),
+            (self.current_time - timedelta(minutes=35), 5, 3, 1.0),
+            (self.current_time - timedelta(minutes=1), 9, 9, 1.0),
+        ]
+        for timestamp, occupancy_level, line_wait, _ in rows:
+            self.bar.fold_report(timestamp, occupancy_level, line_wait)
+
+        self.assertEqual(
+            self.bar.decayed_display_values(self.current_time),
+            _weighted_display_values(rows, self.current_time),
+        )
+
+    def test_values_expire_after_display_window(self):
+        self.bar.fold_report(self.current_time - timedelta(minutes=61), 7, 7)
+        self.assertEqual(
+            self.bar.decayed_display_values(self.current_time), (None, None)
+        )
+
+    def test_fold_after_gap_starts_over(self):
+        self.bar.fold_report(self.current_time - timedelta(hours=3), 10, 10)
+        self.bar.fold_report(self.current_time, 2, 4)
+        self.assertEqual(self.bar.decayed_display_values(self.current_time), (2, 4))
+
+    def test_missing_line_waits_skipped(self):
+        rows = [
+            (self.current_time - timedelta(minutes=30), 4, 6, 1.0),
+            (self.current_time - timedelta(minutes=10), 8, None, 1.0),
+            (self.current_time - timedelta(minutes=5), 6, None, 1.0),
+        ]
+        for timestamp, occupancy_level, line_wait, _ in rows:
+            self.bar.fold_report(timestamp, occupancy_level, line_wait)
+
+        self.assertEqual(self.bar.decayed_display_values(self.current_time)[1], 6)
+        self.assertEqual(
+            self.bar.decayed_display_values(self.current_time),
+            _weighted_display_values(rows, self.current_time),
+        )
+
+    def test_no_line_waits_leaves_line_empty(self):
+        self.bar.fold_report(self.current_time, 5, None)
+        self.assertEqual(self.bar.decayed_display_values(self.current_time), (5, None))
+
+    def test_fold_report_into_bar_saves_displayed_values(self):
+        report = OccupancyReport.objects.create(
+            user="token", bar=self.bar, occupancy_level=6, line_wait=4
+        )
+        self.assertEqual(fold_report_into_bar(report), (6, 4))
+
+        self.bar.refresh_from_db()
+        self.assertEqual(self.bar.displayed_current_occupancy, 6)
+        self.assertEqual(self.bar.decayed_display_values(), (6, 4))
+
+
+class ExpireDisplayedValuesTest(TestCase):
+    def test_only_bars_past_the_window_cleared(self):
+        stale = Bar.objects.create(
+            name="Stale",
+            displayed_current_occupancy=5,
+            displayed_current_line=2,
+            decay_anchor=now() - timedelta(hours=2),
+        )
+        fresh = Bar.objects.create(
+            name="Fresh",
+            displayed_current_occupancy=7,
+            displayed_current_line=1,
+            decay_anchor=now() - timedelta(minutes=10),
+        )
+        self.assertEqual(expire_displayed_values(), 1)
+        self.assertEqual(expire_displayed_values(), 0)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertIsNone(stale.displayed_current_occupancy)
+        self.assertEqual(fresh.displayed_current_occupancy, 7)
+
+
+class PresenceTest(TestCase):
+    def setUp(self):
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.other_bar = Bar.objects.create(name="Other Bar")
+
+    def create_presence(self, username, bar, minutes_ago):
+        user = User.objects.create(username=username)
+        UserProfile.objects.filter(user=user).update(
+            is_near_bar=bar.id,
+            last_updated_location=now() - timedelta(minutes=minutes_ago),
+        )
+        return user
+
+    def test_live_counts_ignore_expired_presences(self):
+        self.create_presence("fresh", self.bar, minutes_ago=5)
+        # Entered hours ago and still there, the app sends no heartbeat
+        self.create_presence("staying", self.bar, minutes_ago=3 * 60)
+        self.create_presence("stale", self.bar, minutes_ago=12 * 60)
+        self.create_presence("other", self.other_bar, minutes_ago=1)
+        self.assertEqual(live_users_nearby(self.bar.id), 2)
+        self.assertEqual(live_presence_counts(), {self.bar.id: 2, self.other_bar.id: 1})
+
+    def test_reconcile_rewrites_drifted_counters(self):
+        self.create_presence("fresh", self.bar, minutes_ago=5)
+        stale_user = self.create_presence("stale", self.other_bar, minutes_ago=12 * 60)
+        Bar.objects.filter(id=self.bar.id).update(users_nearby=7)
+        Bar.objects.filter(id=self.other_bar.id).update(users_nearby=3)
+
+        expired, updated = reconcile_users_nearby()
+
+        self.assertEqual((expired, updated), (1, 2))
+        self.bar.refresh_from_db()
+        self.other_bar.refresh_from_db()
+        self.assertEqual(self.bar.users_nearby, 1)
+        self.assertEqual(self.other_bar.users_nearby, 0)
+        self.assertEqual(UserProfile.objects.get(user=stale_user).is_near_bar, -1)
+
+
+def create_hourly_history(bar, weeks=4, weather=None):
+    """Weekly Friday 23:00 rushes and quiet Tuesday 20:00s, Eastern time."""
+    eastern = ZoneInfo("US/Eastern")
+    friday = datetime(2026, 9, 4, 23, tzinfo=eastern)
+    tuesday = datetime(2026, 9, 1, 20, tzinfo=eastern)
+    for week in range(weeks):
+        for hour, occupancy in ((friday, 9), (tuesday, 3)):
+            HourlyBarReport.objects.create(
+                bar=bar,
+                hour=hour + timedelta(weeks=week),
+                report_count=10,
+                mean_occupancy=occupancy,
+                mean_line_wait=2,
+                mean_temperature=60,
+                weather=weather,
+            )
+
+
+class ForecastTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_forecaster()
+        self.addCleanup(reset_forecaster)
+        self.bar = Bar.objects.create(name="Test Bar")
+
+    def test_fit_recovers_weekly_pattern_and_weather(self):
+        rng = np.random.default_rng(0)
+        n = 4000
+        bar_ids = rng.integers(1, 4, n)
+        weekdays = rng.integers(0, 7, n)
+        hours = rng.integers(18, 24, n)
+        rain = rng.random(n) < 0.3
+        occupancy = (
+            3
+            + bar_ids
+            + 2 * (weekdays >= 4)
+            + 0.5 * (hours - 18)
+            - 1.5 * rain
+            + rng.normal(0, 0.5, n)
+        )
+        fit = fit_forecast(
+            bar_ids,
+            weekdays,
+            hours,
+            occupancy,
+            np.ones(n),
+            np.full(n, np.nan),
+            ["rain" if r else None for r in rain],
+        )
+        self.assertAlmostEqual(fit["weather_effects"]["rain"], -1.5, delta=0.1)
+        self.assertIsNone(fit["temperature_mean"])
+
+        forecaster = Forecaster(ForecastFit(id=1, **fit))
+        saturday_late = datetime(2026, 9, 5, 23, tzinfo=forecaster.zone)
+        monday_early = datetime(2026, 9, 7, 18, tzinfo=forecaster.zone)
+        self.assertAlmostEqual(
+            forecaster.predict(2, saturday_late), 3 + 2 + 2 + 2.5, delta=0.3
+        )
+        # Predictions stay on the 1 to 10 scale
+        self.assertEqual(forecaster.predict(3, saturday_late), 10)
+        self.assertAlmostEqual(forecaster.predict(1, monday_early), 4, delta=0.3)
+        self.assertIsNone(forecaster.predict(99, monday_early))
+
+    def test_train_and_serve(self):
+        create_hourly_history(self.bar)
+        sparse_bar = Bar.objects.create(name="Sparse Bar")
+        create_hourly_history(sparse_bar, weeks=1)
+        fit = train_forecast(weeks=520)
+        self.assertEqual(fit.samples, 10)
+        self.assertEqual(list(fit.bar_parameters), [str(self.bar.id)])
+
+        forecaster = get_forecaster()
+        self.assertEqual(forecaster.fit_id, fit.id)
+        friday = datetime(2026, 10, 2, 23, 30, tzinfo=forecaster.zone)
+        tuesday = datetime(2026, 10, 6, 20, 30, tzinfo=forecaster.zone)
+        self.assertGreater(
+            forecaster.predict(self.bar.id, friday),
+            forecaster.predict(self.bar.id, tuesday) + 3,
+        )
+        hours = forecaster.forecast(self.bar.id, friday, 3)
+        self.assertEqual([hour.hour for hour, _ in hours], [23, 0, 1])
+
+    def test_no_history(self):
+        self.assertIsNone(train_forecast())
+        self.assertIsNone(get_forecaster())
+
+    def test_reloads_fit_stored_under_a_reused_id(self):
+        create_hourly_history(self.bar)
+        fit = train_forecast(weeks=520)
+        self.assertEqual(get_forecaster().fit_id, fit.id)
+
+        # As after the table is emptied and the sequence restarts
+        ForecastFit.objects.filter(id=fit.id).update(
+            trained_at=fit.trained_at + timedelta(days=1), bar_parameters={}
+        )
+        cache.clear()
+        forecaster = get_forecaster()
+        self.assertEqual(forecaster.fit_id, fit.id)
+        self.assertEqual(forecaster.trained_at, fit.trained_at + timedelta(days=1))
+        self.assertEqual(forecaster.bars, {})
+
+
+class LocalBroadcasterTest(TestCase):
+    def read(self, broadcaster, after, timeout=0.01):
+        return async_to_sync(broadcaster.read)(after, timeout)
+
+    def test_read_after_cursor(self):
+        broadcaster = LocalBroadcaster(backlog=10)
+        start = async_to_sync(broadcaster.cursor)()
+        broadcaster.publish([{"id": 1, "users_nearby": 1}])
+        broadcaster.publish(
+            [{"id": 1, "users_nearby": 2}, {"id": 2, "users_nearby": 0}]
+        )
+        events = self.read(broadcaster, start)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(self.read(broadcaster, events[0][0]), events[1:])
+        self.assertEqual(self.read(broadcaster, events[1][0]), [])
+        self.assertEqual(
+            merge_changes(events),
+            [{"id": 1, "users_nearby": 2}, {"id": 2, "users_nearby": 0}],
+        )
+
+    def test_unresumable_cursors(self):
+        broadcaster = LocalBroadcaster(backlog=2)
+        start = async_to_sync(broadcaster.cursor)()
+        for count in range(3):
+            broadcaster.publish([{"id": 1, "users_nearby": count}])
+        self.assertIsNone(self.read(broadcaster, start))
+        self.assertIsNone(self.read(broadcaster, "garbage"))
+        # Cursor from another process or from before a restart
+        other = async_to_sync(LocalBroadcaster(backlog=2).cursor)()
+        self.assertIsNone(self.read(broadcaster, other))
+
+    def test_waiting_reader_woken_by_publish(self):
+        broadcaster = LocalBroadcaster(backlog=10)
+
+        async def read_while_publishing():
+            start = await broadcaster.cursor()
+            reader = asyncio.ensure_future(broadcaster.read(start, timeout=5))
+            await asyncio.sleep(0)
+            # Writers publish from sync threads
+            await asyncio.to_thread(broadcaster.publish, [{"id": 1}])
+            return await reader
+
+        events = async_to_sync(read_while_publishing)()
+        self.assertEqual([changes for _, changes in events], [[{"id": 1}]])
+
+
+class BarSpatialIndexTest(TestCase):
+    def setUp(self):
+        self.bars = [
+            (1, 38.0336, -78.5080),
+            (2, 38.0340, -78.5080),
+            (3, 38.0500, -78.5000),
+        ]
+        self.index = BarSpatialIndex(self.bars, radius_miles=0.05)
+
+    def test_nearest_bar_within_radius(self):
+        bar_id, distance = self.index.nearest(38.0337, -78.5080)
+        self.assertEqual(bar_id, 1)
+        self.assertLess(distance, 0.05)
+
+    def test_no_bar_outside_radius(self):
+        self.assertIsNone(self.index.nearest(38.0420, -78.5080))
+
+    def test_matches_brute_force_geodesic(self):
+        for lat, lon in [(38.0338, -78.5079), (38.0499, -78.5003), (38.03, -78.52)]:
+            expected = min(
+                (
+                    (calculate_distance((lat, lon), (bar_lat, bar_lon)), bar_id)
+                    for bar_id, bar_lat, bar_lon in self.bars
+                ),
+            )
+            nearest = self.index.nearest(lat, lon)
+            if expected[0] <= 0.05:
+                self.assertEqual(nearest[0], expected[1])
+            else:
+                self.assertIsNone(nearest)
+
+    def test_haversine_close_to_geodesic(self):
+        geodesic_miles = calculate_distance((38.0336, -78.5080), (38.0500, -78.5000))
+        haversine = haversine_miles(38.0336, -78.5080, 38.0500, -78.5000)
+        self.assertAlmostEqual(haversine, geodesic_miles, delta=geodesic_miles * 0.005)
+
+
+class BarIndexCacheTest(TestCase):
+    def test_index_rebuilt_after_ttl_without_invalidation(self):
+        cache.clear()
+        bar = Bar.objects.create(name="Test Bar", latitude=38.0336, longitude=-78.5080)
+        self.assertEqual(get_bar_index().nearest(38.0336, -78.5080)[0], bar.id)
+
+        # As seen by another worker: no signal, the cached version is unchanged
+        Bar.objects.filter(id=bar.id).update(latitude=38.0500, longitude=-78.5000)
+        self.assertIsNotNone(get_bar_index().nearest(38.0336, -78.5080))
+        with override_settings(BAR_INDEX_TTL_SECONDS=0):
+            self.assertIsNone(get_bar_index().nearest(38.0336, -78.5080))
+            self.assertEqual(get_bar_index().nearest(38.0500, -78.5000)[0], bar.id)
+
+
+class HaversineKernelTest(TestCase):
+    def setUp(self):
+        self.users = [(38.0336, -78.5080), (38.0400, -78.4900), (38.0290, -78.4770)]
+        self.bars = [(38.0340, -78.5085), (38.0310, -78.4800)]
+
+    def test_matrix_matches_geodesic(self):
+        matrix = haversine_distance_matrix(self.users, self.bars)
+        self.assertEqual(matrix.shape, (3, 2))
+        for i, user in enumerate(self.users):
+            for j, bar in enumerate(self.bars):
+                exact = calculate_distance(user, bar)
+                self.assertAlmostEqual(matrix[i, j], exact, delta=exact * 0.005)
+
+    def test_nearest_bars(self):
+        indices, distances = nearest_bars(self.users, self.bars, chunk_size=2)
+        expected = [
+            min(
+                range(len(self.bars)),
+                key=lambda j: calculate_distance(user, self.bars[j]),
+            )
+            for user in self.users
+        ]
+        self.assertEqual(indices.tolist(), expected)
+        self.assertAlmostEqual(
+            distances[2],
+            calculate_distance(self.users[2], self.bars[1]),
+            delta=0.001,
+        )
+
+
+class ReportRetentionTest(TestCase):
+    def setUp(self):
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.old_hour = (now() - timedelta(days=3)).replace(
+            minute=0, second=0, microsecond=0
+        )
+
+    def create_report(self, timestamp, occupancy_level, line_wait, **kwargs):
+        report = OccupancyReport.objects.create(
+            user="token",
+            bar=self.bar,
+            occupancy_level=occupancy_level,
+            line_wait=line_wait,
+            **kwargs,
+        )
+        OccupancyReport.objects.filter(id=report.id).update(timestamp=timestamp)
+
+    def test_old_reports_rolled_up_and_deleted(self):
+        self.create_report(self.old_hour + timedelta(minutes=5), 4, 2, weather="rain")
+        self.create_report(self.old_hour + timedelta(minutes=50), 8, 6, weather="rain")
+        self.create_report(self.old_hour + timedelta(minutes=55), 1, 1, flagged=True)
+        self.create_report(now(), 5, 5)
+
+        clear_reports(retention_hours=24, batch_size=1)
+
+        self.assertEqual(OccupancyReport.objects.count(), 1)
+        rollup = HourlyBarReport.objects.get(bar=self.bar, hour=self.old_hour)
+        self.assertEqual(rollup.report_count, 2)
+        self.assertEqual(rollup.flagged_count, 1)
+        self.assertEqual(rollup.mean_occupancy, 6)
+        self.assertEqual(rollup.mean_line_wait, 4)
+        self.assertEqual(rollup.weather, "rain")
+
+    def test_late_reports_merged_into_existing_rollup(self):
+        self.create_report(self.old_hour, 2, 2)
+        clear_reports(retention_hours=24)
+        self.create_report(self.old_hour + timedelta(minutes=30), 6, 4)
+        self.create_report(self.old_hour + timedelta(minutes=31), 7, 3)
+        clear_reports(retention_hours=24)
+
+        rollup = HourlyBarReport.objects.get(bar=self.bar, hour=self.old_hour)
+        self.assertEqual(rollup.report_count, 3)
+        self.assertEqual(rollup.mean_occupancy, 5)
+        self.assertEqual(rollup.mean_line_wait, 3)
+
+    def test_interrupted_deletes_not_counted_twice(self):
+        for minute in (5, 10, 15):
+            self.create_report(self.old_hour + timedelta(minutes=minute), 4, 2)
+        delete = QuerySet.delete
+        deletes = []
+
+        def delete_once(queryset):
+            if deletes:
+                raise DatabaseError("connection lost")
+            deletes.append(queryset)
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, "delete", delete_once):
+            with self.assertRaises(DatabaseError):
+                clear_reports(retention_hours=24, batch_size=1)
+        self.assertEqual(OccupancyReport.objects.count(), 2)
+
+        clear_reports(retention_hours=24, batch_size=1)
+        self.assertFalse(OccupancyReport.objects.exists())
+        rollup = HourlyBarReport.objects.get(bar=self.bar, hour=self.old_hour)
+        self.assertEqual(rollup.report_count, 3)
+
+
+class FraudScoringTest(TestCase):
+    def setUp(self):
+        self.bar = Bar.objects.create(name="Test Bar")
+
+    def create_report(self, minutes_ago, occupancy_level, line_wait, **kwargs):
+        report = OccupancyReport.objects.create(
+            user="token",
+            bar=self.bar,
+            occupancy_level=occupancy_level,
+            line_wait=line_wait,
+            **kwargs,
+        )
+        report.timestamp = now() - timedelta(minutes=minutes_ago)
+        OccupancyReport.objects.filter(id=report.id).update(timestamp=report.timestamp)
+        return report
+
+    def test_outlier_flagged_against_median(self):
+        for minutes_ago in (30, 20, 10):
+            self.create_report(minutes_ago, 5, 5)
+        outlier = self.create_report(0, 10, 5)
+        honest = self.create_report(0, 6, 4)
+
+        flagged = flag_reports([outlier, honest])
+
+        self.assertEqual(flagged, [outlier])
+        self.assertTrue(OccupancyReport.objects.get(id=outlier.id).flagged)
+        self.assertFalse(OccupancyReport.objects.get(id=honest.id).flagged)
+
+    def test_not_scored_without_enough_reports(self):
+        self.create_report(10, 2, 2)
+        report = self.create_report(0, 10, 10)
+        self.assertEqual(flag_reports([report]), [])
+
+    def test_reports_outside_window_ignored(self):
+        for minutes_ago in (120, 110, 100):
+            self.create_report(minutes_ago, 1, 1)
+        report = self.create_report(0, 10, 10)
+        self.assertEqual(flag_reports([report]), [])
+
+    def test_median_resists_outliers(self):
+        # A mean would be dragged to 6 and flag the honest report
+        times = np.array([0.0, 1, 2, 3, 4, 5])
+        occupancy = np.array([2, 2, 2, 10, 10, 2])
+        flags = score_bar(times, occupancy, np.full(6, -1))
+        self.assertEqual(flags.tolist(), [False, False, False, True, True, False])
+
+    def test_line_wait_not_scored_without_other_line_waits(self):
+        times = np.array([0.0, 5, 10])
+        occupancy = np.array([5, 5, 5])
+        line = np.array([-1, -1, 25])
+        self.assertEqual(score_bar(times, occupancy, line).tolist(), [False] * 3)
+
+        # Enough line waits in the window, the outlier is scored again
+        line = np.array([5, 5, 25])
+        self.assertEqual(
+            score_bar(times, occupancy, line).tolist(), [False, False, True]
+        )
+
+    def test_line_waits_in_minutes_scored(self):
+        # The iOS app stores line waits as minutes, up to 50
+        for minutes_ago, line_wait in ((30, 25), (20, 30), (10, 25)):
+            self.create_report(minutes_ago, 5, line_wait)
+        honest = self.create_report(0, 5, 30)
+        outlier = self.create_report(0, 5, 1000)
+
+        self.assertEqual(flag_reports([honest, outlier]), [outlier])
+        self.assertEqual(
+            rescore_reports(now() - timedelta(hours=1), now() + timedelta(minutes=1)),
+            (5, 1),
+        )
+
+    def test_rescore_rewrites_flags(self):
+        for minutes_ago in (40, 30, 20):
+            self.create_report(minutes_ago, 5, 5, flagged=True)
+        outlier = self.create_report(10, 1, 10)
+
+        scored, flagged = rescore_reports(
+            now() - timedelta(hours=1), now() + timedelta(minutes=1)
+        )
+
+        self.assertEqual((scored, flagged), (4, 1))
+        self.assertEqual(
+            list(
+                OccupancyReport.objects.filter(flagged=True).values_list(
+                    "id", flat=True
+                )
+            ),
+            [outlier.id],
+        )
+
+
+class ReputationTest(TestCase):
+    def setUp(self):
+        self.bar = Bar.objects.create(name="Test Bar")
+        self.trusted = User.objects.create_user(username="trusted-token")
+        self.suspect = User.objects.create_user(username="suspect-token")
+
+    def create_report(self, user, occupancy_level, line_wait):
+        return OccupancyReport.objects.create(
+            user=user.username,
+            bar=self.bar,
+            occupancy_level=occupancy_level,
+            line_wait=line_wait,
+        )
+
+    def test_strikes_update_trust_in_one_statement(self):
+        with self.assertNumQueries(1):
+            record_strikes({self.trusted.id: 1, self.suspect.id: 2})
+
+        self.trusted.profile.refresh_from_db()
+        self.suspect.profile.refresh_from_db()
+        self.assertEqual(self.trusted.profile.strikes, 1)
+        self.assertAlmostEqual(self.trusted.profile.trust_weight, 0.5)
+        self.assertEqual(self.suspect.profile.strikes, 2)
+        self.assertAlmostEqual(self.suspect.profile.trust_weight, 0.25)
+
+    def test_displayed_values_weighted_by_trust(self):
+        handle_user_strikes(self.suspect)
+        self.create_report(self.trusted, 8, 8)
+        self.create_report(self.suspect, 2, 2)
+
+        # (8 * 1 + 2 * 0.5) / 1.5
+        self.assertEqual(calculate_displayed_values(self.bar), (6, 6))
+
+    def test_banned_reports_ignored_without_rewriting(self):
+        record_strikes({self.suspect.id: 4})
+        self.create_report(self.trusted, 8, 8)
+        report = self.create_report(self.suspect, 1, 1)
+
+        self.assertEqual(calculate_displayed_values(self.bar), (8, 8))
+        self.assertEqual(fold_report_into_bar(report), (None, None))
+        self.assertFalse(OccupancyReport.objects.get(id=report.id).flagged)
+
+
+class LogHandlersTest(TestCase):
+    def make_record(self, level=logging.INFO, **extra):
+        record = logging.makeLogRecord(
+            {"name": "app.test", "levelno": level, "msg": "Hello %s", "args": ("bar",)}
+        )
+        record.__dict__.update(extra)
+        return record
+
+    def test_sampling_never_drops_warnings(self):
+        sampling = SamplingFilter(rate=0)
+        self.assertFalse(sampling.filter(self.make_record(logging.INFO)))
+        self.assertTrue(sampling.filter(self.make_record(logging.WARNING)))
+
+    def test_json_lines_include_extras(self):
+        entry = json.loads(JsonFormatter().format(self.make_record(near_bar_id=3)))
+        self.assertEqual(entry["message"], "Hello bar")
+        self.assertEqual(entry["logger"], "app.test")
+        self.assertEqual(entry["near_bar_id"], 3)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueueListenerHandler(maxsize=1)
+        handler.close()
+        handler.emit(self.make_record())
+        handler.emit(self.make_record())
+        self.assertEqual(handler.dropped, 1)
@@ -1,55 +1,57 @@
-from django.test import TestCase
-from app.apis.views import update_location
+import uuid
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from app.models import Bar, OccupancyReport, UserProfile
 from django.contrib.auth.models import User
 
 
+@override_settings(REPORT_PIPELINE="eager")
 class SubmitOccupancyTest(TestCase):
     def setUp(self):
-        self.user = User.objects.create_user(username="testuser", password="password")
+        self.token = str(uuid.uuid4())
+        self.user = User.objects.create(username=self.token)
         self.bar = Bar.objects.create(name="Test Bar")
 
     def test_submit_occupancy_success(self):
-        self.client.login(username="testuser", password="password")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("submit_occupancy"),
+                {
+                    "bar_id": self.bar.id,
+                    "occupancy_level": 5,
+                    "line_wait": 10,
+                    "within_proximity": True,
+                },
+                HTTP_AUTHORIZATION=self.token,
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Report submitted successfully.", response.content.decode())
+        self.assertEqual(UserProfile.objects.get(user=self.user).submissions, 1)
+
+    def test_submit_occupancy_needs_token(self):
         response = self.client.post(
             reverse("submit_occupancy"),
-            {
-                "bar_id": self.bar.id,
-                "occupancy_level": 5,
-                "line_wait": 10,
-                "within_proximity": True,
-            },
+            {"bar_id": self.bar.id, "occupancy_level": 5, "line_wait": 10},
         )
-        self.assertEqual(response.status_code, 200)
-        self.assertIn("Report submitted successfully.", response.content.decode())
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(OccupancyReport.objects.exists())
 
 
-class UpdateLocationTest(TestCase):
+class BarPagesTest(TestCase):
     def setUp(self):
-        self.user = User.objects.create_user(username="testuser", password="password")
-        self.client.login(username="testuser", password="password")
+        self.bar = Bar.objects.create(name="Test Bar")
+        OccupancyReport.objects.create(
+            user="token", bar=self.bar, occupancy_level=5, line_wait=5
+        )
 
-    def test_update_location_success(self):
-        """Test successful location update."""
-        response = self.client.post(
-            reverse("update_location"), {"latitude": 38.0336, "longitude": -78.5080}
+    def test_bar_list(self):
+        response = self.client.get(reverse("bar_list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Test Bar")
+
+    def test_bar_detail_ignores_invalid_cursor(self):
+        response = self.client.get(
+            reverse("bar_detail", args=[self.bar.id]), {"before": "not-a-cursor"}
         )
         self.assertEqual(response.status_code, 200)
-        self.assertIn("Location updated successfully.", response.content.decode())
-
-        profile = UserProfile.objects.get(user=self.user)
-        self.assertEqual(profile.latitude, 38.0336)
-        self.assertEqual(profile.longitude, -78.5080)
-
-    def test_missing_data(self):
-        """Test missing latitude or longitude."""
-        response = self.client.post(reverse("update_location"), {"latitude": 38.0336})
-        self.assertEqual(response.status_code, 400)
-        self.assertIn("Missing location data.", response.content.decode())
-
-    def test_invalid_method(self):
-        """Test invalid request method."""
-        response = self.client.get(reverse("update_location"))
-        self.assertEqual(response.status_code, 405)
-        self.assertIn("Invalid request method.", response.content.decode())
+        self.assertEqual(len(response.context["reports"]), 1)
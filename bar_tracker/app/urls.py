@@ -2,11 +2,17 @@ from django.urls import path
 from . import views
 from .apis.views import (
     submit_occupancy,
+    submit_occupancy_batch,
     get_bars,
+    get_bar_changes,
+    stream_bar_changes,
+    get_bar_reports,
+    get_bar_forecast,
     register_user,
     update_user_email,
     get_user_email,
     is_user_near_bar,
+    is_user_near_bar_location,
 )
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -14,10 +20,25 @@ urlpatterns = [
     path("", views.bar_list, name="bar_list"),  # Home page with bar list
     path("bar/<int:bar_id>/", views.bar_detail, name="bar_detail"),  # Bar details
     path("submit_occupancy/", submit_occupancy, name="submit_occupancy"),
+    path(
+        "submit_occupancy/batch/",
+        submit_occupancy_batch,
+        name="submit_occupancy_batch",
+    ),
     path("is_near_bar/", is_user_near_bar, name="is_user_near_bar"),
+    path(
+        "is_near_bar/location/",
+        is_user_near_bar_location,
+        name="is_user_near_bar_location",
+    ),
     path("bars/", get_bars, name="get_bars"),
+    path("bars/changes/", get_bar_changes, name="get_bar_changes"),
+    path("bars/stream/", stream_bar_changes, name="stream_bar_changes"),
+    path("bars/<int:bar_id>/reports/", get_bar_reports, name="get_bar_reports"),
+    path("bars/<int:bar_id>/forecast/", get_bar_forecast, name="get_bar_forecast"),
     path("api-token-auth/", obtain_auth_token, name="api_token_auth"),
     path("register/", register_user, name="register_user"),
     path("update_email/", update_user_email, name="update_email"),
     path("get_email/", get_user_email, name="get_user_email"),
+    path("metrics", views.metrics, name="metrics"),
 ]
@@ -1,86 +1,224 @@
 from datetime import timedelta
 from django.utils.timezone import now
-from app.models import UserProfile, OccupancyReport, Bar, SiteStatistics
+from app.models import (
+    UserProfile,
+    OccupancyReport,
+    Bar,
+    DISPLAY_WINDOW,
+    decay_factor,
+)
 from geopy.distance import geodesic
-import math
-from django.shortcuts import get_object_or_404
-from typing import Tuple, Dict, Any
-from django.contrib.auth.models import User
-from rest_framework.response import Response
-from rest_framework import status
-from django.db.models import Count
+import base64
+from collections import defaultdict
+import hashlib
+import logging
+import numpy as np
+from datetime import datetime
+from typing import Tuple, Dict
+from django.db.models import F, Q
+from django.db import transaction
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from app.live import publish_bar_changes, publish_users_nearby
+from app.reputation import get_trust_weights, record_strikes, with_trust_weights
+
+logger = logging.getLogger(__name__)
+
+
+def _weighted_display_values(reports, current_time):
+    """
+    Apply the half life weighting to (timestamp, occupancy_level, line_wait,
+    trust_weight) rows. Returns (None, None) when there are no rows. Rows without
+    a line wait only count towards the occupancy.
+    """
+    weighted_occupancy = 0
+    weighted_line = 0
+    total_weight = 0
+    line_weight = 0
+    for timestamp, occupancy_level, line_wait, trust_weight in reports:
+        weight = decay_factor(current_time - timestamp) * trust_weight
+        weighted_occupancy += occupancy_level * weight
+        total_weight += weight
+        if line_wait is not None:
+            weighted_line += line_wait * weight
+            line_weight += weight
+
+    if not total_weight:
+        return None, None
+    return (
+        round(weighted_occupancy / total_weight),
+        round(weighted_line / line_weight) if line_weight else None,
+    )
 
 
 def calculate_displayed_values(bar: Bar) -> Tuple[int, int]:
     """
     Calculate and return displayed values for occupancy and line.
     Displayed values use a half life formula.  Weight = 0.5^(Minutes Elapsed / Half-Life in Minutes)
+    Each weight is scaled by the author's trust weight, banned users are ignored.
     """
-    half_life = 15  # mins
     current_time = now()
-    one_hour_ago = current_time - timedelta(hours=1)
-    reports_weighted = []
-    all_weights = []
+    reports = with_trust_weights(
+        bar.reports.filter(timestamp__gte=current_time - DISPLAY_WINDOW)
+    ).values_list("timestamp", "occupancy_level", "line_wait", "trust_weight")
+    return _weighted_display_values(reports, current_time)
 
-    reports = bar.reports.filter(timestamp__gte=one_hour_ago).order_by("-timestamp")
-    if reports.exists():
-        for report in reports:
-            minutes_elapsed = (current_time - report.timestamp).total_seconds() / 60
-            weight = 0.5 ** (minutes_elapsed / half_life)
-            reports_weighted.append(
-                (report.occupancy_level * weight, report.line_wait * weight)
-            )
-            all_weights.append(weight)
 
-        total_weight = sum(weight for weight in all_weights)
+def calculate_displayed_values_for_bars(bars) -> Dict[int, Tuple[int, int]]:
+    """
+    Batched version of calculate_displayed_values.
+    Fetches the last hour of reports for every bar in a single query and
+    returns a map of bar_id -> (displayed_occupancy, displayed_line).
+    Bars without recent reports map to (None, None).
+    """
+    current_time = now()
+    bar_ids = [bar.id if isinstance(bar, Bar) else bar for bar in bars]
+    reports_by_bar = {bar_id: [] for bar_id in bar_ids}
 
-        displayed_occupancy = round(sum(r[0] for r in reports_weighted) / total_weight)
-        displayed_line = round(sum(r[1] for r in reports_weighted) / total_weight)
-    else:
-        displayed_occupancy = None
-        displayed_line = None
+    reports = with_trust_weights(
+        OccupancyReport.objects.filter(
+            bar_id__in=bar_ids, timestamp__gte=current_time - DISPLAY_WINDOW
+        )
+    ).values_list("bar_id", "timestamp", "occupancy_level", "line_wait", "trust_weight")
+    for bar_id, *row in reports:
+        reports_by_bar[bar_id].append(row)
 
-    return displayed_occupancy, displayed_line
+    return {
+        bar_id: _weighted_display_values(rows, current_time)
+        for bar_id, rows in reports_by_bar.items()
+    }
 
 
-def flag_fraudulent_entries(report, displayed_occupancy, displayed_line):
+def fold_reports_into_bar(bar_id, reports, trust_weights=None) -> Tuple[int, int]:
     """
-    Check if a report is fraudulent based on thresholds.
-    Args:
-        report (OccupancyReport): The report being submitted.
-        displayed_occupancy (int): The current average occupancy displayed to users.
-        displayed_line (int): The current average line wait displayed to users.
-    Returns:
-        bool: True if the report is flagged as fraudulent, False otherwise.
+    Fold new reports for one bar into its decayed aggregates and store the
+    resulting displayed values, with a single locked read and a single write.
+    The bar row is locked so concurrent submissions for the same bar fold one
+    after another. Each report is weighted by its author's trust weight, from
+    trust_weights (username -> weight) when given. The new values are published
+    to the live stream once the fold commits. Returns the new displayed values.
     """
-    # Thresholds for flagging
-    occupancy_threshold = 3
-    line_threshold = 3
+    reports = sorted(reports, key=lambda report: report.timestamp)
+    if trust_weights is None:
+        trust_weights = get_trust_weights({report.user for report in reports})
+    with transaction.atomic():
+        bar = Bar.objects.select_for_update().get(pk=bar_id)
+        for report in reports:
+            weight = trust_weights.get(report.user, 1.0)
+            if weight:
+                bar.fold_report(
+                    report.timestamp,
+                    report.occupancy_level,
+                    report.line_wait,
+                    weight=weight,
+                )
+        displayed_values = bar.decayed_display_values(now())
+        bar.displayed_current_occupancy, bar.displayed_current_line = displayed_values
+        bar.save(
+            update_fields=[
+                "decayed_occupancy_sum",
+                "decayed_line_sum",
+                "decayed_weight_total",
+                "decayed_line_weight",
+                "decay_anchor",
+                "displayed_current_occupancy",
+                "displayed_current_line",
+            ]
+        )
+        change = {
+            "id": bar_id,
+            "current_occupancy": displayed_values[0],
+            "current_line_wait": displayed_values[1],
+        }
+        transaction.on_commit(lambda: publish_bar_changes([change]))
+    return displayed_values
+
 
-    # Determine if report deviates beyond thresholds
-    fraudulent_occupancy = (
-        abs(report.occupancy_level - displayed_occupancy) > occupancy_threshold
+def expire_displayed_values(current_time=None) -> int:
+    """
+    Clear the stored displayed values of bars whose newest report has left the
+    display window, in one UPDATE. /bars/ already drops them on read, this bumps
+    their change_version so delta sync clients drop them too.
+    """
+    current_time = current_time or now()
+    return (
+        Bar.objects.filter(decay_anchor__lt=current_time - DISPLAY_WINDOW)
+        .filter(
+            Q(displayed_current_occupancy__isnull=False)
+            | Q(displayed_current_line__isnull=False)
+        )
+        .update(displayed_current_occupancy=None, displayed_current_line=None)
     )
-    fraudulent_line = abs(report.line_wait - displayed_line) > line_threshold
 
-    # Flag the report if either condition is met
-    report.flagged = fraudulent_occupancy or fraudulent_line
-    report.save()
-    return report.flagged
+
+def fold_report_into_bar(report: OccupancyReport) -> Tuple[int, int]:
+    """Fold a single new report into its bar, see fold_reports_into_bar."""
+    return fold_reports_into_bar(report.bar_id, [report])
+
+
+REPORT_PAGE_SIZE = 50
+
+
+def encode_report_cursor(report: OccupancyReport) -> str:
+    """Opaque keyset cursor pointing just past `report` in newest-first order."""
+    key = f"{report.timestamp.isoformat()}|{report.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_report_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_report_cursor. Raises ValueError for a malformed cursor."""
+    try:
+        timestamp, report_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(timestamp), int(report_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def get_report_page(bar: Bar, cursor=None, page_size=REPORT_PAGE_SIZE):
+    """
+    One page of a bar's reports, newest first, using (timestamp, id) keyset
+    pagination so every page costs the same regardless of history length.
+    Returns (reports, next_cursor); next_cursor is None on the last page.
+    """
+    reports = (
+        OccupancyReport.objects.filter(bar=bar)
+        .select_related("bar")
+        .only(
+            "id",
+            "bar__name",
+            "timestamp",
+            "occupancy_level",
+            "line_wait",
+            "flagged",
+        )
+        .order_by("-timestamp", "-id")
+    )
+    if cursor:
+        timestamp, report_id = decode_report_cursor(cursor)
+        reports = reports.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=report_id)
+        )
+
+    page = list(reports[: page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_report_cursor(page[-1])
+    return page, next_cursor
 
 
 def handle_user_strikes(user):
     """
-    Increment strikes for a user and disable their reports if over limit.
+    Increment strikes for a user. Over the limit their reports are ignored, see
+    app/reputation.py.
     Args:
         user (User): The user associated with the flagged report.
     """
-    profile, created = UserProfile.objects.get_or_create(user=user)
-    profile.increment_strikes()
-    profile.save()
-
-    if profile.strikes > 3:
-        OccupancyReport.objects.filter(user=user).update(flagged=True)
+    record_strikes({user.id: 1})
 
 
 def verify_cooldown(user, bar, cooldown_minutes=10):
@@ -95,28 +233,181 @@ def verify_cooldown(user, bar, cooldown_minutes=10):
     return not recent_reports.exists()
 
 
+COOLDOWN_KEY = "cooldown:{user}:{bar_id}"
+
+
+def _cooldown_key(user, bar):
+    bar_id = bar.id if isinstance(bar, Bar) else bar
+    # Reports store the raw token as the user, keep it out of the cache keys
+    user_hash = hashlib.sha1(str(user).encode()).hexdigest()
+    return COOLDOWN_KEY.format(user=user_hash, bar_id=bar_id)
+
+
+def cache_is_shared() -> bool:
+    """False for the per-process LocMem and dummy caches."""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def claim_cooldown(user, bar, cooldown_minutes=None) -> bool:
+    """
+    Start the user's cooldown for a bar unless one is already running.
+    Returns True if the user may submit, False while they are cooling down.
+    This is a single atomic cache.add, so concurrent submissions can't both
+    pass. A claim in a per-process cache only holds in that process, so then
+    the stored reports are checked as well, as they are when the cache is
+    unavailable.
+    """
+    if cooldown_minutes is None:
+        cooldown_minutes = settings.REPORT_COOLDOWN_MINUTES
+    try:
+        claimed = cache.add(_cooldown_key(user, bar), 1, timeout=cooldown_minutes * 60)
+    except Exception as e:
+        logger.warning(f"Cooldown cache unavailable, checking reports instead: {e}")
+        return verify_cooldown(user, bar, cooldown_minutes)
+    if claimed and not cache_is_shared():
+        return verify_cooldown(user, bar, cooldown_minutes)
+    return claimed
+
+
+def split_by_cooldown(user, reports, cooldown_minutes=None):
+    """
+    Split a user's unsaved reports into the ones that keep the cooldown and the
+    indexes of the ones that don't. Reports for a bar must be cooldown_minutes
+    apart, from each other and from the user's stored reports for it, and the
+    earliest one wins. Reports inside the current cooldown window also have to
+    claim it, so a live submission can't slip in next to them.
+    Returns (kept reports, rejected indexes), both in input order.
+    """
+    if cooldown_minutes is None:
+        cooldown_minutes = settings.REPORT_COOLDOWN_MINUTES
+    if not reports or not cooldown_minutes:
+        return list(reports), []
+    cooldown = timedelta(minutes=cooldown_minutes)
+
+    taken = defaultdict(list)
+    stored = OccupancyReport.objects.filter(
+        user=user,
+        bar_id__in={report.bar_id for report in reports},
+        timestamp__gt=min(report.timestamp for report in reports) - cooldown,
+        timestamp__lt=max(report.timestamp for report in reports) + cooldown,
+    ).values_list("bar_id", "timestamp")
+    for bar_id, timestamp in stored:
+        taken[bar_id].append(timestamp)
+
+    recent = now() - cooldown
+    rejected = set()
+    order = sorted(range(len(reports)), key=lambda i: reports[i].timestamp)
+    for i in order:
+        report = reports[i]
+        if any(
+            abs(report.timestamp - timestamp) < cooldown
+            for timestamp in taken[report.bar_id]
+        ) or (report.timestamp > recent and not claim_cooldown(user, report.bar_id)):
+            rejected.add(i)
+        else:
+            taken[report.bar_id].append(report.timestamp)
+    kept = [report for i, report in enumerate(reports) if i not in rejected]
+    return kept, sorted(rejected)
+
+
+def release_cooldown(user, bar):
+    """Undo claim_cooldown for a submission that wasn't stored."""
+    try:
+        cache.delete(_cooldown_key(user, bar))
+    except Exception as e:
+        logger.warning(f"Could not release cooldown: {e}")
+
+
+def transition_user_location(user, near_bar_id) -> int:
+    """
+    Move a user's presence from the bar they were last near to near_bar_id.
+    near_bar_id of None, -1 or an unknown bar means the user is not near any bar.
+    Counters are changed with conditional F() updates under the profile row lock,
+    so concurrent check-ins never lose an update and users_nearby never drops below
+    zero. Changed counts are published to the live stream after the commit.
+    Returns the bar id now recorded on the profile.
+    """
+    try:
+        new_bar_id = int(near_bar_id)
+    except (TypeError, ValueError):
+        new_bar_id = -1
+
+    with transaction.atomic():
+        profile, created = UserProfile.objects.select_for_update().get_or_create(
+            user=user
+        )
+        old_bar_id = profile.is_near_bar
+
+        if new_bar_id != old_bar_id:
+            if old_bar_id not in (None, -1):
+                Bar.objects.filter(id=old_bar_id, users_nearby__gt=0).update(
+                    users_nearby=F("users_nearby") - 1
+                )
+            if new_bar_id != -1:
+                incremented = Bar.objects.filter(id=new_bar_id).update(
+                    users_nearby=F("users_nearby") + 1
+                )
+                if not incremented:
+                    new_bar_id = -1
+            transaction.on_commit(
+                lambda: publish_users_nearby([old_bar_id, new_bar_id])
+            )
+
+        UserProfile.objects.filter(pk=profile.pk).update(
+            is_near_bar=new_bar_id, last_updated_location=now()
+        )
+    return new_bar_id
+
+
+EARTH_RADIUS_MILES = 3958.7613
+
+
 def calculate_distance(
     user_coords: Tuple[float, float], bar_coords: Tuple[float, float]
 ) -> float:
     return geodesic(user_coords, bar_coords).miles
 
 
-def get_user_from_request(request):
-    """need this because using anon tokens caused django to treat user class diff, so need to idenitfy by username"""
-    auth_header = request.headers.get("Authorization")
-    if not auth_header:
-        return None, Response(
-            {"error": "Missing token"}, status=status.HTTP_400_BAD_REQUEST
-        )
+def haversine_distance_matrix(user_coords, bar_coords) -> np.ndarray:
+    """
+    Great circle distances in miles between every user and every bar.
+    Args:
+        user_coords: array-like of shape (n_users, 2) with (latitude, longitude).
+        bar_coords: array-like of shape (n_bars, 2) with (latitude, longitude).
+    Returns:
+        np.ndarray of shape (n_users, n_bars). Within ~0.5% of calculate_distance.
+    """
+    users = np.radians(np.asarray(user_coords, dtype=np.float64).reshape(-1, 2))
+    bars = np.radians(np.asarray(bar_coords, dtype=np.float64).reshape(-1, 2))
+    user_lat = users[:, 0:1]
+    user_lon = users[:, 1:2]
+    bar_lat = bars[:, 0]
+    bar_lon = bars[:, 1]
 
-    token = auth_header
-    if token.startswith("Token "):
-        token = token[6:]
+    a = (
+        np.sin((bar_lat - user_lat) / 2) ** 2
+        + np.cos(user_lat) * np.cos(bar_lat) * np.sin((bar_lon - user_lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
 
-    try:
-        user = User.objects.get(username=token)
-        return user, None
-    except User.DoesNotExist:
-        return None, Response(
-            {"error": "User not found for this token"}, status=status.HTTP_404_NOT_FOUND
+
+def nearest_bars(
+    user_coords, bar_coords, chunk_size=10000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index of the nearest bar and its distance in miles for every user.
+    Users are processed in chunks so memory stays at chunk_size x n_bars.
+    """
+    users = np.asarray(user_coords, dtype=np.float64).reshape(-1, 2)
+    indices = np.empty(len(users), dtype=np.intp)
+    distances = np.empty(len(users), dtype=np.float64)
+    for start in range(0, len(users), chunk_size):
+        matrix = haversine_distance_matrix(
+            users[start : start + chunk_size], bar_coords
         )
+        chunk_indices = matrix.argmin(axis=1)
+        indices[start : start + chunk_size] = chunk_indices
+        distances[start : start + chunk_size] = matrix[
+            np.arange(len(matrix)), chunk_indices
+        ]
+    return indices, distances
@@ -3,26 +3,45 @@ from django.shortcuts import redirect
 from .forms import OccupancyReportForm
 from django.shortcuts import render, get_object_or_404
 from .models import Bar, OccupancyReport, UserProfile
-from django.http import JsonResponse
-from .utils import calculate_displayed_values
-from app.utils import flag_fraudulent_entries, handle_user_strikes, verify_cooldown
+from .weather_models import CurrentWeather
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.timezone import now
+from .utils import (
+    calculate_displayed_values_for_bars,
+    fold_report_into_bar,
+    get_report_page,
+)
+from app.fraud import flag_reports
+from app.forecast import current_forecast, get_forecaster
+from app.metrics import registry
+from app.utils import claim_cooldown, handle_user_strikes
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 def bar_list(request):
-    bars = Bar.objects.filter(is_active=True)
+    bars = list(Bar.objects.filter(is_active=True))
+    displayed_values = calculate_displayed_values_for_bars(bars)
+    forecast = current_forecast(
+        get_forecaster(), CurrentWeather.objects.filter(id=1).first(), now()
+    )
     for bar in bars:
-        bar.displayed_current_occupancy, bar.displayed_current_line = (
-            calculate_displayed_values(bar)
-        )
+        bar.displayed_current_occupancy, bar.displayed_current_line = displayed_values[
+            bar.id
+        ]
+        bar.forecast_occupancy = forecast(bar.id)
     return render(request, "bar_list.html", {"bars": bars})
 
 
 def bar_detail(request, bar_id):
     bar = get_object_or_404(Bar, id=bar_id)
-    reports = OccupancyReport.objects.filter(bar=bar).order_by("-timestamp")
+    try:
+        reports, next_cursor = get_report_page(bar, request.GET.get("before"))
+    except ValueError:
+        reports, next_cursor = get_report_page(bar)
 
     if request.method == "POST":
         form = OccupancyReportForm(request.POST)
@@ -32,18 +51,17 @@ def bar_detail(request, bar_id):
             report.user = request.user
             report.save()
 
-            # Calculate new displayed values using utils.py logic
-            bar.displayed_current_occupancy, bar.displayed_current_line = (
-                calculate_displayed_values(bar)
-            )
-            bar.save()
+            # Fold the report into the bar's displayed values using utils.py logic
+            fold_report_into_bar(report)
 
             return redirect("bar_detail", bar_id=bar.id)
     else:
         form = OccupancyReportForm()
 
     return render(
-        request, "bar_detail.html", {"bar": bar, "reports": reports, "form": form}
+        request,
+        "bar_detail.html",
+        {"bar": bar, "reports": reports, "next_cursor": next_cursor, "form": form},
     )
 
 
@@ -55,11 +73,11 @@ def submit_occupancy(request):
             line_wait = request.POST.get("line_wait")
             bar = get_object_or_404(Bar, id=bar_id)
             user = request.user
-            if not verify_cooldown(user, bar):
+            if not claim_cooldown(user, bar):
                 return JsonResponse(
                     {
                         "success": False,
-                        "message": "You can only submit a report every 10 minutes for the same bar.",
+                        "message": f"You can only submit a report every {settings.REPORT_COOLDOWN_MINUTES} minutes for the same bar.",
                     },
                     status=400,
                 )
@@ -70,14 +88,11 @@ def submit_occupancy(request):
                 occupancy_level=int(occupancy_level) if occupancy_level else None,
                 line_wait=int(line_wait) if line_wait else None,
             )
-            # Calculate new displayed values using utils.py logic
-            displayed_occupancy, displayed_line = calculate_displayed_values(bar)
-            bar.displayed_current_occupancy = displayed_occupancy
-            bar.displayed_current_line = displayed_line
+            # Fold the report into the bar's displayed values using utils.py logic
+            fold_report_into_bar(report)
 
-            if flag_fraudulent_entries(report, displayed_occupancy, displayed_line):
+            if flag_reports([report]):
                 handle_user_strikes(user)
-            bar.save()
 
             return JsonResponse(
                 {"success": True, "message": "Report submitted successfully."}
@@ -88,3 +103,20 @@ def submit_occupancy(request):
             return JsonResponse({"success": False, "error": str(e)}, status=500)
 
     return JsonResponse({"success": False, "error": "Invalid request"}, status=405)
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint for the request metrics in app/metrics.py.
+    Needs "Authorization: Bearer <METRICS_TOKEN>", and is only open without a
+    token when DEBUG is on.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
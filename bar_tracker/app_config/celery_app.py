@@ -0,0 +1,12 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+
+app = Celery("app_config")
+
+# Read CELERY_* settings from app_config/settings.py
+app.config_from_object("django.conf:settings", namespace="CELERY")
+
+app.autodiscover_tasks()
@@ -52,10 +52,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times everything below it
+    "app.metrics.RequestMetricsMiddleware",
+    # Above everything that reads or changes the body, so metrics see wire sizes
+    "app.encoding.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # WhiteNoiseMiddleware with an async path, see app/static_files.py
+    "app.static_files.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -91,6 +96,80 @@ WSGI_APPLICATION = "app_config.wsgi.application"
 DATABASES = {"default": dj_database_url.config(default=config("DATABASE_URL"))}
 
 
+# Cache
+# Local memory by default; set REDIS_URL to share the cache between workers.
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Max age in seconds of the cached /bars/ payload
+BARS_CACHE_TTL = config("BARS_CACHE_TTL", default=30, cast=int)
+
+# Celery, used by the report pipeline when REPORT_PIPELINE is "celery"
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default=REDIS_URL)
+
+# Where post-submission report processing runs: "eager", "thread" or "celery".
+# Celery is opt-in, setting REDIS_URL alone must not hand reports to a worker
+# service that isn't deployed.
+REPORT_PIPELINE = config("REPORT_PIPELINE", default="thread")
+REPORT_PIPELINE_THREADS = config("REPORT_PIPELINE_THREADS", default=4, cast=int)
+
+# Device token -> user id caching, see app/authentication.py
+AUTH_LRU_SIZE = config("AUTH_LRU_SIZE", default=10000, cast=int)
+AUTH_LRU_TTL = config("AUTH_LRU_TTL", default=60, cast=int)
+AUTH_CACHE_TTL = config("AUTH_CACHE_TTL", default=24 * 60 * 60, cast=int)
+
+# Minutes a user has to wait between reports for the same bar
+REPORT_COOLDOWN_MINUTES = config("REPORT_COOLDOWN_MINUTES", default=10, cast=int)
+# Oldest report time accepted by the batch endpoint. Keep it well below
+# REPORT_RETENTION_HOURS so a late report never lands in an hour that
+# clear_reports has rolled up or is deleting.
+BATCH_REPORT_MAX_AGE_HOURS = config("BATCH_REPORT_MAX_AGE_HOURS", default=6, cast=int)
+
+# Minutes after their last location update that a user stops counting as near a bar.
+# The iOS app sends is_near_bar only when it enters or leaves a bar's geofence and
+# has no heartbeat, so a user staying at a bar sends nothing until they leave.
+# The TTL has to outlast a night out or reconcile_presence drops them from
+# users_nearby; it only clears presences whose exit update never arrived.
+PRESENCE_TTL_MINUTES = config("PRESENCE_TTL_MINUTES", default=6 * 60, cast=int)
+
+# Live bar changes, see app/live.py. Without REDIS_URL a client only sees the
+# changes made by the worker process it is connected to.
+LIVE_BACKLOG = config("LIVE_BACKLOG", default=1000, cast=int)
+# Longest wait of a /bars/changes/ long poll
+LIVE_POLL_SECONDS = config("LIVE_POLL_SECONDS", default=25, cast=float)
+# Lifetime of a /bars/stream/ connection and the gap between its keepalives
+LIVE_STREAM_SECONDS = config("LIVE_STREAM_SECONDS", default=300, cast=float)
+LIVE_KEEPALIVE_SECONDS = config("LIVE_KEEPALIVE_SECONDS", default=15, cast=float)
+
+# Hours raw reports are kept before being rolled up into hourly aggregates
+REPORT_RETENTION_HOURS = config("REPORT_RETENTION_HOURS", default=48, cast=int)
+
+# Occupancy forecasts, see app/forecast.py. Weeks of history a fit is trained
+# on, hours forecast ahead, and the zone whose weekdays and hours it learns.
+FORECAST_HISTORY_WEEKS = config("FORECAST_HISTORY_WEEKS", default=12, cast=int)
+FORECAST_HOURS = config("FORECAST_HOURS", default=4, cast=int)
+FORECAST_TIME_ZONE = config("FORECAST_TIME_ZONE", default="US/Eastern")
+
+# Radius in miles within which a location ping counts as near a bar
+GEOFENCE_RADIUS_MILES = config("GEOFENCE_RADIUS_MILES", default=0.05, cast=float)
+# Max age of a worker's bar spatial index, see app/geo.py. Bar changes reach
+# every worker at once only through a shared cache (REDIS_URL); with the local
+# memory cache other workers see them after this many seconds.
+BAR_INDEX_TTL_SECONDS = config("BAR_INDEX_TTL_SECONDS", default=300, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -134,9 +213,50 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "app.authentication.DeviceTokenAuthentication",
         "rest_framework.authentication.TokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",  # Requires authentication by default
     ],
 }
+
+# Requests slower than this many milliseconds are logged with their queries,
+# see app/metrics.py. Empty turns the trace off.
+SLOW_REQUEST_MS = config(
+    "SLOW_REQUEST_MS", default="500", cast=lambda v: float(v) if v else None
+)
+# Bearer token for the /metrics endpoint
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+# Fraction of INFO and DEBUG records kept from the per-request loggers below
+LOG_SAMPLE_RATE = config("LOG_SAMPLE_RATE", default=0.01, cast=float)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "app_config.log_handlers.JsonFormatter"},
+    },
+    "filters": {
+        "sample": {
+            "()": "app_config.log_handlers.SamplingFilter",
+            "rate": LOG_SAMPLE_RATE,
+        },
+    },
+    "handlers": {
+        "queue": {
+            "class": "app_config.log_handlers.QueueListenerHandler",
+            "formatter": "json",
+        },
+    },
+    "root": {"handlers": ["queue"], "level": LOG_LEVEL},
+    "loggers": {
+        "django": {"level": "INFO"},
+        "django.db.backends": {"level": "WARNING"},
+        # Fire on every request
+        "app.permissions": {"level": LOG_LEVEL, "filters": ["sample"]},
+        "app.apis.views": {"level": LOG_LEVEL, "filters": ["sample"]},
+    },
+}
@@ -0,0 +1,119 @@
+"""
+Per-request cost of the API auth path: the token permission check plus
+resolving the token to a user.
+
+"before" is the old path: ValidTokenPermission printing five lines to stdout,
+then User.objects.get(username=token) in the view. stdout is a pipe to a
+separate process, like gunicorn's stdout going to the platform log collector.
+"after" is the current ValidTokenPermission, which logs nothing on success,
+with DeviceTokenAuthentication resolving the token from its caches.
+
+    python benchmarks/bench_auth.py [--requests 5000]
+"""
+
+import argparse
+import io
+import subprocess
+import time
+import uuid
+from contextlib import redirect_stdout
+
+from common import (
+    latency_summary,
+    print_latency_table,
+    setup_django,
+    test_database,
+)
+
+setup_django()
+
+from django.contrib.auth.models import User  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from app.authentication import DeviceTokenAuthentication, token_users  # noqa: E402
+from app.permissions import ValidTokenPermission  # noqa: E402
+
+
+def old_has_permission(request):
+    # ValidTokenPermission.has_permission before structured logging
+    print("Checking token permission")
+    token = request.headers.get("Authorization")
+    if not token:
+        print("AUTH ERROR: No Authorization header present")
+        return False
+    print(f"Raw Authorization header: {token[:15]}...")
+    try:
+        print(f"Attempting to validate token as UUID: {token[:15]}...")
+        uuid.UUID(token)
+        print("Token successfully validated as UUID format")
+        return True
+    except (ValueError, AttributeError) as e:
+        print(f"AUTH ERROR: Invalid token format: {str(e)}")
+        return False
+
+
+def before(request):
+    assert old_has_permission(request)
+    return User.objects.get(username=request.headers["Authorization"])
+
+
+permission = ValidTokenPermission()
+authentication = DeviceTokenAuthentication()
+
+
+def after(request):
+    assert permission.has_permission(request, None)
+    return authentication.authenticate(request)[0]
+
+
+def run(auth_path, requests, clear_local=False):
+    latencies = []
+    for request in requests:
+        if clear_local:
+            token_users.clear()
+        start = time.perf_counter()
+        auth_path(request)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latency_summary(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    factory = APIRequestFactory()
+    collector = subprocess.Popen(
+        ["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL
+    )
+    # Unbuffered like gunicorn's stdout in production
+    stdout = io.TextIOWrapper(collector.stdin, line_buffering=True)
+
+    with test_database():
+        tokens = [str(uuid.uuid4()) for _ in range(args.users)]
+        for token in tokens:
+            User.objects.create(username=token)
+        requests = [
+            factory.get("/bars/", HTTP_AUTHORIZATION=tokens[i % len(tokens)])
+            for i in range(args.requests)
+        ]
+        # Warm the caches
+        for token in tokens:
+            after(factory.get("/bars/", HTTP_AUTHORIZATION=token))
+
+        with redirect_stdout(stdout):
+            before_summary = run(before, requests)
+        rows = [
+            ("before (print + query)", before_summary),
+            ("after (shared cache)", run(after, requests, clear_local=True)),
+            ("after (local LRU)", run(after, requests)),
+        ]
+
+    stdout.close()
+    collector.wait()
+    print(f"auth path x {args.requests}")
+    print_latency_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the vectorized haversine kernel against per-pair geodesic.
+
+    python benchmarks/bench_distance.py [--users 2000] [--bars 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+django.setup()
+
+from app.utils import calculate_distance, haversine_distance_matrix  # noqa: E402
+
+# Around downtown Charlottesville
+CENTER = (38.0336, -78.5080)
+
+
+def random_coords(rng, count, spread=0.02):
+    return np.column_stack(
+        (
+            CENTER[0] + rng.uniform(-spread, spread, count),
+            CENTER[1] + rng.uniform(-spread, spread, count),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--bars", type=int, default=200)
+    parser.add_argument("--geodesic-sample", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    users = random_coords(rng, args.users)
+    bars = random_coords(rng, args.bars)
+    pairs = args.users * args.bars
+
+    start = time.perf_counter()
+    matrix = haversine_distance_matrix(users, bars)
+    vectorized_seconds = time.perf_counter() - start
+
+    # geodesic is too slow to run over every pair, time a sample and extrapolate
+    sample = min(args.geodesic_sample, pairs)
+    flat_users = np.repeat(np.arange(args.users), args.bars)[:sample]
+    flat_bars = np.tile(np.arange(args.bars), args.users)[:sample]
+    start = time.perf_counter()
+    exact = [
+        calculate_distance(tuple(users[u]), tuple(bars[b]))
+        for u, b in zip(flat_users, flat_bars)
+    ]
+    geodesic_seconds = (time.perf_counter() - start) * pairs / sample
+
+    relative_error = np.abs(matrix[flat_users, flat_bars] - exact) / np.array(exact)
+    print(f"{pairs} user-bar pairs")
+    print(f"haversine matrix: {vectorized_seconds * 1000:10.2f} ms")
+    print(f"geodesic (est.):  {geodesic_seconds * 1000:10.2f} ms")
+    print(f"speedup:          {geodesic_seconds / vectorized_seconds:10.0f}x")
+    print(f"max rel. error:   {relative_error.max():10.4%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Serialization time and bytes on the wire of the /bars/ payload in every format
+and content coding from app/encoding.py, for a synthetic list of bars.
+
+    python benchmarks/bench_encoding.py [--bars 500] [--repeat 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import brotli
+import django
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+django.setup()
+
+from app.caching import BAR_FIELDS  # noqa: E402
+from app.encoding import COLUMNS, JSON, MSGPACK, compress, encode  # noqa: E402
+
+
+def synthetic_rows(count, rng):
+    rows = []
+    for bar_id in range(1, count + 1):
+        live = rng.random() < 0.6
+        rows.append(
+            {
+                "id": bar_id,
+                "name": f"Bar {bar_id} on {rng.choice(['Main', 'State', 'Park'])} St",
+                "current_occupancy": int(rng.integers(1, 11)) if live else None,
+                "current_line_wait": int(rng.integers(0, 11)) if live else None,
+                "forecast_occupancy": None if live else int(rng.integers(1, 11)),
+                "is_active": True,
+                "latitude": float(40.7 + rng.normal(0, 0.05)),
+                "longitude": float(-74.0 + rng.normal(0, 0.05)),
+            }
+        )
+    return rows
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.bars, np.random.default_rng(0))
+    print(f"{args.bars} bars")
+    print(f"{'':42}{'encode ms':>10}{'bytes':>10}")
+    for media_type in (JSON, COLUMNS, MSGPACK):
+        body, encode_ms = timed(
+            lambda: encode(rows, BAR_FIELDS, media_type), args.repeat
+        )
+        print(f"{media_type:42}{encode_ms:10.3f}{len(body):10d}")
+        for coding in ("gzip", "br"):
+            compressed, compress_ms = timed(lambda: compress(body, coding), args.repeat)
+            label = f"  + {coding}"
+            print(f"{label:42}{encode_ms + compress_ms:10.3f}{len(compressed):10d}")
+        default_br, default_ms = timed(lambda: brotli.compress(body), 5)
+        label = "  + br, default quality"
+        print(f"{label:42}{encode_ms + default_ms:10.3f}{len(default_br):10d}")
+
+
+if __name__ == "__main__":
+    main()
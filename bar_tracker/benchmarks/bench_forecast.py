@@ -0,0 +1,129 @@
+"""
+Fit time, prediction latency and held-out accuracy of the occupancy forecast on
+synthetic hourly history. The last week is held out and compared against the
+naive forecast of each bar's mean occupancy.
+
+    python benchmarks/bench_forecast.py [--bars 300] [--weeks 12]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import django
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+django.setup()
+
+from app.forecast import Forecaster, fit_forecast  # noqa: E402
+from app.models import ForecastFit  # noqa: E402
+
+# Evenings into the early morning
+OPEN_HOURS = (18, 19, 20, 21, 22, 23, 0, 1)
+CONDITIONS = (None, "clouds", "rain", "snow")
+
+
+def synthetic_history(bars, weeks, rng):
+    popularity = rng.normal(0, 1.5, bars)
+    party = rng.uniform(1, 3, bars)
+    days = np.arange(weeks * 7)
+    day_weather = rng.choice(len(CONDITIONS), len(days), p=(0.5, 0.3, 0.15, 0.05))
+    day_temperature = rng.normal(55, 15, len(days))
+
+    columns = {name: [] for name in ("bar", "day", "hour", "weather", "temperature")}
+    for bar in range(bars):
+        for day in days:
+            # Not every bar gets reports every night
+            for hour in OPEN_HOURS:
+                if rng.random() < 0.6:
+                    columns["bar"].append(bar)
+                    columns["day"].append(day)
+                    columns["hour"].append(hour)
+                    columns["weather"].append(day_weather[day])
+                    columns["temperature"].append(day_temperature[day])
+    samples = {name: np.asarray(values) for name, values in columns.items()}
+
+    weekday = samples["day"] % 7
+    late = np.isin(samples["hour"], (22, 23, 0, 1))
+    occupancy = (
+        4
+        + popularity[samples["bar"]]
+        + party[samples["bar"]] * np.isin(weekday, (3, 4, 5)) * late
+        + 0.8 * late
+        - 1.2 * (samples["weather"] >= 2)
+        + 0.02 * (samples["temperature"] - 55)
+        + rng.normal(0, 1, len(weekday))
+    )
+    samples["weekday"] = weekday
+    samples["occupancy"] = np.clip(occupancy, 1, 10)
+    samples["reports"] = rng.integers(1, 15, len(weekday))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bars", type=int, default=300)
+    parser.add_argument("--weeks", type=int, default=12)
+    args = parser.parse_args()
+
+    samples = synthetic_history(args.bars, args.weeks, np.random.default_rng(0))
+    train = samples["day"] < (args.weeks - 1) * 7
+    test = ~train
+
+    def part(name, rows):
+        return samples[name][rows]
+
+    start = time.perf_counter()
+    fit = fit_forecast(
+        part("bar", train),
+        part("weekday", train),
+        part("hour", train),
+        part("occupancy", train),
+        part("reports", train),
+        part("temperature", train),
+        [CONDITIONS[index] for index in part("weather", train)],
+    )
+    fit_seconds = time.perf_counter() - start
+    forecaster = Forecaster(ForecastFit(id=1, **fit))
+
+    # Any date whose weekday matches sample weekday 0, in the forecast time zone
+    monday = datetime(2026, 9, 7, tzinfo=forecaster.zone)
+    times = [
+        monday + timedelta(days=int(day % 7), hours=int(hour))
+        for day, hour in zip(part("day", test), part("hour", test))
+    ]
+    effects = [
+        forecaster.weather_effect(temperature, CONDITIONS[weather])
+        for temperature, weather in zip(
+            part("temperature", test), part("weather", test)
+        )
+    ]
+    bars = part("bar", test).tolist()
+
+    start = time.perf_counter()
+    predicted = [
+        forecaster.predict(bar, when, effect)
+        for bar, when, effect in zip(bars, times, effects)
+    ]
+    predict_us = (time.perf_counter() - start) / len(predicted) * 1e6
+
+    actual = part("occupancy", test)
+    bar_means = {
+        bar: part("occupancy", train)[part("bar", train) == bar].mean()
+        for bar in range(args.bars)
+    }
+    naive = np.array([bar_means[bar] for bar in bars])
+
+    print(f"{train.sum()} training hours across {args.bars} bars")
+    print(f"fit:                {fit_seconds * 1000:10.1f} ms")
+    print(f"predict:            {predict_us:10.2f} us per bar-hour")
+    print(f"held-out MAE:       {np.abs(np.array(predicted) - actual).mean():10.3f}")
+    print(f"bar mean MAE:       {np.abs(naive - actual).mean():10.3f}")
+
+
+if __name__ == "__main__":
+    main()
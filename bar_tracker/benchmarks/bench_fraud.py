@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of the fraud scoring kernel on a synthetic night of reports.
+Every report is scored against the window at its own time, like rescore_reports.
+
+    python benchmarks/bench_fraud.py [--bars 200] [--reports-per-bar 100]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+django.setup()
+
+from app.fraud import score_bar  # noqa: E402
+
+NIGHT_MINUTES = 8 * 60
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bars", type=int, default=200)
+    parser.add_argument("--reports-per-bar", type=int, default=100)
+    parser.add_argument("--outlier-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    nights = []
+    for _ in range(args.bars):
+        count = args.reports_per_bar
+        times = np.sort(rng.uniform(0, NIGHT_MINUTES, count))
+        occupancy = np.clip(rng.normal(4, 1, count).round(), 1, 10).astype(np.int64)
+        line = np.clip(rng.normal(4, 1, count).round(), 1, 10).astype(np.int64)
+        outliers = rng.random(count) < args.outlier_rate
+        occupancy[outliers] = 10
+        nights.append((times, occupancy, line, outliers))
+
+    start = time.perf_counter()
+    flags = [score_bar(times, occupancy, line) for times, occupancy, line, _ in nights]
+    seconds = time.perf_counter() - start
+
+    flags = np.concatenate(flags)
+    outliers = np.concatenate([night[3] for night in nights])
+    print(f"{len(flags)} reports across {args.bars} bars")
+    print(f"scoring:          {seconds * 1000:10.2f} ms")
+    print(f"flagged:          {flags.sum():10d}")
+    print(
+        f"outliers caught:  {(flags & outliers).sum() / max(outliers.sum(), 1):10.1%}"
+    )
+    print(f"false positives:  {(flags & ~outliers).sum():10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Latency of POST /submit_occupancy/ with the report pipeline in the request
+("eager", the old synchronous behaviour), on the in-process thread pool, and
+with processing handed off entirely ("request only", what the request costs
+when a Celery worker in another process does the work).
+
+    python benchmarks/bench_submit.py [--requests 500]
+"""
+
+import argparse
+import time
+import uuid
+from unittest import mock
+
+from common import (
+    latency_summary,
+    print_latency_table,
+    setup_django,
+    test_database,
+)
+
+setup_django()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from app import pipeline  # noqa: E402
+from app.models import Bar  # noqa: E402
+from app.weather_models import CurrentWeather  # noqa: E402
+
+
+def run(mode, requests, bars, tokens):
+    client = Client()
+    latencies = []
+    if mode == "request only":
+        handoff = mock.patch("app.pipeline.dispatch_reports")
+    else:
+        handoff = override_settings(REPORT_PIPELINE=mode)
+    # Pairs of token and bar repeat, keep the cooldown check but let them through
+    with handoff, override_settings(REPORT_COOLDOWN_MINUTES=0):
+        for i in range(requests):
+            token = tokens[i % len(tokens)]
+            start = time.perf_counter()
+            response = client.post(
+                "/submit_occupancy/",
+                {
+                    "bar_id": bars[i % len(bars)].id,
+                    "occupancy_level": 1 + i % 10,
+                    "line_wait": 1 + i % 7,
+                },
+                HTTP_AUTHORIZATION=token,
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.content
+    if pipeline._executor is not None:
+        pipeline._executor.shutdown(wait=True)
+        pipeline._executor = None
+    return latency_summary(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    with test_database():
+        CurrentWeather.objects.create(id=1, temperature=60, weather_string="clear")
+        bars = [Bar.objects.create(name=f"Bar {i}") for i in range(20)]
+        tokens = [str(uuid.uuid4()) for _ in range(50)]
+        for token in tokens:
+            User.objects.create(username=token)
+
+        rows = [
+            (mode, run(mode, args.requests, bars, tokens))
+            for mode in ("eager", "thread", "request only")
+        ]
+    print(f"POST /submit_occupancy/ x {args.requests}")
+    print_latency_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Helpers shared by the scripts in this directory."""
+
+import os
+import sys
+from contextlib import contextmanager
+
+import django
+import numpy as np
+
+
+def setup_django():
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_config.settings")
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Run against a throwaway copy of the database, like manage.py test does."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def latency_summary(latencies_ms):
+    """p50 / p95 / p99 / mean of a list of latencies in milliseconds."""
+    latencies = np.asarray(latencies_ms)
+    return {
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "mean": float(latencies.mean()),
+    }
+
+
+def print_latency_table(rows):
+    """rows: list of (label, latency_summary dict)."""
+    print(f"{'':24}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for label, summary in rows:
+        print(
+            f"{label:24}{summary['p50']:10.2f}{summary['p99']:10.2f}"
+            f"{summary['mean']:10.2f}"
+        )
@@ -0,0 +1,302 @@
+"""
+Concurrent load test of the mobile API: GET /bars/, POST /submit_occupancy/
+and POST /is_near_bar/ in a mix close to what the app sends on a busy night.
+
+    # In process through Django's test client, against a throwaway database
+    # seeded by benchmarks/seed.py
+    python benchmarks/loadtest.py [--duration 30] [--concurrency 8] [--reports 1000000]
+
+    # Against a running server, e.g. gunicorn on a database seeded with
+    # `python benchmarks/seed.py --force`
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --metrics-token $METRICS_TOKEN
+
+Reports throughput, latency percentiles and DB queries per request for each
+endpoint. Queries come from the request metrics middleware, read in process or
+from /metrics. --save writes the results as JSON and --compare checks them
+against a saved run, exiting with status 1 when an endpoint regressed by more
+than --threshold.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import latency_summary, setup_django, test_database
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from app.metrics import registry  # noqa: E402
+from app.models import Bar  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from seed import seed  # noqa: E402
+
+# endpoint: (share of requests, view name in the request metrics)
+ENDPOINTS = {
+    "GET /bars/": (0.7, "get_bars"),
+    "POST /is_near_bar/": (0.2, "is_user_near_bar"),
+    "POST /submit_occupancy/": (0.1, "submit_occupancy"),
+}
+METRIC_LINE = re.compile(
+    r'^bar_tracker_request_db_queries_(sum|count)\{view="([^"]+)"\} (\S+)$'
+)
+
+
+def build_request(endpoint, rng, bar_ids, tokens):
+    """(method, path, json body or None, token) for one request."""
+    token = rng.choice(tokens)
+    if endpoint == "GET /bars/":
+        return "GET", "/bars/", None, token
+    if endpoint == "POST /is_near_bar/":
+        near_bar_id = rng.choice(bar_ids) if rng.random() < 0.7 else -1
+        return "POST", "/is_near_bar/", {"near_bar_id": near_bar_id}, token
+    return (
+        "POST",
+        "/submit_occupancy/",
+        {
+            "bar_id": rng.choice(bar_ids),
+            "occupancy_level": rng.randint(1, 10),
+            "line_wait": rng.randint(1, 10),
+        },
+        token,
+    )
+
+
+class InProcessTarget:
+    """Sends requests through the full middleware stack with the test client."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def send(self, method, path, body, token):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client()
+        if method == "GET":
+            response = client.get(path, HTTP_AUTHORIZATION=token)
+        else:
+            response = client.post(
+                path,
+                json.dumps(body),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=token,
+            )
+        return response.status_code
+
+    def query_totals(self):
+        return parse_query_totals(registry.render())
+
+    def close_thread(self):
+        connection.close()
+
+
+class HttpTarget:
+    """Sends requests to a running server."""
+
+    def __init__(self, url, metrics_token):
+        self.url = url.rstrip("/")
+        self.metrics_token = metrics_token
+
+    def send(self, method, path, body, token):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.url + path,
+            data=data,
+            method=method,
+            headers={"Authorization": token, "Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def query_totals(self):
+        request = urllib.request.Request(
+            self.url + "/metrics",
+            headers={"Authorization": f"Bearer {self.metrics_token}"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return parse_query_totals(response.read().decode())
+        except urllib.error.URLError:
+            # Metrics not reachable, queries per request are left out
+            return {}
+
+    def close_thread(self):
+        pass
+
+
+def parse_query_totals(text):
+    """view -> [query sum, request count] from the Prometheus metrics text."""
+    totals = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, view, value = match.groups()
+            totals.setdefault(view, [0.0, 0.0])[kind == "count"] = float(value)
+    return totals
+
+
+def worker(target, deadline, bar_ids, tokens, rng_seed):
+    rng = random.Random(rng_seed)
+    endpoints = list(ENDPOINTS)
+    shares = [ENDPOINTS[endpoint][0] for endpoint in endpoints]
+    samples = []
+    try:
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, shares)[0]
+            request = build_request(endpoint, rng, bar_ids, tokens)
+            start = time.perf_counter()
+            status = target.send(*request)
+            samples.append((endpoint, (time.perf_counter() - start) * 1000, status))
+    finally:
+        target.close_thread()
+    return samples
+
+
+def run_load(target, bar_ids, tokens, duration, concurrency):
+    before = target.query_totals()
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(worker, target, deadline, bar_ids, tokens, seed)
+            for seed in range(concurrency)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - start
+    after = target.query_totals()
+
+    results = {}
+    for endpoint, (_, view) in ENDPOINTS.items():
+        latencies = [ms for name, ms, _ in samples if name == endpoint]
+        if not latencies:
+            continue
+        statuses = [status for name, _, status in samples if name == endpoint]
+        summary = latency_summary(latencies)
+        summary["requests"] = len(latencies)
+        summary["throughput"] = len(latencies) / elapsed
+        summary["errors"] = sum(status >= 500 for status in statuses)
+        summary["rejected"] = sum(400 <= status < 500 for status in statuses)
+        queries, count = (
+            after.get(view, [0, 0])[i] - before.get(view, [0, 0])[i] for i in (0, 1)
+        )
+        summary["queries_per_request"] = queries / count if count else None
+        results[endpoint] = summary
+    return {
+        "duration": elapsed,
+        "throughput": len(samples) / elapsed,
+        "endpoints": results,
+    }
+
+
+def print_results(results):
+    print(f"{len(ENDPOINTS)} endpoints, {results['throughput']:.1f} req/s total")
+    print(
+        f"{'':26}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'queries':>9}{'4xx':>7}{'5xx':>7}"
+    )
+    for endpoint, summary in results["endpoints"].items():
+        queries = summary["queries_per_request"]
+        queries = "-" if queries is None else f"{queries:.2f}"
+        print(
+            f"{endpoint:26}{summary['throughput']:9.1f}{summary['p50']:9.2f}"
+            f"{summary['p95']:9.2f}{summary['p99']:9.2f}{queries:>9}"
+            f"{summary['rejected']:7d}{summary['errors']:7d}"
+        )
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline, as printable lines."""
+    regressions = []
+    for endpoint, summary in results["endpoints"].items():
+        old = baseline["endpoints"].get(endpoint)
+        if old is None:
+            continue
+        if summary["p95"] > old["p95"] * (1 + threshold):
+            regressions.append(
+                f"{endpoint}: p95 {old['p95']:.2f} -> {summary['p95']:.2f} ms"
+            )
+        if summary["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{endpoint}: throughput {old['throughput']:.1f} -> "
+                f"{summary['throughput']:.1f} req/s"
+            )
+        new_queries, old_queries = (
+            summary["queries_per_request"],
+            old["queries_per_request"],
+        )
+        if (
+            new_queries is not None
+            and old_queries is not None
+            and new_queries > old_queries * (1 + threshold)
+        ):
+            regressions.append(
+                f"{endpoint}: queries per request {old_queries:.2f} -> {new_queries:.2f}"
+            )
+        if summary["errors"] > old["errors"]:
+            regressions.append(
+                f"{endpoint}: server errors {old['errors']} -> {summary['errors']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--url", help="Load a running server instead")
+    parser.add_argument("--metrics-token", default="")
+    parser.add_argument("--bars", type=int, default=300)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--reports", type=int, default=1_000_000)
+    parser.add_argument("--pipeline", default="eager", help="In process only")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file from --save")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.url:
+        target = HttpTarget(args.url, args.metrics_token)
+        # Pick bars and users from the database the server was seeded with
+        bar_ids = list(Bar.objects.filter(is_active=True).values_list("id", flat=True))
+        tokens = list(User.objects.values_list("username", flat=True)[:5000])
+        results = run_load(target, bar_ids, tokens, args.duration, args.concurrency)
+    else:
+        with test_database(), override_settings(REPORT_PIPELINE=args.pipeline):
+            start = time.perf_counter()
+            bar_ids, tokens = seed(args.bars, args.users, args.reports)
+            print(f"Seeded in {time.perf_counter() - start:.1f}s")
+            registry.clear()
+            results = run_load(
+                InProcessTarget(), bar_ids, tokens, args.duration, args.concurrency
+            )
+            connection.close()
+
+    results["config"] = vars(args)
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
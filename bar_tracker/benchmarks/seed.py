@@ -0,0 +1,184 @@
+"""
+Seeds a realistic dataset for the load tests: bars whose popularity follows a
+power law, device token users, and reports that pile up on Thursday to
+Saturday nights between 10pm and 2am, with a slice in the last hour so the
+live paths (displayed values, fraud window, cooldowns) have data.
+
+    python benchmarks/seed.py --force [--bars 300] [--users 20000] [--reports 1000000]
+
+This writes into whatever DATABASE_URL points at, hence --force.
+benchmarks/loadtest.py calls seed() on a throwaway test database instead.
+"""
+
+import argparse
+import csv
+import io
+import time
+import uuid
+from datetime import timedelta
+
+import numpy as np
+
+from common import setup_django
+
+if __name__ == "__main__":
+    setup_django()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils.timezone import now  # noqa: E402
+from app.models import Bar, OccupancyReport, UserProfile  # noqa: E402
+from app.utils import fold_reports_into_bar  # noqa: E402
+
+# Around downtown Charlottesville
+CENTER = (38.0336, -78.5080)
+# Relative report volume by weekday, Monday first
+WEEKDAY_WEIGHTS = np.array([0.4, 0.4, 0.6, 1.5, 3.0, 3.5, 0.8])
+COPY_CHUNK = 200_000
+COPY_COLUMNS = (
+    "bar_id",
+    "user",
+    "timestamp",
+    "flagged",
+    "occupancy_level",
+    "line_wait",
+    "temperature",
+    "weather",
+    "closed_event",
+)
+
+
+def power_law_weights(count, exponent):
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def seed_bars(rng, count):
+    latitudes = CENTER[0] + rng.uniform(-0.03, 0.03, count)
+    longitudes = CENTER[1] + rng.uniform(-0.03, 0.03, count)
+    bars = Bar.objects.bulk_create(
+        Bar(name=f"Bench Bar {i}", latitude=lat, longitude=lon)
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+    )
+    return np.array([bar.id for bar in bars])
+
+
+def seed_users(rng, count, batch_size=5000):
+    tokens = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(count)]
+    for start in range(0, count, batch_size):
+        users = User.objects.bulk_create(
+            User(username=token, password="!")
+            for token in tokens[start : start + batch_size]
+        )
+        # bulk_create skips the signal that creates profiles
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+    return tokens
+
+
+def report_timestamps(rng, count, weeks, live_fraction, current_time):
+    """Night-skewed timestamps over the last `weeks` weeks plus a live slice."""
+    live = int(count * live_fraction)
+    history = count - live
+
+    today = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = np.array([today - timedelta(days=d) for d in range(1, weeks * 7 + 1)])
+    day_weights = WEEKDAY_WEIGHTS[[day.weekday() for day in days]]
+    day_index = rng.choice(len(days), history, p=day_weights / day_weights.sum())
+    # Minutes after midnight, centered on 11:30pm, spilling past midnight
+    minutes = rng.normal(23.5 * 60, 90, history).clip(17 * 60, 28 * 60)
+    history_times = [
+        days[d] + timedelta(minutes=float(m)) for d, m in zip(day_index, minutes)
+    ]
+    live_times = [
+        current_time - timedelta(seconds=float(s)) for s in rng.uniform(0, 3600, live)
+    ]
+    return history_times + live_times
+
+
+def seed_reports(rng, bar_ids, tokens, count, weeks, live_fraction):
+    current_time = now()
+    bar_index = rng.choice(len(bar_ids), count, p=power_law_weights(len(bar_ids), 1.1))
+    user_index = rng.choice(len(tokens), count, p=power_law_weights(len(tokens), 0.5))
+    timestamps = report_timestamps(rng, count, weeks, live_fraction, current_time)
+
+    # Busier bars are fuller, everyone is fuller around midnight
+    base = 3 + 4 * (1 - bar_index / len(bar_ids))
+    occupancy = (base + rng.normal(0, 1.5, count)).round().clip(1, 10).astype(int)
+    line = (occupancy - 2 + rng.normal(0, 1.5, count)).round().clip(1, 10).astype(int)
+    flagged = rng.random(count) < 0.01
+    temperature = rng.normal(55, 12, count).round().astype(int)
+
+    # "user" is a reserved word
+    quoted_columns = ", ".join(f'"{column}"' for column in COPY_COLUMNS)
+    with connection.cursor() as cursor:
+        for start in range(0, count, COPY_CHUNK):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for i in range(start, min(start + COPY_CHUNK, count)):
+                writer.writerow(
+                    (
+                        bar_ids[bar_index[i]],
+                        tokens[user_index[i]],
+                        timestamps[i].isoformat(),
+                        "t" if flagged[i] else "f",
+                        occupancy[i],
+                        line[i],
+                        temperature[i],
+                        "clear",
+                        "f",
+                    )
+                )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {OccupancyReport._meta.db_table} ({quoted_columns}) "
+                "FROM STDIN WITH CSV",
+                buffer,
+            )
+        cursor.execute(f"ANALYZE {OccupancyReport._meta.db_table}")
+
+
+def fold_live_reports():
+    """Bring every bar's decayed aggregates up to date with the live slice."""
+    recent = OccupancyReport.objects.filter(
+        timestamp__gte=now() - timedelta(hours=1), flagged=False
+    )
+    reports_by_bar = {}
+    for report in recent:
+        reports_by_bar.setdefault(report.bar_id, []).append(report)
+    for bar_id, reports in reports_by_bar.items():
+        fold_reports_into_bar(bar_id, reports, trust_weights={})
+
+
+def seed(
+    bars=300, users=20000, reports=1_000_000, weeks=8, live_fraction=0.005, rng_seed=0
+):
+    """Seed the dataset and return (bar ids, user tokens)."""
+    rng = np.random.default_rng(rng_seed)
+    bar_ids = seed_bars(rng, bars)
+    tokens = seed_users(rng, users)
+    seed_reports(rng, bar_ids, tokens, reports, weeks, live_fraction)
+    fold_live_reports()
+    return [int(bar_id) for bar_id in bar_ids], tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bars", type=int, default=300)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--reports", type=int, default=1_000_000)
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    if not args.force:
+        parser.error("this writes into the configured database, pass --force")
+
+    start = time.perf_counter()
+    seed(args.bars, args.users, args.reports, args.weeks)
+    print(
+        f"Seeded {args.bars} bars, {args.users} users and {args.reports} reports "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()